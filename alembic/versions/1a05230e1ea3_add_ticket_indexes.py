@@ -0,0 +1,42 @@
+"""add ticket indexes
+
+Revision ID: 1a05230e1ea3
+Revises: 0fe41da599e1
+Create Date: 2026-10-18 10:12:41.318024
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1a05230e1ea3'
+down_revision: Union[str, None] = '0fe41da599e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Build the indexes concurrently so the tickets table stays writable on large installs
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tickets_created_at_id', 'tickets', ['created_at', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_tickets_pending', 'tickets', ['created_at'],
+                        postgresql_where=sa.text("status = 'submitted'"), postgresql_concurrently=True)
+        op.create_index('ix_tickets_status_created_at', 'tickets', ['status', 'created_at', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_tickets_category_created_at', 'tickets', ['category', 'created_at', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_tickets_priority_created_at', 'tickets', ['priority', 'created_at', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tickets_priority_created_at', table_name='tickets', postgresql_concurrently=True)
+        op.drop_index('ix_tickets_category_created_at', table_name='tickets', postgresql_concurrently=True)
+        op.drop_index('ix_tickets_status_created_at', table_name='tickets', postgresql_concurrently=True)
+        op.drop_index('ix_tickets_pending', table_name='tickets', postgresql_concurrently=True)
+        op.drop_index('ix_tickets_created_at_id', table_name='tickets', postgresql_concurrently=True)
@@ -0,0 +1,42 @@
+"""add ticket processing runs
+
+Revision ID: 3f7a9c1d2e60
+Revises: 8d41f6a2c3b7
+Create Date: 2026-10-18 14:05:12.502931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7a9c1d2e60'
+down_revision: Union[str, None] = '8d41f6a2c3b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ticket_processing_runs',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('ticket_id', sa.UUID(), nullable=False),
+        sa.Column('enqueued_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('duration_ms', sa.Integer(), nullable=False),
+        sa.Column('outcome', sa.String(length=16), nullable=False),
+        sa.Column('stages', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.ForeignKeyConstraint(['ticket_id'], ['tickets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ticket_processing_runs_ticket_id_started_at', 'ticket_processing_runs',
+                    ['ticket_id', 'started_at'], unique=False)
+    op.create_index('ix_ticket_processing_runs_started_at', 'ticket_processing_runs', ['started_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ticket_processing_runs_started_at', table_name='ticket_processing_runs')
+    op.drop_index('ix_ticket_processing_runs_ticket_id_started_at', table_name='ticket_processing_runs')
+    op.drop_table('ticket_processing_runs')
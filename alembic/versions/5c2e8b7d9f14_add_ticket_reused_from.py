@@ -0,0 +1,29 @@
+"""add ticket reused_from_ticket_id
+
+Revision ID: 5c2e8b7d9f14
+Revises: 1a05230e1ea3
+Create Date: 2026-10-18 11:02:17.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e8b7d9f14'
+down_revision: Union[str, None] = '1a05230e1ea3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column('reused_from_ticket_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key('fk_tickets_reused_from_ticket_id', 'tickets', 'tickets',
+                          ['reused_from_ticket_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    op.drop_constraint('fk_tickets_reused_from_ticket_id', 'tickets', type_='foreignkey')
+    op.drop_column('tickets', 'reused_from_ticket_id')
@@ -0,0 +1,27 @@
+"""add ticket token usage
+
+Revision ID: 8d41f6a2c3b7
+Revises: 5c2e8b7d9f14
+Create Date: 2026-10-18 12:20:45.118302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41f6a2c3b7'
+down_revision: Union[str, None] = '5c2e8b7d9f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column('input_tokens', sa.Integer(), nullable=True))
+    op.add_column('tickets', sa.Column('output_tokens', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('tickets', 'output_tokens')
+    op.drop_column('tickets', 'input_tokens')
@@ -0,0 +1,27 @@
+"""add ticket labels_source
+
+Revision ID: a7c3e9f1d5b2
+Revises: f3b7d1a9c2e4
+Create Date: 2026-10-19 10:41:07.652913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9f1d5b2'
+down_revision: Union[str, None] = 'f3b7d1a9c2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column('labels_source', sa.String(length=16), nullable=True))
+    # Earlier tickets cannot tell AI and local labels apart, only reused ones are known
+    op.execute("UPDATE tickets SET labels_source = 'reused' WHERE reused_from_ticket_id IS NOT NULL")
+
+
+def downgrade() -> None:
+    op.drop_column('tickets', 'labels_source')
@@ -0,0 +1,116 @@
+"""add ticket stats hourly
+
+Revision ID: b6e1d0c4a9f2
+Revises: 3f7a9c1d2e60
+Create Date: 2026-10-18 15:32:08.114520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e1d0c4a9f2'
+down_revision: Union[str, None] = '3f7a9c1d2e60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Contribution of a set of ticket rows to the hourly rollup, added (sign 1) or removed (sign -1)
+CHANGES = """
+    SELECT date_trunc('hour', created_at) AS bucket, status::text AS status,
+           coalesce(category::text, '') AS category, coalesce(priority::text, '') AS priority, {sign} AS sign,
+           category_confidence, priority_confidence,
+           extract(epoch FROM processed_at - created_at) AS processing_seconds
+    FROM {rows}
+"""
+
+UPSERT = """
+    INSERT INTO ticket_stats_hourly AS stats
+    SELECT * FROM (
+        SELECT bucket, status, category, priority,
+               sum(sign) AS tickets,
+               coalesce(sum(sign * category_confidence), 0) AS category_confidence_sum,
+               coalesce(sum(sign) FILTER (WHERE category_confidence IS NOT NULL), 0) AS category_confidence_count,
+               coalesce(sum(sign * priority_confidence), 0) AS priority_confidence_sum,
+               coalesce(sum(sign) FILTER (WHERE priority_confidence IS NOT NULL), 0) AS priority_confidence_count,
+               coalesce(sum(sign * processing_seconds), 0) AS processing_seconds_sum,
+               coalesce(sum(sign) FILTER (WHERE processing_seconds IS NOT NULL), 0) AS processed_count
+        FROM ({changes}) AS changes
+        GROUP BY bucket, status, category, priority
+    ) AS delta
+    -- Updates that do not touch the counted columns cancel out
+    WHERE (tickets, category_confidence_sum, category_confidence_count, priority_confidence_sum,
+           priority_confidence_count, processing_seconds_sum, processed_count) <> (0, 0, 0, 0, 0, 0, 0)
+    -- Concurrent statements lock the rollup rows in the same order
+    ORDER BY bucket, status, category, priority
+    ON CONFLICT (bucket, status, category, priority) DO UPDATE SET
+        tickets = stats.tickets + excluded.tickets,
+        category_confidence_sum = stats.category_confidence_sum + excluded.category_confidence_sum,
+        category_confidence_count = stats.category_confidence_count + excluded.category_confidence_count,
+        priority_confidence_sum = stats.priority_confidence_sum + excluded.priority_confidence_sum,
+        priority_confidence_count = stats.priority_confidence_count + excluded.priority_confidence_count,
+        processing_seconds_sum = stats.processing_seconds_sum + excluded.processing_seconds_sum,
+        processed_count = stats.processed_count + excluded.processed_count;
+"""
+
+
+def _upsert(*sources) -> str:
+    changes = " UNION ALL ".join(CHANGES.format(sign=sign, rows=rows) for sign, rows in sources)
+    return UPSERT.format(changes=changes)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ticket_stats_hourly',
+        sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('status', sa.String(length=32), nullable=False),
+        sa.Column('category', sa.String(length=32), nullable=False),
+        sa.Column('priority', sa.String(length=32), nullable=False),
+        sa.Column('tickets', sa.BigInteger(), nullable=False),
+        sa.Column('category_confidence_sum', sa.Float(), nullable=False),
+        sa.Column('category_confidence_count', sa.BigInteger(), nullable=False),
+        sa.Column('priority_confidence_sum', sa.Float(), nullable=False),
+        sa.Column('priority_confidence_count', sa.BigInteger(), nullable=False),
+        sa.Column('processing_seconds_sum', sa.Float(), nullable=False),
+        sa.Column('processed_count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket', 'status', 'category', 'priority')
+    )
+    # Statement-level triggers see every changed row at once through the transition tables, so a bulk COPY
+    # or UPDATE costs one upsert per affected rollup row instead of one per ticket
+    op.execute(f"""
+        CREATE FUNCTION ticket_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {_upsert((1, 'new_rows'))}
+            ELSIF TG_OP = 'UPDATE' THEN
+                {_upsert((1, 'new_rows'), (-1, 'old_rows'))}
+            ELSE
+                {_upsert((-1, 'old_rows'))}
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER ticket_stats_insert AFTER INSERT ON tickets
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER ticket_stats_update AFTER UPDATE ON tickets
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER ticket_stats_delete AFTER DELETE ON tickets
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_apply()
+    """)
+    # Backfill the existing tickets
+    op.execute(_upsert((1, 'tickets')))
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER ticket_stats_delete ON tickets")
+    op.execute("DROP TRIGGER ticket_stats_update ON tickets")
+    op.execute("DROP TRIGGER ticket_stats_insert ON tickets")
+    op.execute("DROP FUNCTION ticket_stats_apply()")
+    op.drop_table('ticket_stats_hourly')
@@ -0,0 +1,37 @@
+"""add ticket search vector
+
+Revision ID: c4f8a2e7d1b3
+Revises: b6e1d0c4a9f2
+Create Date: 2026-10-18 16:47:51.203664
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f8a2e7d1b3'
+down_revision: Union[str, None] = 'b6e1d0c4a9f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR = ("setweight(to_tsvector('english', subject), 'A') || "
+                 "setweight(to_tsvector('english', body), 'B') || "
+                 "setweight(to_tsvector('english', coalesce(initial_response, '')), 'C')")
+
+
+def upgrade() -> None:
+    # Adding a stored generated column rewrites the tickets table under an exclusive lock
+    op.add_column('tickets', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                       sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tickets_search_vector', 'tickets', ['search_vector'], postgresql_using='gin',
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tickets_search_vector', table_name='tickets', postgresql_concurrently=True)
+    op.drop_column('tickets', 'search_vector')
@@ -0,0 +1,28 @@
+"""add ticket reused_from_ticket_id index
+
+Revision ID: d9e4b2f6a8c1
+Revises: a7c3e9f1d5b2
+Create Date: 2026-10-19 11:05:22.190474
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e4b2f6a8c1'
+down_revision: Union[str, None] = 'a7c3e9f1d5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tickets_reused_from_ticket_id', 'tickets', ['reused_from_ticket_id'],
+                        postgresql_where=sa.text('reused_from_ticket_id IS NOT NULL'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tickets_reused_from_ticket_id', table_name='tickets', postgresql_concurrently=True)
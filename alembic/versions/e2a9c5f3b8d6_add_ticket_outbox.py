@@ -0,0 +1,33 @@
+"""add ticket outbox
+
+Revision ID: e2a9c5f3b8d6
+Revises: c4f8a2e7d1b3
+Create Date: 2026-10-18 18:21:40.816372
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9c5f3b8d6'
+down_revision: Union[str, None] = 'c4f8a2e7d1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The relay keeps the table close to empty, so ticket_id needs no index for the cascading deletes
+    op.create_table(
+        'ticket_outbox',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('ticket_id', sa.UUID(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['ticket_id'], ['tickets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ticket_outbox')
@@ -0,0 +1,26 @@
+"""add ticket failed_stages
+
+Revision ID: f3b7d1a9c2e4
+Revises: e2a9c5f3b8d6
+Create Date: 2026-10-19 09:12:33.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b7d1a9c2e4'
+down_revision: Union[str, None] = 'e2a9c5f3b8d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column('failed_stages', postgresql.ARRAY(sa.String(length=16)), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('tickets', 'failed_stages')
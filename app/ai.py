@@ -1,126 +1,322 @@
 import json
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
 import anthropic
+import httpx
 import openai
 from openai import AsyncOpenAI
 
+from app.cache import validated_completions
 from app.config import Config
-from app.decorators import log
+from app.decorators import cached, cached_stream, instrumented, instrumented_stream
+from app.metrics import record_tokens
+from app.prompts import fit_body, max_tokens_for, record_usage
+from app.ratelimit import estimate_tokens, get_rate_limiter
 from app.schemas import TicketCategory, TicketPriority
 
 
 class AIModel(ABC):
+    provider: str
+    # Client errors other than API status errors that are worth retrying
+    retry_on: tuple = ()
+    # Whether the model acquires the provider concurrency limits itself instead of leaving it to the caller
+    limits_concurrency: bool = False
+
+    def _max_retries(self, default: int) -> int:
+        # The rate limiter does the retrying when enabled, the SDK's own retries would ignore its limits
+        return 0 if get_rate_limiter(self.provider) else default
+
+    async def warm_up(self):
+        """
+        Open a connection to the provider ahead of the first real request.
+        """
+
+    def _record_usage(self, input_tokens: Optional[int], output_tokens: Optional[int]):
+        record_usage(input_tokens, output_tokens, self.provider, self.model)
+        record_tokens(self.provider, self.model, input_tokens, output_tokens)
+
+    async def _request(self, call: Callable[[], Awaitable], system_prompt: str, user_prompt: str, max_tokens: int):
+        """
+        Make a raw-response API call through the provider's rate limiter and return the parsed response.
+        """
+        limiter = get_rate_limiter(self.provider)
+        if limiter is None:
+            response = await call()
+        else:
+            response = await limiter.run(call, estimate_tokens(system_prompt, user_prompt, max_tokens), self.retry_on)
+        # Parsing a raw SDK response is synchronous; streamed bodies are only read while iterating
+        return response.parse()
+
     @abstractmethod
     async def get_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
         pass
 
+    @abstractmethod
+    def stream_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """
+        Yield the completion text in chunks as the provider generates it.
+        """
+
 
 class OpenAIModel(AIModel):
+    provider = "openai"
+    retry_on = (openai.APIConnectionError,)
+
     def __init__(self, model: str = "gpt-3.5-turbo"):
         self.api_key = Config.OPENAI_API_KEY
-        self.client = AsyncOpenAI()
+        self.client = AsyncOpenAI(max_retries=self._max_retries(openai.DEFAULT_MAX_RETRIES))
 
         if not self.api_key:
             raise ValueError("OpenAI API key is missing")
         openai.api_key = self.api_key
         self.model = model
 
-    @log
+    @cached
+    @instrumented
     async def get_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
-        completion = await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=max_tokens
+        completion = await self._request(
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens
+            ),
+            system_prompt, user_prompt, max_tokens
         )
+        if completion.usage:
+            self._record_usage(completion.usage.prompt_tokens, completion.usage.completion_tokens)
         return completion.choices[0].message.content
 
+    @cached_stream
+    @instrumented_stream
+    async def stream_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        stream = await self._request(
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            ),
+            system_prompt, user_prompt, max_tokens
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                self._record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def warm_up(self):
+        await self.client.models.list()
+
 
 class AnthropicModel(AIModel):
+    provider = "anthropic"
+    retry_on = (anthropic.APIConnectionError,)
+
     def __init__(self, model: str = "claude-3-5-sonnet-20240620"):
         self.api_key = Config.ANTHROPIC_API_KEY
         if not self.api_key:
             raise ValueError("Anthropic API key is missing")
-        self.client = anthropic.AsyncAnthropic(api_key=self.api_key)
+        self.client = anthropic.AsyncAnthropic(api_key=self.api_key,
+                                               max_retries=self._max_retries(anthropic.DEFAULT_MAX_RETRIES))
         self.model = model
 
-    @log
+    @cached
+    @instrumented
     async def get_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
         messages = [
             {"role": "user", "content": user_prompt}
         ]
-        response = await self.client.messages.create(
-            model=self.model,
-            messages=messages,
-            system=system_prompt,
-            max_tokens=max_tokens
+        response = await self._request(
+            lambda: self.client.messages.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                system=system_prompt,
+                max_tokens=max_tokens
+            ),
+            system_prompt, user_prompt, max_tokens
         )
+        self._record_usage(response.usage.input_tokens, response.usage.output_tokens)
         return response.content[0].text
 
+    @cached_stream
+    @instrumented_stream
+    async def stream_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        messages = [
+            {"role": "user", "content": user_prompt}
+        ]
+        stream = await self._request(
+            lambda: self.client.messages.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                system=system_prompt,
+                max_tokens=max_tokens,
+                stream=True
+            ),
+            system_prompt, user_prompt, max_tokens
+        )
+        async for event in stream:
+            if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                yield event.delta.text
+            elif event.type == "message_start":
+                self._record_usage(event.message.usage.input_tokens, 0)
+            elif event.type == "message_delta":
+                self._record_usage(0, event.usage.output_tokens)
 
-openai_model = OpenAIModel()
-anthropic_model = AnthropicModel()
+    async def warm_up(self):
+        await self.client.get("/v1/models", cast_to=httpx.Response)
 
 
-async def categorize_ticket(model: AIModel, subject: str, body: str) -> (TicketCategory, float):
+def parse_category(response: str) -> (TicketCategory, float):
     """
-    Use the provided AI model to categorize the support ticket based on its content.
+    Parse a categorize completion into the category and its confidence.
     """
-    system_prompt = "You are an assistant that categorizes support tickets into predefined categories and returns a JSON object with the category and a confidence score."
-    user_prompt = f"Subject: {subject}\n\nBody: {body}\n\nCategories: [Account Access, Payment Issue, Feature Request, Technical Problem, Other]\n\nRespond with a JSON object like this: {{'category': 'Category Name', 'confidence': 0.95}}"
-
-    response = await model.get_completion(system_prompt, user_prompt, max_tokens=50)
-
     # Parse the JSON response
     try:
         response_json = json.loads(response)
         category = response_json.get('category')
         category_confidence = response_json.get('confidence')
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, AttributeError):
         raise ValueError(f"Invalid JSON format received: {response}")
 
     # Validate category
     try:
         category_enum = TicketCategory[category.replace(" ", "_").lower()]
-    except KeyError:
+    except (KeyError, AttributeError):
         raise ValueError(f"Invalid category received: {category}")
 
     return category_enum, category_confidence
 
 
-async def prioritize_ticket(model: AIModel, subject: str, body: str) -> (TicketPriority, float):
+async def categorize_ticket(model: AIModel, subject: str, body: str) -> (TicketCategory, float):
     """
-    Use the provided AI model to prioritize the support ticket based on its content.
+    Use the provided AI model to categorize the support ticket based on its content.
     """
-    system_prompt = "You are an assistant that prioritizes support tickets based on urgency and returns a JSON object with the priority and a confidence score."
-    user_prompt = f"Subject: {subject}\n\nBody: {body}\n\nPriorities: [Low, Medium, High, Critical]\n\nRespond with a JSON object like this: {{'priority': 'Priority Level', 'confidence': 0.90}}"
+    system_prompt = "You are an assistant that categorizes support tickets into predefined categories and returns a JSON object with the category and a confidence score."
+    user_prompt = f"Subject: {subject}\n\nBody: {fit_body(body, 'triage')}\n\nCategories: [Account Access, Payment Issue, Feature Request, Technical Problem, Other]\n\nRespond with a JSON object like this: {{'category': 'Category Name', 'confidence': 0.95}}"
+
+    with validated_completions(parse_category):
+        response = await model.get_completion(system_prompt, user_prompt, max_tokens=max_tokens_for('categorize'))
+    return parse_category(response)
 
-    response = await model.get_completion(system_prompt, user_prompt, max_tokens=50)
 
+def parse_priority(response: str) -> (TicketPriority, float):
+    """
+    Parse a prioritize completion into the priority and its confidence.
+    """
     # Parse the JSON response
     try:
         response_json = json.loads(response)
         priority = response_json.get('priority')
         priority_confidence = response_json.get('confidence')
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, AttributeError):
         raise ValueError(f"Invalid JSON format received: {response}")
 
     # Validate priority
     try:
         priority_enum = TicketPriority[priority.lower()]
-    except KeyError:
+    except (KeyError, AttributeError):
         raise ValueError(f"Invalid priority received: {priority}")
 
     return priority_enum, priority_confidence
 
 
-async def generate_response(model: AIModel, subject: str, body: str) -> str:
+async def prioritize_ticket(model: AIModel, subject: str, body: str) -> (TicketPriority, float):
     """
-    Use the provided AI model to generate an initial response for the support ticket based on its content.
+    Use the provided AI model to prioritize the support ticket based on its content.
+    """
+    system_prompt = "You are an assistant that prioritizes support tickets based on urgency and returns a JSON object with the priority and a confidence score."
+    user_prompt = f"Subject: {subject}\n\nBody: {fit_body(body, 'triage')}\n\nPriorities: [Low, Medium, High, Critical]\n\nRespond with a JSON object like this: {{'priority': 'Priority Level', 'confidence': 0.90}}"
+
+    with validated_completions(parse_priority):
+        response = await model.get_completion(system_prompt, user_prompt, max_tokens=max_tokens_for('prioritize'))
+    return parse_priority(response)
+
+
+TRIAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "category": {"type": "string", "enum": ["Account Access", "Payment Issue", "Feature Request", "Technical Problem", "Other"]},
+        "category_confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "priority": {"type": "string", "enum": ["Low", "Medium", "High"]},
+        "priority_confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["category", "category_confidence", "priority", "priority_confidence"],
+    "additionalProperties": False,
+}
+
+
+def _parse_confidence(response_json: dict, key: str) -> float:
+    confidence = response_json[key]
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+        raise ValueError(f"Invalid {key} received: {confidence}")
+    return float(confidence)
+
+
+def triage_prompts(subject: str, body: str) -> (str, str):
+    """
+    Return the system and user prompts of a combined triage completion.
+    """
+    system_prompt = (
+        "You are an assistant that triages support tickets. "
+        "You assign each ticket a category and a priority based on urgency, each with a confidence score between 0 and 1. "
+        "Respond only with a JSON object that validates against this JSON schema: " + json.dumps(TRIAGE_SCHEMA)
+    )
+    user_prompt = f"Subject: {subject}\n\nBody: {fit_body(body, 'triage')}"
+    return system_prompt, user_prompt
+
+
+def parse_triage(response: str) -> (TicketCategory, float, TicketPriority, float):
+    """
+    Parse a triage completion, which must match TRIAGE_SCHEMA exactly.
+    """
+    # Parse the JSON response
+    try:
+        response_json = json.loads(response)
+    except json.JSONDecodeError:
+        raise ValueError(f"Invalid JSON format received: {response}")
+    if not isinstance(response_json, dict) or set(response_json) != set(TRIAGE_SCHEMA["required"]):
+        raise ValueError(f"Response does not match the triage schema: {response}")
+
+    # Validate category and priority
+    category = response_json['category']
+    if category not in TRIAGE_SCHEMA["properties"]["category"]["enum"]:
+        raise ValueError(f"Invalid category received: {category}")
+    priority = response_json['priority']
+    if priority not in TRIAGE_SCHEMA["properties"]["priority"]["enum"]:
+        raise ValueError(f"Invalid priority received: {priority}")
+
+    return (
+        TicketCategory[category.replace(" ", "_").lower()],
+        _parse_confidence(response_json, 'category_confidence'),
+        TicketPriority[priority.lower()],
+        _parse_confidence(response_json, 'priority_confidence'),
+    )
+
+
+async def triage_ticket(model: AIModel, subject: str, body: str) -> (TicketCategory, float, TicketPriority, float):
+    """
+    Use the provided AI model to categorize and prioritize the support ticket in a single completion.
+    The response must match TRIAGE_SCHEMA exactly.
+    """
+    system_prompt, user_prompt = triage_prompts(subject, body)
+    with validated_completions(parse_triage):
+        response = await model.get_completion(system_prompt, user_prompt, max_tokens=max_tokens_for('triage'))
+    return parse_triage(response)
+
+
+def response_prompts(subject: str, body: str) -> (str, str):
+    """
+    Return the system and user prompts of an initial response completion.
     """
     system_prompt = (
         "You are an assistant that generates initial responses for support tickets. "
@@ -129,8 +325,26 @@ async def generate_response(model: AIModel, subject: str, body: str) -> str:
         "If additional information or action is needed from the customer, clearly state what is required. "
         "The response should be formatted in plain text, without JSON or code blocks."
     )
-    user_prompt = f"Subject: {subject}\n\nBody: {body}\n\nGenerate an initial response to the provided ticket."
+    user_prompt = f"Subject: {subject}\n\nBody: {fit_body(body, 'response')}\n\nGenerate an initial response to the provided ticket."
+    return system_prompt, user_prompt
+
+
+async def generate_response(model: AIModel, subject: str, body: str,
+                            on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                            category: Optional[TicketCategory] = None) -> str:
+    """
+    Use the provided AI model to generate an initial response for the support ticket based on its content.
+    When `on_delta` is given the response is streamed and every chunk is passed to it as it arrives.
+    The response length is bounded by the category's limit when the category is already known.
+    """
+    system_prompt, user_prompt = response_prompts(subject, body)
+    max_tokens = max_tokens_for('response', category)
 
-    response = await model.get_completion(system_prompt, user_prompt, max_tokens=4096)
+    if on_delta is None:
+        return await model.get_completion(system_prompt, user_prompt, max_tokens=max_tokens)
 
-    return response
+    chunks = []
+    async for delta in model.stream_completion(system_prompt, user_prompt, max_tokens=max_tokens):
+        chunks.append(delta)
+        await on_delta(delta)
+    return "".join(chunks)
@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+from app.ai import AIModel, parse_triage, response_prompts, triage_prompts
+from app.config import Config
+from app.crud import bulk_update_tickets, claim_unprocessed_tickets, get_tickets_for_processing
+from app.database import AsyncSessionLocal
+from app.models import TicketStatus
+from app.processing import finish_processing_run, record_enqueued, start_processing_run
+from app.prompts import max_tokens_for
+from app.redis_client import get_async_redis
+from app.registry import get_model
+from app.ticket_cache import invalidate_tickets
+
+logger = logging.getLogger(__name__)
+
+# Task and prompt builder of each request made per ticket
+BATCH_TASKS = (
+    ("triage", triage_prompts),
+    ("response", response_prompts),
+)
+
+# Chunks waiting for their batch jobs by chunk id, as JSON {"ticket_ids", "jobs": {task: batch id}, "deadline"}, so
+# that the jobs of a process that stopped while waiting can still be collected (`python -m app.batch --resume`)
+BATCH_CHUNKS_KEY = "batch:chunks"
+
+# Ids of the processing runs requested through `POST /process?mode=batch`, waiting for `python -m app.batch`
+BATCH_RUNS_KEY = "batch:runs"
+
+
+class BatchRequest(NamedTuple):
+    custom_id: str
+    system_prompt: str
+    user_prompt: str
+    max_tokens: int
+
+
+class BatchError(Exception):
+    """
+    A batch job ended without any results.
+    """
+
+
+class BatchBackend(ABC):
+    @abstractmethod
+    async def submit(self, requests: List[BatchRequest]) -> str:
+        """
+        Submit the requests as one batch job and return its id.
+        """
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Return None while the batch job is running, then the completion of each request by custom id
+        (None for the requests that failed).
+        """
+
+    @abstractmethod
+    async def cancel(self, batch_id: str) -> None:
+        """
+        Stop a running batch job.
+        """
+
+
+def openai_batch_jsonl(model: str, requests: List[BatchRequest]) -> bytes:
+    """
+    Pack requests into an OpenAI batch input file of chat completions.
+    """
+    lines = [
+        json.dumps({
+            "custom_id": request.custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "max_tokens": request.max_tokens,
+                "messages": [
+                    {"role": "system", "content": request.system_prompt},
+                    {"role": "user", "content": request.user_prompt},
+                ],
+            },
+        })
+        for request in requests
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def parse_openai_batch_output(output: str) -> Dict[str, Optional[str]]:
+    results = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if response.get("status_code") == 200:
+            results[entry["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        else:
+            results[entry["custom_id"]] = None
+    return results
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    OpenAI Batch API: a JSONL input file, processed within 24 hours at half the synchronous price.
+    """
+
+    def __init__(self, model: AIModel):
+        self.client = model.client
+        self.model = model.model
+
+    async def submit(self, requests: List[BatchRequest]) -> str:
+        input_file = await self.client.files.create(
+            file=("tickets.jsonl", openai_batch_jsonl(self.model, requests)), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        if not batch.output_file_id:
+            raise BatchError(f"OpenAI batch {batch_id} ended as {batch.status}")
+        # Expired and cancelled batches still return the results of the requests that completed
+        output = await self.client.files.content(batch.output_file_id)
+        return parse_openai_batch_output(output.text)
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.client.batches.cancel(batch_id)
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """
+    Anthropic Message Batches API, called through the client's raw endpoints since the SDK has no wrapper for it.
+    """
+
+    headers = {"anthropic-beta": "message-batches-2024-09-24"}
+
+    def __init__(self, model: AIModel):
+        self.client = model.client
+        self.model = model.model
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await getattr(self.client, method)(path, cast_to=httpx.Response, options={"headers": self.headers},
+                                                  **kwargs)
+
+    async def submit(self, requests: List[BatchRequest]) -> str:
+        body = {"requests": [
+            {
+                "custom_id": request.custom_id,
+                "params": {
+                    "model": self.model,
+                    "max_tokens": request.max_tokens,
+                    "system": request.system_prompt,
+                    "messages": [{"role": "user", "content": request.user_prompt}],
+                },
+            }
+            for request in requests
+        ]}
+        response = await self._request("post", "/v1/messages/batches", body=body)
+        return response.json()["id"]
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        batch = (await self._request("get", f"/v1/messages/batches/{batch_id}")).json()
+        if batch["processing_status"] != "ended":
+            return None
+        if not batch.get("results_url"):
+            raise BatchError(f"Anthropic batch {batch_id} ended without results")
+        output = await self._request("get", batch["results_url"])
+        results = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            result = entry["result"]
+            succeeded = result["type"] == "succeeded"
+            results[entry["custom_id"]] = result["message"]["content"][0]["text"] if succeeded else None
+        return results
+
+    async def cancel(self, batch_id: str) -> None:
+        await self._request("post", f"/v1/messages/batches/{batch_id}/cancel")
+
+
+def fake_completion(request: BatchRequest) -> str:
+    if request.custom_id.endswith(":triage"):
+        return json.dumps({"category": "Other", "category_confidence": 0.5,
+                           "priority": "Medium", "priority_confidence": 0.5})
+    return "Thank you for contacting us. We are looking into your request and will get back to you shortly."
+
+
+class FakeBatchBackend(BatchBackend):
+    """
+    Local stand-in for a provider batch API, speaking the OpenAI batch file formats.
+    A batch finishes after `polls_until_done` polls and every request is answered by `respond`.
+    """
+
+    def __init__(self, respond: Callable[[BatchRequest], Optional[str]] = fake_completion, polls_until_done: int = 1):
+        self.respond = respond
+        self.polls_until_done = polls_until_done
+        self.batches = {}
+
+    async def submit(self, requests: List[BatchRequest]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = [openai_batch_jsonl("fake", requests), self.polls_until_done]
+        return batch_id
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        batch = self.batches[batch_id]
+        if batch[1] > 0:
+            batch[1] -= 1
+            return None
+        lines = []
+        for line in batch[0].decode().splitlines():
+            entry = json.loads(line)
+            messages = entry["body"]["messages"]
+            completion = self.respond(BatchRequest(entry["custom_id"], messages[0]["content"],
+                                                   messages[1]["content"], entry["body"]["max_tokens"]))
+            response = ({"status_code": 200, "body": {"choices": [{"message": {"content": completion}}]}}
+                        if completion is not None else {"status_code": 500, "body": {}})
+            lines.append(json.dumps({"custom_id": entry["custom_id"], "response": response}))
+        return parse_openai_batch_output("\n".join(lines))
+
+    async def cancel(self, batch_id: str) -> None:
+        self.batches.pop(batch_id, None)
+
+
+BATCH_BACKENDS = {
+    "openai": OpenAIBatchBackend,
+    "anthropic": AnthropicBatchBackend,
+}
+
+_fake_backend = None
+
+
+def get_batch_backend(task: str) -> BatchBackend:
+    """
+    Return the batch backend of the provider configured for the task, or the fake one when BATCH_BACKEND is 'fake'.
+    """
+    global _fake_backend
+    if Config.BATCH_BACKEND == 'fake':
+        if _fake_backend is None:
+            _fake_backend = FakeBatchBackend()
+        return _fake_backend
+    provider = getattr(Config, f'{task.upper()}_PROVIDER')
+    return BATCH_BACKENDS[provider](get_model(provider, getattr(Config, f'{task.upper()}_MODEL')))
+
+
+def _ticket_updates(tickets: list, results: Dict[str, Optional[str]]) -> List[dict]:
+    """
+    Turn the batch results into ticket updates. Tickets missing a result are released back to 'submitted';
+    the 'partial' failure policy keeps whatever succeeded and records the missing stages for the next run.
+    """
+    updates = []
+    processed_at = datetime.utcnow()
+    for ticket in tickets:
+        update = {"id": ticket.id}
+        try:
+            triage = results.get(f"{ticket.id}:triage")
+            if triage is not None:
+                (update['category'], update['category_confidence'],
+                 update['priority'], update['priority_confidence']) = parse_triage(triage)
+                update['labels_source'] = 'ai'
+        except ValueError as e:
+            logger.warning(f"Invalid batch triage for ticket {ticket.id}: {e}")
+        response = results.get(f"{ticket.id}:response")
+        if response is not None:
+            update['initial_response'] = response
+
+        missing = [stage for stage, field in (('triage', 'category'), ('response', 'initial_response'))
+                   if field not in update]
+        if not missing:
+            update.update(status=TicketStatus.processed, processed_at=processed_at, failed_stages=None)
+        elif Config.PARTIAL_FAILURE_POLICY == 'partial' and len(update) > 1:
+            update.update(status=TicketStatus.submitted, failed_stages=missing)
+        else:
+            update = {"id": ticket.id, "status": TicketStatus.submitted}
+        updates.append(update)
+    return updates
+
+
+def _lease_key(chunk_id: str) -> str:
+    return f"batch:chunk:{chunk_id}:lease"
+
+
+def _lease_ttl() -> int:
+    # Renewed on every poll, so a chunk whose lease ran out has lost the process waiting for it
+    return int(3 * Config.BATCH_POLL_INTERVAL) + 60
+
+
+async def _save_chunk(chunk_id: str, ticket_ids: list, jobs: dict, deadline: float):
+    redis = get_async_redis()
+    state = {"ticket_ids": [str(ticket_id) for ticket_id in ticket_ids],
+             "jobs": {task: batch_id for task, (_, batch_id) in jobs.items()}, "deadline": deadline}
+    await redis.set(_lease_key(chunk_id), 1, ex=_lease_ttl())
+    await redis.hset(BATCH_CHUNKS_KEY, chunk_id, json.dumps(state))
+
+
+async def _drop_chunk(chunk_id: str):
+    redis = get_async_redis()
+    await redis.hdel(BATCH_CHUNKS_KEY, chunk_id)
+    await redis.delete(_lease_key(chunk_id))
+
+
+async def _cancel_jobs(jobs: dict):
+    for task, (backend, batch_id) in jobs.items():
+        try:
+            await backend.cancel(batch_id)
+            logger.info(f"Cancelled {task} batch {batch_id}")
+        except Exception:
+            logger.exception(f"Could not cancel {task} batch {batch_id}")
+
+
+async def _abandon_chunk(chunk_id: str, ticket_ids: list, jobs: dict):
+    """
+    Cancel the running batch jobs of a failed chunk and put its tickets back to 'submitted'.
+    The chunk is kept for --resume if its tickets cannot be released.
+    """
+    await _cancel_jobs(jobs)
+    try:
+        async with AsyncSessionLocal() as db:
+            await bulk_update_tickets(db, [{"id": ticket_id, "status": TicketStatus.submitted}
+                                           for ticket_id in ticket_ids])
+        await _drop_chunk(chunk_id)
+    except Exception:
+        logger.exception(f"Could not release the tickets of batch chunk {chunk_id}")
+
+
+async def _collect_chunk(chunk_id: str, tickets: list, jobs: dict, deadline: float) -> int:
+    """
+    Poll the batch jobs of a chunk until they end or the deadline passes, then write the results back in bulk.
+    Jobs still running at the deadline are cancelled. Returns the number of processed tickets.
+    """
+    results = {}
+    while jobs:
+        for task, (backend, batch_id) in list(jobs.items()):
+            try:
+                task_results = await backend.poll(batch_id)
+            except BatchError:
+                logger.exception(f"{task} batch {batch_id} failed")
+                task_results = {}
+            except Exception as e:
+                # Most likely transient; the job keeps running at the provider, so try again on the next poll
+                logger.warning(f"Polling {task} batch {batch_id} failed: {e!r}")
+                task_results = None
+            if task_results is not None:
+                results.update(task_results)
+                del jobs[task]
+        if jobs:
+            if time.time() > deadline:
+                logger.error(f"Gave up waiting for batches {[batch_id for _, batch_id in jobs.values()]}")
+                await _cancel_jobs(jobs)
+                jobs.clear()
+                break
+            await get_async_redis().expire(_lease_key(chunk_id), _lease_ttl())
+            await asyncio.sleep(Config.BATCH_POLL_INTERVAL)
+
+    updates = _ticket_updates(tickets, results)
+    async with AsyncSessionLocal() as db:
+        await bulk_update_tickets(db, updates)
+    await _drop_chunk(chunk_id)
+    processed = sum(update['status'] == TicketStatus.processed for update in updates)
+    logger.info(f"Batch processed {processed} of {len(tickets)} tickets")
+    return processed
+
+
+async def process_batch(ticket_ids: list) -> int:
+    """
+    Run the triage and response requests of claimed tickets as provider batch jobs, wait for them
+    and write the results back in bulk. Returns the number of processed tickets.
+    On failure the jobs are cancelled and the tickets go back to 'submitted' before the error is raised.
+    """
+    chunk_id = uuid.uuid4().hex
+    jobs = {}
+    try:
+        async with AsyncSessionLocal() as db:
+            tickets = await get_tickets_for_processing(db, ticket_ids)
+
+        for task, prompts in BATCH_TASKS:
+            backend = get_batch_backend(task)
+            max_tokens = max_tokens_for(task)
+            requests = [BatchRequest(f"{ticket.id}:{task}", *prompts(ticket.subject, ticket.body), max_tokens)
+                        for ticket in tickets]
+            jobs[task] = (backend, await backend.submit(requests))
+            logger.info(f"Submitted {task} batch {jobs[task][1]} for {len(requests)} tickets")
+
+        deadline = time.time() + Config.BATCH_TIMEOUT
+        await _save_chunk(chunk_id, ticket_ids, jobs, deadline)
+        return await _collect_chunk(chunk_id, tickets, jobs, deadline)
+    except Exception:
+        # A cancelled or interrupted process keeps its chunk and jobs for --resume instead
+        await _abandon_chunk(chunk_id, ticket_ids, jobs)
+        raise
+
+
+async def _resume_chunk(chunk_id: str, state: dict) -> int:
+    ticket_ids = [uuid.UUID(ticket_id) for ticket_id in state["ticket_ids"]]
+    jobs = {task: (get_batch_backend(task), batch_id) for task, batch_id in state["jobs"].items()}
+    logger.info(f"Resuming batch chunk {chunk_id} of {len(ticket_ids)} tickets")
+    try:
+        async with AsyncSessionLocal() as db:
+            tickets = await get_tickets_for_processing(db, ticket_ids)
+        return await _collect_chunk(chunk_id, tickets, jobs, state["deadline"])
+    except Exception:
+        await _abandon_chunk(chunk_id, ticket_ids, jobs)
+        raise
+
+
+async def resume_batches() -> int:
+    """
+    Collect the batch jobs of the chunks left behind by processes that stopped waiting for them,
+    i.e. whose lease ran out. Returns the number of processed tickets.
+    """
+    redis = get_async_redis()
+    resumed = []
+    for chunk_id, state in (await redis.hgetall(BATCH_CHUNKS_KEY)).items():
+        chunk_id = chunk_id.decode()
+        # Chunks still being collected by a running process keep their lease
+        if await redis.set(_lease_key(chunk_id), 1, nx=True, ex=_lease_ttl()):
+            resumed.append(_resume_chunk(chunk_id, json.loads(state)))
+    processed = 0
+    for outcome in await asyncio.gather(*resumed, return_exceptions=True):
+        if isinstance(outcome, BaseException):
+            logger.error("Resumed batch chunk failed", exc_info=outcome)
+        else:
+            processed += outcome
+    return processed
+
+
+async def run_batch_processing(run_id: str):
+    """
+    Claim all unprocessed tickets in chunks of BATCH_SIZE and process the chunks as concurrent batch jobs,
+    meant to run in the background. Progress is recorded under the processing run, which fails if any chunk does.
+    """
+    chunks = []
+    run_status = 'finished'
+    try:
+        async with AsyncSessionLocal() as db:
+            while True:
+                ticket_ids = await claim_unprocessed_tickets(db, Config.BATCH_SIZE)
+                if not ticket_ids:
+                    break
+                await db.commit()
+                # Each chunk is submitted as soon as it is claimed and releases its tickets if it fails
+                chunks.append(asyncio.ensure_future(process_batch(ticket_ids)))
+                await invalidate_tickets(ticket_ids)
+                await record_enqueued(run_id, len(ticket_ids))
+    except Exception:
+        logger.exception(f"Claiming tickets for batch processing run {run_id} failed")
+        run_status = 'failed'
+    for outcome in await asyncio.gather(*chunks, return_exceptions=True):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Batch chunk of processing run {run_id} failed", exc_info=outcome)
+            run_status = 'failed'
+    await finish_processing_run(run_id, run_status)
+
+
+async def queue_batch_run() -> str:
+    """
+    Register a batch processing run for `python -m app.batch` to pick up and return its tracking id.
+    The web process only queues the run: waiting for the batch jobs can take up to BATCH_TIMEOUT.
+    """
+    run_id = await start_processing_run(status='queued')
+    await get_async_redis().rpush(BATCH_RUNS_KEY, run_id)
+    return run_id
+
+
+async def _start(run_id: str):
+    await start_processing_run(run_id)
+    logger.info(f"Starting batch processing run {run_id}")
+    await run_batch_processing(run_id)
+
+
+async def _run(watch: bool):
+    redis = get_async_redis()
+    if watch:
+        while True:
+            _, run_id = await redis.blpop([BATCH_RUNS_KEY], timeout=0)
+            await _start(run_id.decode())
+    run_id = await redis.lpop(BATCH_RUNS_KEY)
+    if run_id is None:
+        # Nothing queued, start a run right away
+        await _start(str(uuid.uuid4()))
+    while run_id is not None:
+        await _start(run_id.decode())
+        run_id = await redis.lpop(BATCH_RUNS_KEY)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Process the unprocessed tickets through provider batch APIs.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Only collect the batch jobs left behind by processes that stopped waiting for them")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and start the batch runs queued through POST /process?mode=batch")
+    args = parser.parse_args()
+    if args.resume:
+        processed = asyncio.run(resume_batches())
+        logger.info(f"Resumed batches processed {processed} tickets")
+        return
+    asyncio.run(_run(args.watch))
+
+
+if __name__ == '__main__':
+    main()
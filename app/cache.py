@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from aiocache import RedisCache
+from aiocache.serializers import StringSerializer
+
+from app import metrics
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with per-entry expiry, bounded to max_size entries.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis cache shared by all web and worker processes.
+    Entries expire after their TTL, size-bounded eviction is left to the Redis maxmemory-policy (e.g. allkeys-lru).
+    """
+
+    def __init__(self, host: str, port: int, namespace: str = 'completion'):
+        self.host = host
+        self.port = port
+        self.namespace = namespace
+        # Redis connections are bound to the event loop they were opened on, so keep one client per loop
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self) -> RedisCache:
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop] = RedisCache(endpoint=self.host, port=self.port, namespace=self.namespace,
+                                             serializer=StringSerializer())
+        return self._clients[loop]
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client().get(key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self._client().set(key, value, ttl=ttl)
+
+
+# Check that completions must pass to be stored, for the completions made in the current context
+_validator: ContextVar[Optional[Callable[[str], object]]] = ContextVar('completion_validator', default=None)
+
+
+@contextlib.contextmanager
+def validated_completions(validate: Callable[[str], object]):
+    """
+    Only cache the completions made in this context that `validate` accepts, i.e. does not raise ValueError for,
+    so that an unparseable answer is asked for again instead of being served from the cache.
+    """
+    token = _validator.set(validate)
+    try:
+        yield
+    finally:
+        _validator.reset(token)
+
+
+def current_validator() -> Optional[Callable[[str], object]]:
+    return _validator.get()
+
+
+class _SharedCall:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class CompletionCache:
+    """
+    Content-addressed cache of AI completions.
+    Identical requests that are in flight at the same time share a single provider call.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._in_flight = {}
+
+    @staticmethod
+    def key(model: str, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+        payload = json.dumps([model, system_prompt, user_prompt, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "errors": self.errors}
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[str]],
+                          validate: Optional[Callable[[str], object]] = None) -> str:
+        """
+        Return the cached completion for the key, calling the provider and storing the result on a miss
+        if `validate` (when given) accepts it. The shared call is cancelled once every caller waiting for it
+        has been cancelled.
+        """
+        shared = self._in_flight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = _SharedCall(asyncio.ensure_future(self._load(key, call, validate)))
+            self._in_flight[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+        shared.waiters += 1
+        try:
+            # Shield the shared call so that one cancelled caller does not cancel it for the others
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if not shared.waiters and not shared.task.done():
+                # Timed out, hedged or failed callers would otherwise leave the provider call running
+                self._forget(key, shared)
+                shared.task.cancel()
+
+    def _forget(self, key: str, shared: "_SharedCall"):
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """
+        Return the cached completion for the key, or None on a miss or when the backend is unavailable.
+        """
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Completion cache lookup failed: {e!r}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def store(self, key: str, value: str) -> None:
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Completion cache store failed: {e!r}")
+
+    async def _load(self, key: str, call: Callable[[], Awaitable[str]],
+                    validate: Optional[Callable[[str], object]] = None) -> str:
+        value = await self.lookup(key)
+        if value is not None:
+            return value
+        value = await call()
+        if value is None:
+            return value
+        if validate is not None:
+            try:
+                validate(value)
+            except ValueError:
+                # Returned as it is for the caller to fail on, but not stored
+                return value
+        await self.store(key, value)
+        return value
+
+
+_completion_cache = None
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    Return the process-wide completion cache configured by COMPLETION_CACHE_BACKEND, or None when caching is off.
+    """
+    global _completion_cache
+    if _completion_cache is None and Config.COMPLETION_CACHE_BACKEND != 'none':
+        if Config.COMPLETION_CACHE_BACKEND == 'redis':
+            backend = RedisCacheBackend(Config.REDIS_HOST, Config.REDIS_PORT)
+        else:
+            backend = MemoryCacheBackend(Config.COMPLETION_CACHE_MAX_SIZE)
+        _completion_cache = CompletionCache(backend, Config.COMPLETION_CACHE_TTL)
+    return _completion_cache
+
+
+def _collect_cache_stats():
+    if _completion_cache is not None:
+        for result, count in _completion_cache.stats().items():
+            metrics.completion_cache_lookups.labels(result).set(count)
+
+
+metrics.REGISTRY.add_collector(_collect_cache_stats)
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.config import Config
+from app.database import AsyncSessionLocal
+from app.models import Ticket, TicketStatus
+from app.schemas import TicketCategory, TicketPriority
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = list(TicketCategory)
+PRIORITIES = list(TicketPriority)
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+class SparseRows:
+    """
+    Minimal CSR matrix: row i holds the values data[indptr[i]:indptr[i + 1]] at columns indices[...].
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, n_features: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_features = n_features
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.indptr) - 1
+
+    def _row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_rows), np.diff(self.indptr))
+
+    def take(self, rows: np.ndarray) -> 'SparseRows':
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseRows(indptr, self.indices[positions], self.data[positions], self.n_features)
+
+    def dot(self, weights: np.ndarray) -> np.ndarray:
+        """
+        X @ weights for a dense (n_features, k) matrix.
+        """
+        products = self.data[:, None] * weights[self.indices]
+        row_ids = self._row_ids()
+        return np.stack([np.bincount(row_ids, products[:, j], minlength=self.n_rows)
+                         for j in range(weights.shape[1])], axis=1)
+
+    def transpose_dot(self, values: np.ndarray) -> np.ndarray:
+        """
+        X.T @ values for a dense (n_rows, k) matrix.
+        """
+        contributions = self.data[:, None] * values[self._row_ids()]
+        return np.stack([np.bincount(self.indices, contributions[:, j], minlength=self.n_features)
+                         for j in range(values.shape[1])], axis=1)
+
+
+class HashingVectorizer:
+    """
+    Hashes word unigrams and bigrams (subject words get their own features) into a fixed-size feature space,
+    with log-scaled, L2-normalised counts.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18):
+        self.n_features = n_features
+
+    @staticmethod
+    def _grams(subject: str, body: str) -> List[str]:
+        subject_tokens = _TOKEN_RE.findall(subject.lower())
+        tokens = subject_tokens + _TOKEN_RE.findall(body.lower())
+        return (
+            tokens
+            + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            + [f"subject:{token}" for token in subject_tokens]
+        )
+
+    def transform(self, subjects: Sequence[str], bodies: Sequence[str]) -> SparseRows:
+        hashes, doc_ids = [], []
+        for doc_id, (subject, body) in enumerate(zip(subjects, bodies)):
+            grams = self._grams(subject, body)
+            hashes.extend(zlib.crc32(gram.encode()) for gram in grams)
+            doc_ids.extend([doc_id] * len(grams))
+
+        n_rows = len(subjects)
+        # Count each (document, feature) pair once; keys sort by document, then by feature
+        keys, counts = np.unique(
+            np.asarray(doc_ids, dtype=np.int64) * self.n_features
+            + np.asarray(hashes, dtype=np.int64) % self.n_features,
+            return_counts=True,
+        )
+        rows, indices = np.divmod(keys, self.n_features)
+        data = np.log1p(counts).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, data ** 2, minlength=n_rows))
+        data /= norms[rows]
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows))))
+        return SparseRows(indptr, indices, data, self.n_features)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LinearClassifier:
+    """
+    Multinomial logistic regression trained with mini-batch gradient descent.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray):
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def fit(cls, features: SparseRows, labels: np.ndarray, n_classes: int, epochs: int = 10,
+            learning_rate: float = 1.0, l2: float = 1e-6, batch_size: int = 256, seed: int = 0) -> 'LinearClassifier':
+        rng = np.random.default_rng(seed)
+        weights = np.zeros((features.n_features, n_classes), dtype=np.float32)
+        bias = np.zeros(n_classes, dtype=np.float32)
+        for _ in range(epochs):
+            order = rng.permutation(features.n_rows)
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                batch_features = features.take(batch)
+                gradient = _softmax(batch_features.dot(weights) + bias)
+                gradient[np.arange(len(batch)), labels[batch]] -= 1
+                gradient /= len(batch)
+                weights -= learning_rate * (batch_features.transpose_dot(gradient) + l2 * weights)
+                bias -= learning_rate * gradient.sum(axis=0)
+        return cls(weights, bias)
+
+    def predict_proba(self, features: SparseRows) -> np.ndarray:
+        return _softmax(features.dot(self.weights) + self.bias)
+
+
+class TicketClassifier:
+    """
+    Local category and priority classifier, scoring any number of tickets per call.
+    """
+
+    def __init__(self, vectorizer: HashingVectorizer, category_model: LinearClassifier,
+                 priority_model: LinearClassifier, version: str):
+        self.vectorizer = vectorizer
+        self.category_model = category_model
+        self.priority_model = priority_model
+        self.version = version
+
+    @classmethod
+    def train(cls, subjects: Sequence[str], bodies: Sequence[str], categories: Sequence[TicketCategory],
+              priorities: Sequence[TicketPriority], n_features: int = 2 ** 18, **fit_options) -> 'TicketClassifier':
+        vectorizer = HashingVectorizer(n_features)
+        features = vectorizer.transform(subjects, bodies)
+        category_labels = np.array([CATEGORIES.index(category) for category in categories])
+        priority_labels = np.array([PRIORITIES.index(priority) for priority in priorities])
+        return cls(
+            vectorizer,
+            LinearClassifier.fit(features, category_labels, len(CATEGORIES), **fit_options),
+            LinearClassifier.fit(features, priority_labels, len(PRIORITIES), **fit_options),
+            version=datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S'),
+        )
+
+    def predict_batch(self, subjects: Sequence[str],
+                      bodies: Sequence[str]) -> List[Tuple[TicketCategory, float, TicketPriority, float]]:
+        features = self.vectorizer.transform(subjects, bodies)
+        category_proba = self.category_model.predict_proba(features)
+        priority_proba = self.priority_model.predict_proba(features)
+        category_ids = category_proba.argmax(axis=1)
+        priority_ids = priority_proba.argmax(axis=1)
+        rows = np.arange(len(subjects))
+        return [
+            (CATEGORIES[category_id], float(category_confidence), PRIORITIES[priority_id], float(priority_confidence))
+            for category_id, category_confidence, priority_id, priority_confidence in zip(
+                category_ids, category_proba[rows, category_ids], priority_ids, priority_proba[rows, priority_ids])
+        ]
+
+    def save(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"ticket-classifier-{self.version}.npz")
+        np.savez_compressed(
+            path,
+            n_features=self.vectorizer.n_features,
+            category_weights=self.category_model.weights,
+            category_bias=self.category_model.bias,
+            priority_weights=self.priority_model.weights,
+            priority_bias=self.priority_model.bias,
+            labels=json.dumps({"categories": [c.value for c in CATEGORIES], "priorities": [p.value for p in PRIORITIES]}),
+        )
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'TicketClassifier':
+        with np.load(path) as data:
+            labels = json.loads(str(data['labels']))
+            if labels != {"categories": [c.value for c in CATEGORIES], "priorities": [p.value for p in PRIORITIES]}:
+                raise ValueError(f"Classifier {path} was trained for different labels: {labels}")
+            return cls(
+                HashingVectorizer(int(data['n_features'])),
+                LinearClassifier(data['category_weights'], data['category_bias']),
+                LinearClassifier(data['priority_weights'], data['priority_bias']),
+                version=os.path.basename(path)[len("ticket-classifier-"):-len(".npz")],
+            )
+
+
+def find_classifier(directory: str, version: Optional[str] = None) -> Optional[str]:
+    """
+    Return the path of the requested classifier version, or of the newest one when no version is given.
+    """
+    if version:
+        path = os.path.join(directory, f"ticket-classifier-{version}.npz")
+        return path if os.path.exists(path) else None
+    if not os.path.isdir(directory):
+        return None
+    versions = sorted(name for name in os.listdir(directory)
+                      if name.startswith("ticket-classifier-") and name.endswith(".npz"))
+    return os.path.join(directory, versions[-1]) if versions else None
+
+
+_classifier = None
+_classifier_loaded = False
+
+
+def get_classifier() -> Optional[TicketClassifier]:
+    """
+    Return the classifier of this process, loading it on first use, or None when none is available.
+    """
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        _classifier_loaded = True
+        path = find_classifier(Config.CLASSIFIER_DIR, Config.CLASSIFIER_VERSION) if Config.CLASSIFIER_ENABLED else None
+        if path:
+            _classifier = TicketClassifier.load(path)
+            logger.info(f"Loaded ticket classifier {_classifier.version}")
+    return _classifier
+
+
+async def _load_training_data(min_confidence: float):
+    query = (
+        select(Ticket.subject, Ticket.body, Ticket.category, Ticket.priority)
+        .filter(Ticket.status == TicketStatus.processed)
+        # Locally classified and reused tickets would only teach the classifier its own (or copied) labels
+        .filter(Ticket.labels_source == 'ai', Ticket.reused_from_ticket_id.is_(None))
+        .filter(Ticket.category_confidence >= min_confidence, Ticket.priority_confidence >= min_confidence)
+    )
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(query)
+        rows = result.all()
+    return (
+        [row.subject for row in rows],
+        [row.body for row in rows],
+        [TicketCategory(row.category.value) for row in rows],
+        [TicketPriority(row.priority.value) for row in rows],
+    )
+
+
+async def train(directory: str, min_confidence: float, holdout: float = 0.1) -> Optional[str]:
+    """
+    Train a classifier on the processed tickets, report its holdout accuracy and save it as a new version.
+    """
+    subjects, bodies, categories, priorities = await _load_training_data(min_confidence)
+    if not subjects:
+        logger.warning("No processed tickets to train on")
+        return None
+
+    order = np.random.default_rng(0).permutation(len(subjects))
+    n_test = int(len(order) * holdout)
+    test, training = order[:n_test], order[n_test:]
+    pick = lambda values, rows: [values[i] for i in rows]  # noqa: E731
+
+    classifier = TicketClassifier.train(pick(subjects, training), pick(bodies, training),
+                                        pick(categories, training), pick(priorities, training))
+    if n_test:
+        predictions = classifier.predict_batch(pick(subjects, test), pick(bodies, test))
+        category_hits = [p[0] == categories[i] for p, i in zip(predictions, test)]
+        priority_hits = [p[2] == priorities[i] for p, i in zip(predictions, test)]
+        confident = [p[1] >= Config.CLASSIFIER_THRESHOLD and p[3] >= Config.CLASSIFIER_THRESHOLD for p in predictions]
+        logger.info(f"Holdout accuracy: category {np.mean(category_hits):.3f}, priority {np.mean(priority_hits):.3f}, "
+                    f"{np.mean(confident):.1%} of tickets above the {Config.CLASSIFIER_THRESHOLD} threshold")
+
+    path = classifier.save(directory)
+    logger.info(f"Saved ticket classifier {classifier.version} trained on {len(training)} tickets to {path}")
+    return path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train the local ticket classifier from processed tickets.")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--directory", default=Config.CLASSIFIER_DIR)
+    parser.add_argument("--min-confidence", type=float, default=Config.CLASSIFIER_MIN_LABEL_CONFIDENCE,
+                        help="Only learn from tickets whose AI labels had at least this confidence")
+    args = parser.parse_args()
+    asyncio.run(train(args.directory, args.min_confidence))
+
+
+if __name__ == '__main__':
+    main()
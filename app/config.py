@@ -12,3 +12,154 @@ class Config:
     REDIS_PORT=os.environ.get('REDIS_PORT')
     OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY')
     ANTHROPIC_API_KEY=os.environ.get('ANTHROPIC_API_KEY')
+
+    # Database pool: 'queue' pools connections, 'null' opens one per session (PgBouncer, `rq worker`)
+    DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'queue')
+    # Pool profile of this process, 'web' or 'worker'
+    DB_POOL_PROFILE = os.environ.get('DB_POOL_PROFILE', 'web')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    WORKER_DB_POOL_SIZE = int(os.environ.get('WORKER_DB_POOL_SIZE', 10))
+    WORKER_DB_MAX_OVERFLOW = int(os.environ.get('WORKER_DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true') == 'true'
+
+    # Default and maximum page size of paged ticket listings and searches, and rows fetched per streaming round-trip
+    TICKETS_PAGE_SIZE = int(os.environ.get('TICKETS_PAGE_SIZE', 100))
+    TICKETS_MAX_PAGE_SIZE = int(os.environ.get('TICKETS_MAX_PAGE_SIZE', 1000))
+    TICKETS_STREAM_BATCH_SIZE = int(os.environ.get('TICKETS_STREAM_BATCH_SIZE', 500))
+
+    # Encode ticket lists and details straight from the selected columns instead of validating them through
+    # TicketResponse first; uses orjson when it is installed
+    FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', 'false') == 'true'
+
+    # Rows inserted per COPY by POST /tickets/bulk
+    BULK_INGEST_CHUNK_SIZE = int(os.environ.get('BULK_INGEST_CHUNK_SIZE', 1000))
+
+    # 'rq' enqueues RQ jobs for `rq worker`, 'async' pushes ticket ids to a Redis list consumed by app.worker
+    QUEUE_BACKEND = os.environ.get('QUEUE_BACKEND', 'rq')
+    TICKET_QUEUE_KEY = os.environ.get('TICKET_QUEUE_KEY', 'tickets:pending')
+    # New tickets are queued through the ticket_outbox table by a relay task in the web process, which polls it every
+    # OUTBOX_POLL_INTERVAL seconds besides being woken up by new tickets, and queues up to OUTBOX_BATCH_SIZE at a time
+    OUTBOX_RELAY_ENABLED = os.environ.get('OUTBOX_RELAY_ENABLED', 'true') == 'true'
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+
+    # Tickets claimed and enqueued per round-trip by POST /process, and how long a run's progress is kept
+    PROCESS_CHUNK_SIZE = int(os.environ.get('PROCESS_CHUNK_SIZE', 1000))
+    PROCESSING_RUN_TTL = int(os.environ.get('PROCESSING_RUN_TTL', 86400))
+
+    # Batch processing (POST /process?mode=batch): tickets are claimed BATCH_SIZE at a time and sent as provider
+    # batch jobs, polled every BATCH_POLL_INTERVAL seconds for up to BATCH_TIMEOUT. 'fake' answers them locally
+    BATCH_BACKEND = os.environ.get('BATCH_BACKEND', 'provider')
+    BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 10000))
+    BATCH_POLL_INTERVAL = float(os.environ.get('BATCH_POLL_INTERVAL', 60))
+    BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 90000))
+
+    # Async worker: tickets processed at once, ids pulled per Redis round-trip, seconds to block on an empty queue
+    WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 32))
+    WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', 16))
+    WORKER_POLL_TIMEOUT = int(os.environ.get('WORKER_POLL_TIMEOUT', 2))
+    # Attempts per ticket before the async worker gives up on it and puts it back to 'submitted'
+    WORKER_MAX_ATTEMPTS = int(os.environ.get('WORKER_MAX_ATTEMPTS', 3))
+
+    # Maximum number of concurrent in-flight requests per AI provider
+    OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 16))
+    ANTHROPIC_MAX_CONCURRENCY = int(os.environ.get('ANTHROPIC_MAX_CONCURRENCY', 16))
+
+    # Provider ('openai' or 'anthropic') and model of each AI task. The fallback model, when set, takes part in
+    # hedging and failover. Clients are created on first use; MODEL_WARM_UP opens their connections at worker start
+    TRIAGE_PROVIDER = os.environ.get('TRIAGE_PROVIDER', 'openai')
+    TRIAGE_MODEL = os.environ.get('TRIAGE_MODEL', 'gpt-3.5-turbo')
+    TRIAGE_FALLBACK_PROVIDER = os.environ.get('TRIAGE_FALLBACK_PROVIDER', 'anthropic')
+    TRIAGE_FALLBACK_MODEL = os.environ.get('TRIAGE_FALLBACK_MODEL', 'claude-3-5-sonnet-20240620')
+    RESPONSE_PROVIDER = os.environ.get('RESPONSE_PROVIDER', 'anthropic')
+    RESPONSE_MODEL = os.environ.get('RESPONSE_MODEL', 'claude-3-5-sonnet-20240620')
+    RESPONSE_FALLBACK_PROVIDER = os.environ.get('RESPONSE_FALLBACK_PROVIDER', 'openai')
+    RESPONSE_FALLBACK_MODEL = os.environ.get('RESPONSE_FALLBACK_MODEL', 'gpt-3.5-turbo')
+    MODEL_WARM_UP = os.environ.get('MODEL_WARM_UP', 'false') == 'true'
+
+    # Route each task to its primary model, hedging with the fallback when a call exceeds the primary's
+    # ROUTING_HEDGE_PERCENTILE latency and failing over while its error rate is above ROUTING_ERROR_THRESHOLD.
+    # Statistics cover the last ROUTING_WINDOW seconds and need ROUTING_MIN_SAMPLES calls to take effect
+    ROUTING_ENABLED = os.environ.get('ROUTING_ENABLED', 'true') == 'true'
+    ROUTING_HEDGE_PERCENTILE = float(os.environ.get('ROUTING_HEDGE_PERCENTILE', 95))
+    ROUTING_ERROR_THRESHOLD = float(os.environ.get('ROUTING_ERROR_THRESHOLD', 0.5))
+    ROUTING_WINDOW = float(os.environ.get('ROUTING_WINDOW', 300))
+    ROUTING_MIN_SAMPLES = int(os.environ.get('ROUTING_MIN_SAMPLES', 20))
+
+    # 'separate' categorizes and prioritizes in two completions, 'combined' triages in one
+    TRIAGE_MODE = os.environ.get('TRIAGE_MODE', 'separate')
+
+    # Stream the initial response through Redis while it is generated; finished streams are kept for RESPONSE_STREAM_TTL
+    STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', 'true') == 'true'
+    RESPONSE_STREAM_TTL = int(os.environ.get('RESPONSE_STREAM_TTL', 600))
+    # How long GET /ticket/{id}/response/stream waits for a response before giving up
+    RESPONSE_STREAM_TIMEOUT = int(os.environ.get('RESPONSE_STREAM_TIMEOUT', 300))
+
+    # Read-through Redis cache of the GET /ticket/{id} responses, invalidated whenever a ticket changes
+    TICKET_CACHE_ENABLED = os.environ.get('TICKET_CACHE_ENABLED', 'true') == 'true'
+    TICKET_CACHE_TTL = int(os.environ.get('TICKET_CACHE_TTL', 300))
+
+    # Token budgets of the ticket body in triage and response prompts; longer bodies keep their head and tail
+    TRIAGE_PROMPT_TOKEN_BUDGET = int(os.environ.get('TRIAGE_PROMPT_TOKEN_BUDGET', 1000))
+    RESPONSE_PROMPT_TOKEN_BUDGET = int(os.environ.get('RESPONSE_PROMPT_TOKEN_BUDGET', 3000))
+    # Response length, optionally per category as 'category=tokens,...' when the category is known in advance
+    RESPONSE_MAX_TOKENS = int(os.environ.get('RESPONSE_MAX_TOKENS', 1024))
+    RESPONSE_MAX_TOKENS_BY_CATEGORY = os.environ.get('RESPONSE_MAX_TOKENS_BY_CATEGORY',
+                                                     'technical_problem=1536,feature_request=512,other=768')
+
+    # Store a timing breakdown of every processing attempt in ticket_processing_runs
+    PROCESSING_TIMINGS_ENABLED = os.environ.get('PROCESSING_TIMINGS_ENABLED', 'true') == 'true'
+
+    # Per-stage timeouts (seconds) for ticket processing
+    CATEGORIZE_TIMEOUT = float(os.environ.get('CATEGORIZE_TIMEOUT', 30))
+    PRIORITIZE_TIMEOUT = float(os.environ.get('PRIORITIZE_TIMEOUT', 30))
+    TRIAGE_TIMEOUT = float(os.environ.get('TRIAGE_TIMEOUT', 30))
+    RESPONSE_TIMEOUT = float(os.environ.get('RESPONSE_TIMEOUT', 120))
+
+    # 'fail' aborts the ticket on the first failed stage, 'partial' stores whatever stages succeeded and leaves the
+    # ticket submitted with its failed_stages, so the next processing run only retries those
+    PARTIAL_FAILURE_POLICY = os.environ.get('PARTIAL_FAILURE_POLICY', 'fail')
+
+    # Completion cache, also used for streamed responses: 'redis' (shared by all processes), 'memory' (in-process LRU)
+    # or 'none'
+    COMPLETION_CACHE_BACKEND = os.environ.get('COMPLETION_CACHE_BACKEND', 'redis')
+    COMPLETION_CACHE_TTL = int(os.environ.get('COMPLETION_CACHE_TTL', 86400))
+    COMPLETION_CACHE_MAX_SIZE = int(os.environ.get('COMPLETION_CACHE_MAX_SIZE', 10000))
+
+    # Local pre-classifier: its predictions replace the AI triage stages at or above CLASSIFIER_THRESHOLD confidence.
+    # The newest version in CLASSIFIER_DIR is loaded unless CLASSIFIER_VERSION pins one
+    CLASSIFIER_ENABLED = os.environ.get('CLASSIFIER_ENABLED', 'true') == 'true'
+    CLASSIFIER_DIR = os.environ.get('CLASSIFIER_DIR', 'classifiers')
+    CLASSIFIER_VERSION = os.environ.get('CLASSIFIER_VERSION')
+    CLASSIFIER_THRESHOLD = float(os.environ.get('CLASSIFIER_THRESHOLD', 0.9))
+    # Only train on tickets whose AI labels had at least this confidence
+    CLASSIFIER_MIN_LABEL_CONFIDENCE = float(os.environ.get('CLASSIFIER_MIN_LABEL_CONFIDENCE', 0.7))
+
+    # Near-duplicate reuse: a ticket whose MinHash similarity to a recently processed one reaches DEDUP_THRESHOLD
+    # reuses its category, priority and response. DEDUP_NUM_PERM must be a multiple of DEDUP_BANDS
+    DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'false') == 'true'
+    DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.8))
+    DEDUP_NUM_PERM = int(os.environ.get('DEDUP_NUM_PERM', 128))
+    DEDUP_BANDS = int(os.environ.get('DEDUP_BANDS', 16))
+    DEDUP_TTL = int(os.environ.get('DEDUP_TTL', 86400))
+
+    # Client-side provider rate limits: 'redis' (shared by all processes), 'memory' (per process, so each process may
+    # use the whole quota; only for single-process setups) or 'none'.
+    # The per-minute limits are updated from the providers' rate-limit headers
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'redis')
+    OPENAI_RPM = float(os.environ.get('OPENAI_RPM', 500))
+    OPENAI_TPM = float(os.environ.get('OPENAI_TPM', 200000))
+    ANTHROPIC_RPM = float(os.environ.get('ANTHROPIC_RPM', 50))
+    ANTHROPIC_TPM = float(os.environ.get('ANTHROPIC_TPM', 40000))
+    # Seconds of quota that may be used in one burst
+    RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', 5))
+    RATE_LIMIT_MAX_RETRIES = int(os.environ.get('RATE_LIMIT_MAX_RETRIES', 5))
+
+    # Metrics: model prices in US dollars per million input:output tokens as 'model=input:output,...', the share of
+    # AI calls whose prompts and completions are logged (0 disables), and the async worker's /metrics port (0 disables)
+    MODEL_PRICES = os.environ.get('MODEL_PRICES', 'gpt-3.5-turbo=0.5:1.5,claude-3-5-sonnet-20240620=3:15')
+    PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', 0))
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
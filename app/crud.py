@@ -1,20 +1,30 @@
-from typing import List
+import base64
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence
+from uuid import UUID
 
+import asyncpg
 from fastapi import HTTPException
+from sqlalchemy import Integer, String, cast, column, delete, extract, func, insert, literal_column, true, tuple_, update
+from sqlalchemy.dialects.postgresql import JSONB, array
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.models import Ticket, TicketStatus
+from app.config import Config
+from app.models import SEARCH_CONFIG, Ticket, TicketOutbox, TicketProcessingRun, TicketStatsHourly, TicketStatus
 from app.schemas import TicketCreateRequest, TicketUpdateRequest
+from app.ticket_cache import invalidate_tickets
 
 
 async def create_ticket(db: AsyncSession, ticket_data: TicketCreateRequest) -> Ticket:
     """
-    Create a new ticket with the provided data.
+    Create a new ticket with the provided data, and its outbox entry in the same transaction.
     """
-    new_ticket = Ticket(**ticket_data.model_dump())
+    new_ticket = Ticket(id=uuid.uuid4(), **ticket_data.model_dump())
     db.add(new_ticket)
+    db.add(TicketOutbox(ticket_id=new_ticket.id))
     try:
         await db.commit()
         return new_ticket
@@ -23,6 +33,36 @@ async def create_ticket(db: AsyncSession, ticket_data: TicketCreateRequest) -> T
         raise HTTPException(status_code=400, detail=str(e))
 
 
+async def bulk_create_tickets(db: AsyncSession, tickets: Sequence[TicketCreateRequest]) -> List[UUID]:
+    """
+    Insert many tickets and their outbox entries in one transaction and return their IDs.
+    Uses COPY on asyncpg and falls back to a multi-row INSERT on other drivers.
+    """
+    rows = [dict(id=uuid.uuid4(), status=TicketStatus.submitted, **ticket.model_dump()) for ticket in tickets]
+    try:
+        connection = await db.connection()
+        driver_connection = (await connection.get_raw_connection()).driver_connection
+        if hasattr(driver_connection, 'copy_records_to_table'):
+            await driver_connection.copy_records_to_table(
+                Ticket.__tablename__,
+                columns=['id', 'subject', 'body', 'customer_email', 'status'],
+                records=[(row['id'], row['subject'], row['body'], row['customer_email'], row['status'].value)
+                         for row in rows],
+            )
+            await driver_connection.copy_records_to_table(
+                TicketOutbox.__tablename__, columns=['ticket_id'], records=[(row['id'],) for row in rows],
+            )
+        else:
+            await db.execute(insert(Ticket), rows)
+            await db.execute(insert(TicketOutbox), [dict(ticket_id=row['id']) for row in rows])
+        await db.commit()
+    except (SQLAlchemyError, asyncpg.PostgresError) as e:
+        # COPY goes through the driver connection directly, so its errors are not wrapped by SQLAlchemy
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    return [row['id'] for row in rows]
+
+
 async def get_ticket_by_id(db: AsyncSession, ticket_id: str) -> Ticket:
     """
     Retrieve a ticket by its ID.
@@ -35,20 +75,130 @@ async def get_ticket_by_id(db: AsyncSession, ticket_id: str) -> Ticket:
     return ticket
 
 
-async def get_all_tickets(db: AsyncSession, category: str = None, priority: str = None, status: str = None) -> list:
+async def get_ticket_row(db: AsyncSession, ticket_id: str, fields: Sequence[str]):
+    """
+    Retrieve the given columns of a ticket as a row, without loading the Ticket object.
+    """
+    query = select(*(getattr(Ticket, field) for field in fields)).filter(Ticket.id == ticket_id)
+    result = await db.execute(query)
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return row
+
+
+def encode_cursor(created_at: datetime, ticket_id: UUID) -> str:
     """
-    Retrieve all tickets with optional filters.
+    Encode the keyset position of a ticket into an opaque pagination cursor.
     """
-    query = select(Ticket)
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{ticket_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> (datetime, UUID):
+    """
+    Decode a pagination cursor produced by encode_cursor.
+    """
+    try:
+        created_at, ticket_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(ticket_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _tickets_query(category: str = None, priority: str = None, status: str = None, cursor: str = None,
+                   fields: Optional[Sequence[str]] = None):
+    """
+    Build the ticket list query in keyset order.
+    With `fields` only those columns are selected; 'id' and 'created_at' are always included for the keyset.
+    """
+    if fields:
+        query = select(*(getattr(Ticket, field) for field in dict.fromkeys(('id', 'created_at', *fields))))
+    else:
+        query = select(Ticket)
+    query = _filter_tickets(query, category, priority, status)
+    if cursor:
+        query = query.filter(tuple_(Ticket.created_at, Ticket.id) > tuple_(*decode_cursor(cursor)))
+    return query.order_by(Ticket.created_at, Ticket.id)
+
+
+def _filter_tickets(query, category: str = None, priority: str = None, status: str = None):
     if category:
         query = query.filter(Ticket.category == category)
     if priority:
         query = query.filter(Ticket.priority == priority)
     if status:
         query = query.filter(Ticket.status == status)
+    return query
+
+
+async def get_all_tickets(db: AsyncSession, category: str = None, priority: str = None, status: str = None,
+                          limit: int = None, cursor: str = None, fields: Optional[Sequence[str]] = None) -> list:
+    """
+    Retrieve tickets with optional filters, one keyset page at a time.
+    Returns Ticket objects, or rows with just the requested columns when `fields` is given.
+    """
+    query = _tickets_query(category, priority, status, cursor, fields)
+    if limit:
+        query = query.limit(limit)
     result = await db.execute(query)
-    tickets = result.scalars().all()
-    return tickets
+    return result.all() if fields else result.scalars().all()
+
+
+def encode_search_cursor(rank: float, ticket_id: UUID) -> str:
+    """
+    Encode the keyset position of a search result into an opaque pagination cursor.
+    """
+    return base64.urlsafe_b64encode(f"{rank!r}|{ticket_id}".encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> (float, UUID):
+    """
+    Decode a pagination cursor produced by encode_search_cursor.
+    """
+    try:
+        rank, ticket_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(rank), UUID(ticket_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _search_query(q: str, category: str = None, priority: str = None, status: str = None, cursor: str = None):
+    """
+    Build the full-text search query, best matches first with the ticket id as tie-breaker.
+    Selects (Ticket, rank) rows.
+    """
+    ts_query = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+    rank = func.ts_rank_cd(Ticket.search_vector, ts_query)
+    query = _filter_tickets(select(Ticket, rank.label("rank")).filter(Ticket.search_vector.op("@@")(ts_query)),
+                            category, priority, status)
+    if cursor:
+        query = query.filter(tuple_(rank, Ticket.id) < tuple_(*decode_search_cursor(cursor)))
+    return query.order_by(rank.desc(), Ticket.id.desc())
+
+
+async def search_tickets(db: AsyncSession, q: str, category: str = None, priority: str = None, status: str = None,
+                         limit: int = None, cursor: str = None) -> list:
+    """
+    Search the subject, body and initial response of tickets, one keyset page at a time.
+    Returns (Ticket, rank) rows.
+    """
+    query = _search_query(q, category, priority, status, cursor)
+    if limit:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    return result.all()
+
+
+async def stream_all_tickets(db: AsyncSession, fields: Sequence[str], category: str = None, priority: str = None,
+                             status: str = None, cursor: str = None) -> AsyncIterator:
+    """
+    Yield rows with the requested columns for all matching tickets from a server-side cursor,
+    without loading the whole result into memory.
+    """
+    query = _tickets_query(category, priority, status, cursor, fields)
+    result = await db.stream(query.execution_options(yield_per=Config.TICKETS_STREAM_BATCH_SIZE))
+    async for row in result:
+        yield row
 
 
 async def update_ticket(db: AsyncSession, ticket_id: str, updates: TicketUpdateRequest) -> Ticket:
@@ -64,10 +214,11 @@ async def update_ticket(db: AsyncSession, ticket_id: str, updates: TicketUpdateR
         setattr(ticket, var, value)
     try:
         await db.commit()
-        return ticket
     except SQLAlchemyError as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    await invalidate_tickets([ticket.id])
+    return ticket
 
 
 async def delete_ticket(db: AsyncSession, ticket_id: str) -> None:
@@ -85,19 +236,77 @@ async def delete_ticket(db: AsyncSession, ticket_id: str) -> None:
     except SQLAlchemyError as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    await invalidate_tickets([ticket.id])
+
+
+def _pending_tickets_query(limit: int):
+    return (
+        select(Ticket.id)
+        .filter(Ticket.status == TicketStatus.submitted)
+        .order_by(Ticket.created_at)
+        .limit(limit)
+    )
 
 
-async def get_all_unprocessed_tickets(db: AsyncSession) -> List[Ticket]:
+async def claim_unprocessed_tickets(db: AsyncSession, limit: int) -> List[UUID]:
     """
-    Retrieve all tickets that have not been processed yet.
-    This function assumes that there is a 'status' field in the 'Ticket' model
-    that indicates whether a ticket has been processed or not.
+    Move up to `limit` of the oldest submitted tickets to 'processing' in a single UPDATE and return their IDs.
+    Rows locked by a concurrent claim are skipped. The caller commits, so the claim can be rolled back
+    if the tickets cannot be enqueued, and then invalidates the cached tickets.
     """
-    query = select(Ticket).filter(Ticket.status == 'submitted')  # Adjust the filter as per your model's definition
+    pending = _pending_tickets_query(limit).with_for_update(skip_locked=True)
+    query = (
+        update(Ticket)
+        .where(Ticket.id.in_(pending.scalar_subquery()))
+        .values(status=TicketStatus.processing)
+        .returning(Ticket.id)
+        .execution_options(synchronize_session=False)
+    )
     result = await db.execute(query)
     return result.scalars().all()
 
 
+async def claim_outbox_entries(db: AsyncSession, limit: int) -> list:
+    """
+    Delete up to `limit` of the oldest outbox entries and return their (ticket_id, created_at).
+    Entries locked by a concurrent relay are skipped. The caller commits once the tickets are queued,
+    so the entries come back if queueing fails.
+    """
+    oldest = select(TicketOutbox.id).order_by(TicketOutbox.id).limit(limit).with_for_update(skip_locked=True)
+    query = (
+        delete(TicketOutbox)
+        .where(TicketOutbox.id.in_(oldest.scalar_subquery()))
+        .returning(TicketOutbox.ticket_id, TicketOutbox.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(query)
+    return result.all()
+
+
+async def get_tickets_for_processing(db: AsyncSession, ticket_ids: Sequence[UUID]) -> list:
+    """
+    Return the id, subject and body of the given tickets.
+    """
+    query = select(Ticket.id, Ticket.subject, Ticket.body).filter(Ticket.id.in_(ticket_ids))
+    result = await db.execute(query)
+    return result.all()
+
+
+async def bulk_update_tickets(db: AsyncSession, updates: List[dict]) -> None:
+    """
+    Apply per-ticket updates, each a dict with the ticket 'id' and the columns to set, as one executemany UPDATE.
+    """
+    if not updates:
+        return
+    try:
+        await db.execute(update(Ticket), updates)
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await invalidate_tickets([row['id'] for row in updates])
+
+
 async def update_ticket_status(db: AsyncSession, ticket_id: int, status: TicketStatus):
     # Fetch the ticket by ID and update its status
     ticket = await db.get(Ticket, ticket_id)
@@ -105,3 +314,120 @@ async def update_ticket_status(db: AsyncSession, ticket_id: int, status: TicketS
         ticket.status = status
         db.add(ticket)
         await db.commit()
+        await invalidate_tickets([ticket.id])
+
+
+async def create_processing_run(db: AsyncSession, run: dict) -> None:
+    """
+    Store the timing breakdown of a processing attempt.
+    """
+    try:
+        await db.execute(insert(TicketProcessingRun), [run])
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def get_processing_runs(db: AsyncSession, ticket_id: str, limit: int = 20) -> List[TicketProcessingRun]:
+    """
+    Return the latest processing attempts of a ticket, newest first.
+    """
+    query = (
+        select(TicketProcessingRun)
+        .filter(TicketProcessingRun.ticket_id == ticket_id)
+        .order_by(TicketProcessingRun.started_at.desc())
+        .limit(limit)
+    )
+    result = await db.execute(query)
+    return result.scalars().all()
+
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def _percentiles(values) -> dict:
+    return {f"p{round(q * 100)}": value for q, value in zip(PERCENTILES, values or ())}
+
+
+async def get_processing_percentiles(db: AsyncSession, since: datetime) -> dict:
+    """
+    Return the p50/p95/p99 milliseconds of the queue wait, the whole attempt and each stage
+    over the processing attempts started since the given time.
+    """
+    quantiles = array(PERCENTILES)
+    queue_wait = extract('epoch', TicketProcessingRun.started_at - TicketProcessingRun.enqueued_at) * 1000
+    totals = await db.execute(
+        select(func.count(), func.percentile_cont(quantiles).within_group(queue_wait),
+               func.percentile_cont(quantiles).within_group(TicketProcessingRun.duration_ms))
+        .filter(TicketProcessingRun.started_at >= since)
+    )
+    runs, queue_wait_ms, total_ms = totals.one()
+
+    stage = func.jsonb_each(TicketProcessingRun.stages).table_valued(
+        column('key', String), column('value', JSONB)).lateral('stage')
+    duration = cast(stage.c.value['end'].astext, Integer) - cast(stage.c.value['start'].astext, Integer)
+    stages = await db.execute(
+        select(stage.c.key, func.count(), func.percentile_cont(quantiles).within_group(duration))
+        .join_from(TicketProcessingRun, stage, true())
+        .filter(TicketProcessingRun.started_at >= since)
+        .group_by(stage.c.key)
+    )
+    return {
+        "runs": runs,
+        "queue_wait_ms": _percentiles(queue_wait_ms),
+        "total_ms": _percentiles(total_ms),
+        "stages": {name: {"count": count, **_percentiles(values)} for name, count, values in stages},
+    }
+
+
+def _mean(total: float, count: int) -> Optional[float]:
+    return total / count if count else None
+
+
+def _stats_range(query, since: Optional[datetime], until: Optional[datetime]):
+    # Whole hours only: the hour containing `since` is included, the one containing `until` is not
+    if since:
+        query = query.filter(TicketStatsHourly.bucket >= func.date_trunc('hour', since))
+    if until:
+        query = query.filter(TicketStatsHourly.bucket < func.date_trunc('hour', until))
+    return query
+
+
+async def get_ticket_stats(db: AsyncSession, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                           hourly: bool = False) -> dict:
+    """
+    Return ticket counts by status, category and priority, mean confidences and mean processing time
+    of the tickets created in the given range, read from the hourly rollup rather than from the tickets.
+    """
+    sums = (func.sum(TicketStatsHourly.tickets), func.sum(TicketStatsHourly.category_confidence_sum),
+            func.sum(TicketStatsHourly.category_confidence_count), func.sum(TicketStatsHourly.priority_confidence_sum),
+            func.sum(TicketStatsHourly.priority_confidence_count), func.sum(TicketStatsHourly.processing_seconds_sum),
+            func.sum(TicketStatsHourly.processed_count))
+    groups = (TicketStatsHourly.status, TicketStatsHourly.category, TicketStatsHourly.priority)
+    result = await db.execute(_stats_range(select(*groups, *sums), since, until).group_by(*groups))
+
+    stats = {"total": 0, "by_status": {}, "by_category": {}, "by_priority": {}}
+    totals = [0.0] * 6
+    for status, category, priority, tickets, *row_sums in result:
+        tickets = int(tickets)
+        if not tickets:
+            continue
+        stats["total"] += tickets
+        for key, value in (("by_status", status), ("by_category", category or "none"),
+                           ("by_priority", priority or "none")):
+            stats[key][value] = stats[key].get(value, 0) + tickets
+        totals = [total + float(value) for total, value in zip(totals, row_sums)]
+    stats["mean_category_confidence"] = _mean(totals[0], totals[1])
+    stats["mean_priority_confidence"] = _mean(totals[2], totals[3])
+    stats["mean_processing_seconds"] = _mean(totals[4], totals[5])
+
+    if hourly:
+        result = await db.execute(
+            _stats_range(select(TicketStatsHourly.bucket, sums[0], sums[6]), since, until)
+            .group_by(TicketStatsHourly.bucket)
+            .order_by(TicketStatsHourly.bucket)
+        )
+        stats["hourly"] = [{"bucket": bucket, "tickets": int(tickets), "processed": int(processed)}
+                           for bucket, tickets, processed in result if tickets]
+    return stats
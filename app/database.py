@@ -1,14 +1,79 @@
 import os
+import threading
+import time
 
 from sqlalchemy import NullPool
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app import metrics
 from app.config import Config
 
 DATABASE_URL = Config.DATABASE_URL
 
-async_engine = create_async_engine(DATABASE_URL, echo=os.environ.get('SQLALCHEMY_ECHO', False) == 'true',  poolclass=NullPool)
+# Pool size and overflow per process role; the remaining pool settings are shared
+POOL_PROFILES = {
+    'web': dict(pool_size=Config.DB_POOL_SIZE, max_overflow=Config.DB_MAX_OVERFLOW),
+    'worker': dict(pool_size=Config.WORKER_DB_POOL_SIZE, max_overflow=Config.WORKER_DB_MAX_OVERFLOW),
+}
+
+
+class PoolStats:
+    """
+    Checkout counters shared by every pool the process creates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def record_checkout(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records how long each checkout waited for a connection.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_checkout(time.perf_counter() - started)
+
+
+def create_engine(profile: str = Config.DB_POOL_PROFILE) -> AsyncEngine:
+    """
+    Create the async engine for the given pool profile.
+    DB_POOL_MODE=null disables pooling, for deployments behind PgBouncer or processes that start a new
+    event loop per job (pooled asyncpg connections cannot be shared between loops).
+    """
+    echo = os.environ.get('SQLALCHEMY_ECHO', False) == 'true'
+    if Config.DB_POOL_MODE == 'null':
+        return create_async_engine(DATABASE_URL, echo=echo, poolclass=NullPool)
+    return create_async_engine(
+        DATABASE_URL,
+        echo=echo,
+        poolclass=InstrumentedQueuePool,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        pool_pre_ping=Config.DB_POOL_PRE_PING,
+        **POOL_PROFILES[profile]
+    )
+
+
+async_engine = create_engine()
 
 # noinspection PyTypeChecker
 AsyncSessionLocal: sessionmaker[AsyncSession] = sessionmaker(
@@ -18,3 +83,48 @@ AsyncSessionLocal: sessionmaker[AsyncSession] = sessionmaker(
     bind=async_engine,
     class_=AsyncSession
 )
+
+
+def use_pool_profile(profile: str) -> AsyncEngine:
+    """
+    Rebind AsyncSessionLocal to a new engine built for the given pool profile.
+    """
+    global async_engine
+    async_engine = create_engine(profile)
+    AsyncSessionLocal.configure(bind=async_engine)
+    return async_engine
+
+
+def get_pool_stats() -> dict:
+    """
+    Return the current pool occupancy and checkout wait statistics.
+    Saturation is the share of the pool's maximum capacity (size plus overflow) currently checked out.
+    """
+    pool = async_engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {"mode": "null"}
+    capacity = pool.size() + pool._max_overflow
+    return {
+        "mode": "queue",
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": pool.checkedout() / capacity if capacity else 0.0,
+        "checkouts": pool_stats.checkouts,
+        "checkout_wait_total": pool_stats.checkout_wait_total,
+        "checkout_wait_max": pool_stats.checkout_wait_max,
+    }
+
+
+def _collect_pool_stats():
+    stats = get_pool_stats()
+    if stats["mode"] == "null":
+        return
+    for state in ("checked_out", "checked_in", "overflow"):
+        metrics.db_pool_connections.labels(state).set(stats[state])
+    metrics.db_pool_checkouts.labels().set(stats["checkouts"])
+    metrics.db_pool_checkout_wait.labels().set(stats["checkout_wait_total"])
+
+
+metrics.REGISTRY.add_collector(_collect_pool_stats)
@@ -1,15 +1,105 @@
 import logging
+import time
 from functools import wraps
 
+from app import metrics
+from app.cache import current_validator, get_completion_cache
+
 logger = logging.getLogger(__name__)
 
 
-def log(func):
+def instrumented(func):
+    """
+    Time AIModel.get_completion by provider, model and processing stage.
+    Prompts and completions are only logged for the sampled share of calls (PAYLOAD_LOG_SAMPLE_RATE).
+    """
     @wraps(func)
-    async def wrapper(*args, **kwargs):
-        logger.info(f"Calling {func.__name__} with args: {args}, kwargs: {kwargs}")
-        result = await func(*args, **kwargs)
-        logger.info(f"{func.__name__} returned: {result}")
+    async def wrapper(self, system_prompt, user_prompt, max_tokens):
+        in_flight = metrics.ai_requests_in_flight.labels(self.provider)
+        in_flight.inc()
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            result = await func(self, system_prompt, user_prompt, max_tokens)
+            outcome = "ok"
+        finally:
+            in_flight.dec()
+            metrics.ai_request_duration.labels(self.provider, self.model, metrics.current_stage(), outcome).observe(
+                time.perf_counter() - started)
+        if metrics.sample_payload():
+            logger.info(f"{self.provider} {self.model} completion, system: {system_prompt!r}, user: {user_prompt!r}, "
+                        f"max_tokens: {max_tokens}, returned: {result!r}")
         return result
 
     return wrapper
+
+
+def instrumented_stream(func):
+    """
+    Time AIModel.stream_completion like `instrumented`, from the request until the stream is exhausted or closed.
+    A stream closed before its end (e.g. a hedge that lost) counts as an error, like a cancelled completion.
+    """
+    @wraps(func)
+    async def wrapper(self, system_prompt, user_prompt, max_tokens):
+        in_flight = metrics.ai_requests_in_flight.labels(self.provider)
+        in_flight.inc()
+        outcome = "error"
+        started = time.perf_counter()
+        chunks = []
+        try:
+            async for delta in func(self, system_prompt, user_prompt, max_tokens):
+                chunks.append(delta)
+                yield delta
+            outcome = "ok"
+        finally:
+            in_flight.dec()
+            metrics.ai_request_duration.labels(self.provider, self.model, metrics.current_stage(), outcome).observe(
+                time.perf_counter() - started)
+        if metrics.sample_payload():
+            logger.info(f"{self.provider} {self.model} streamed completion, system: {system_prompt!r}, "
+                        f"user: {user_prompt!r}, max_tokens: {max_tokens}, returned: {''.join(chunks)!r}")
+
+    return wrapper
+
+
+def cached(func):
+    """
+    Serve AIModel.get_completion from the completion cache, keyed on the model and the full request.
+    Completions are only stored if they pass the validator of the calling context (see validated_completions).
+    """
+    @wraps(func)
+    async def wrapper(self, system_prompt, user_prompt, max_tokens):
+        cache = get_completion_cache()
+        if cache is None:
+            return await func(self, system_prompt, user_prompt, max_tokens)
+        key = cache.key(self.model, system_prompt, user_prompt, max_tokens)
+        return await cache.get_or_call(key, lambda: func(self, system_prompt, user_prompt, max_tokens),
+                                       current_validator())
+
+    return wrapper
+
+
+def cached_stream(func):
+    """
+    Serve AIModel.stream_completion from the completion cache, under the same key as get_completion.
+    A cached completion is replayed as a single chunk, and a completion streamed to the end is stored.
+    """
+    @wraps(func)
+    async def wrapper(self, system_prompt, user_prompt, max_tokens):
+        cache = get_completion_cache()
+        if cache is None:
+            async for delta in func(self, system_prompt, user_prompt, max_tokens):
+                yield delta
+            return
+        key = cache.key(self.model, system_prompt, user_prompt, max_tokens)
+        value = await cache.lookup(key)
+        if value is not None:
+            yield value
+            return
+        chunks = []
+        async for delta in func(self, system_prompt, user_prompt, max_tokens):
+            chunks.append(delta)
+            yield delta
+        await cache.store(key, "".join(chunks))
+
+    return wrapper
@@ -0,0 +1,108 @@
+import hashlib
+import re
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.redis_client import get_async_redis
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+# Mersenne prime larger than any shingle hash reduced modulo it, small enough that a * x + b fits in 64 bits
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = 3) -> np.ndarray:
+    """
+    Hash the overlapping word `size`-grams of the text (the whole text when it is shorter).
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = [" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams)))
+
+
+class MinHasher:
+    """
+    MinHash over `num_perm` universal hash functions; the share of equal positions in two signatures
+    estimates the Jaccard similarity of their shingle sets.
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text) % _PRIME
+        return ((self.a * hashes[None, :] + self.b) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """
+    LSH index of MinHash signatures in Redis. Each signature is split into `bands` bands; tickets sharing
+    any band bucket are candidates, and are then compared on their full signatures.
+    Buckets and signatures expire after `ttl` seconds without new tickets, since duplicates come in bursts.
+    """
+
+    def __init__(self, hasher: MinHasher, bands: int, ttl: int, prefix: str = 'dedup'):
+        if len(hasher.a) % bands:
+            raise ValueError("The number of permutations must be a multiple of the number of bands")
+        self.hasher = hasher
+        self.bands = bands
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def signature(self, subject: str, body: str) -> np.ndarray:
+        return self.hasher.signature(f"{subject}\n{body}")
+
+    def _signature_key(self, ticket_id) -> str:
+        return f"{self.prefix}:sig:{ticket_id}"
+
+    def _band_keys(self, signature: np.ndarray):
+        return [
+            f"{self.prefix}:band:{i}:{hashlib.blake2b(band.tobytes(), digest_size=8).hexdigest()}"
+            for i, band in enumerate(np.split(signature, self.bands))
+        ]
+
+    async def find(self, signature: np.ndarray, threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        Return the id and estimated similarity of the most similar indexed ticket, if it reaches the threshold.
+        """
+        redis = get_async_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in self._band_keys(signature):
+                pipe.smembers(key)
+            buckets = await pipe.execute()
+        candidates = sorted({ticket_id.decode() for bucket in buckets for ticket_id in bucket})
+        if not candidates:
+            return None
+
+        stored = await redis.mget([self._signature_key(ticket_id) for ticket_id in candidates])
+        found = [(ticket_id, np.frombuffer(value, dtype=np.uint32))
+                 for ticket_id, value in zip(candidates, stored) if value is not None]
+        if not found:
+            return None
+        scores = np.mean(np.stack([value for _, value in found]) == signature, axis=1)
+        best = int(scores.argmax())
+        if scores[best] < threshold:
+            return None
+        return found[best][0], float(scores[best])
+
+    async def add(self, ticket_id, signature: np.ndarray):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.set(self._signature_key(ticket_id), signature.astype(np.uint32).tobytes(), ex=self.ttl)
+            for key in self._band_keys(signature):
+                pipe.sadd(key, str(ticket_id))
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+_duplicate_index = None
+
+
+def get_duplicate_index() -> DuplicateIndex:
+    global _duplicate_index
+    if _duplicate_index is None:
+        _duplicate_index = DuplicateIndex(MinHasher(Config.DEDUP_NUM_PERM), Config.DEDUP_BANDS, Config.DEDUP_TTL)
+    return _duplicate_index
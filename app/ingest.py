@@ -0,0 +1,140 @@
+import codecs
+import json
+from typing import AsyncIterator, List, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Config
+from app.crud import bulk_create_tickets
+from app.schemas import BulkTicketError, TicketCreateRequest
+
+# (row number, parsed JSON value, error message) - exactly one of value and error is set
+ParsedRow = Tuple[int, object, str]
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    """
+    Parse newline-delimited JSON as it arrives; a malformed line only fails that row.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    row = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                row += 1
+                yield _parse_line(row, line)
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield _parse_line(row + 1, buffer)
+
+
+def _parse_line(row: int, line: str) -> ParsedRow:
+    try:
+        return row, json.loads(line), None
+    except json.JSONDecodeError as e:
+        return row, None, f"Invalid JSON: {e}"
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    """
+    Parse the elements of a top-level JSON array as they arrive, without buffering the whole body.
+    A syntax error ends the array, since the remaining elements cannot be located reliably.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    iterator = chunks.__aiter__()
+    buffer = ""
+    eof = False
+    row = 0
+
+    async def fill():
+        nonlocal buffer, eof
+        try:
+            buffer += text_decoder.decode(await iterator.__anext__())
+        except StopAsyncIteration:
+            buffer += text_decoder.decode(b"", final=True)
+            eof = True
+
+    async def next_char() -> str:
+        # Skip whitespace and return the next significant character, or "" at the end of the body
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip()
+            if buffer or eof:
+                return buffer[:1]
+            await fill()
+
+    if await next_char() != "[":
+        yield 1, None, "Invalid JSON: expected an array"
+        return
+    buffer = buffer[1:]
+    if await next_char() == "]":
+        buffer = buffer[1:]
+    else:
+        while True:
+            if not await next_char():
+                yield row + 1, None, "Invalid JSON: unexpected end of data"
+                return
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError as e:
+                    if eof:
+                        yield row + 1, None, f"Invalid JSON: {e}"
+                        return
+                else:
+                    # A value ending exactly at the end of the buffer may still be cut off (e.g. a number)
+                    if end < len(buffer) or eof:
+                        break
+                await fill()
+            row += 1
+            yield row, value, None
+            buffer = buffer[end:]
+
+            separator = await next_char()
+            buffer = buffer[1:]
+            if separator == "]":
+                break
+            if separator != ",":
+                yield row + 1, None, "Invalid JSON: expected ',' or ']'"
+                return
+    if await next_char():
+        yield row + 1, None, "Invalid JSON: unexpected data after the array"
+
+
+async def ingest_tickets(db: AsyncSession, rows: AsyncIterator[ParsedRow],
+                         chunk_size: int = Config.BULK_INGEST_CHUNK_SIZE) -> (List, List[BulkTicketError]):
+    """
+    Validate parsed rows as they arrive and insert the valid ones in chunks, each in its own transaction.
+    Returns the IDs of the created tickets and the errors of the rejected rows; when a chunk cannot be
+    stored, each of its rows is reported with the database error and the following chunks are still tried.
+    """
+    ticket_ids, errors, chunk, chunk_rows = [], [], [], []
+
+    async def store():
+        try:
+            ticket_ids.extend(await bulk_create_tickets(db, chunk))
+        except HTTPException as e:
+            errors.extend(BulkTicketError(row=row, detail=f"Not stored: {e.detail}") for row in chunk_rows)
+
+    async for row, value, error in rows:
+        if error is None:
+            try:
+                chunk.append(TicketCreateRequest.model_validate(value))
+                chunk_rows.append(row)
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors())
+        if error is not None:
+            errors.append(BulkTicketError(row=row, detail=error))
+        if len(chunk) >= chunk_size:
+            await store()
+            chunk, chunk_rows = [], []
+    if chunk:
+        await store()
+    errors.sort(key=lambda error: error.row)
+    return ticket_ids, errors
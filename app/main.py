@@ -1,22 +1,48 @@
+import contextlib
+import json
 import logging
+import time
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional
+from uuid import UUID
 
-from fastapi import FastAPI, Depends, status
-from fastapi import HTTPException, Request
+from fastapi import BackgroundTasks, FastAPI, Depends, Query, status
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from app.crud import create_ticket, get_ticket_by_id, get_all_tickets
+from app import metrics
+from app.batch import queue_batch_run
+from app.config import Config
+from app.crud import (create_ticket, get_ticket_by_id, get_ticket_row, get_all_tickets, get_processing_percentiles,
+                      get_processing_runs, get_ticket_stats, search_tickets, stream_all_tickets, encode_cursor,
+                      encode_search_cursor)
 from app.database import AsyncSessionLocal
-from app.processing import enqueue_all_unprocessed_tickets, enqueue_single_ticket
-from app.schemas import TicketCreateRequest, TicketResponse, TicketCreationResponse
+from app.ingest import ingest_tickets, iter_json_array, iter_ndjson
+from app.outbox import notify_outbox, start_outbox_relay, stop_outbox_relay
+from app.processing import get_processing_run, run_processing, start_processing_run
+from app.schemas import (TICKET_FIELDS, BulkTicketCreationResponse, ProcessingRunResponse, TicketCreateRequest,
+                         TicketResponse, TicketCreationResponse)
+from app.serialization import dump_rows, dumps
+from app.streaming import read_response_stream
+from app.ticket_cache import cache_ticket, etag, get_cached_ticket
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    relay_task = await start_outbox_relay() if Config.OUTBOX_RELAY_ENABLED else None
+    yield
+    if relay_task is not None:
+        await stop_outbox_relay(relay_task)
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -34,12 +60,30 @@ async def general_exception_handler(request: Request, exc: Exception):
     return JSONResponse({"detail": "An unexpected error occurred."}, status_code=500)
 
 
+_route_paths = {}
+
+
+def _route_path(request: Request) -> str:
+    # Label requests by route template rather than by path, which would create a series per ticket id
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_paths:
+        _route_paths.update((route.endpoint, route.path) for route in app.routes if hasattr(route, "endpoint"))
+    return _route_paths.get(endpoint, "unmatched")
+
+
 @app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request {request.method} {request.url}")
-    response = await call_next(request)
-    logger.info(f"Response status code: {response.status_code}")
-    return response
+async def time_requests(request: Request, call_next):
+    status_code = 500
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.http_request_duration.labels(request.method, _route_path(request), str(status_code)).observe(
+            time.perf_counter() - started)
 
 
 # Dependency to get database session
@@ -50,8 +94,9 @@ async def get_db_session() -> AsyncSession:
 
 @app.post("/ticket", response_model=TicketCreationResponse, status_code=status.HTTP_201_CREATED)
 async def post_ticket(ticket: TicketCreateRequest, db: AsyncSession = Depends(get_db_session)):
+    # The ticket is queued by the outbox relay, so the request does not wait on the queue
     db_ticket = await create_ticket(db, ticket)
-    enqueue_single_ticket(db_ticket.id)
+    notify_outbox()
 
     # Construct the response model to return
     return TicketCreationResponse(
@@ -61,27 +106,243 @@ async def post_ticket(ticket: TicketCreateRequest, db: AsyncSession = Depends(ge
     )
 
 
+@app.post("/tickets/bulk", response_model=BulkTicketCreationResponse, status_code=status.HTTP_201_CREATED)
+async def post_tickets_bulk(request: Request, db: AsyncSession = Depends(get_db_session)):
+    """
+    Create many tickets from a JSON array or an NDJSON upload (Content-Type: application/x-ndjson).
+    Rows are validated as the body streams in; invalid rows are reported and skipped.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "application/x-ndjson":
+        rows = iter_ndjson(request.stream())
+    elif content_type == "application/json":
+        rows = iter_json_array(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Expected application/json or application/x-ndjson")
+
+    ticket_ids, errors = await ingest_tickets(db, rows)
+    if ticket_ids:
+        notify_outbox()
+
+    return BulkTicketCreationResponse(ticket_ids=ticket_ids, accepted=len(ticket_ids), rejected=len(errors),
+                                      errors=errors)
+
+
+def _cache_id(ticket_id: str) -> Optional[UUID]:
+    # Only canonical ids are cached, invalidation uses the ids of the stored tickets
+    try:
+        return UUID(ticket_id)
+    except ValueError:
+        return None
+
+
+def _etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
+
+
 @app.get("/ticket/{ticket_id}", response_model=TicketResponse)
-async def get_ticket(ticket_id: str, db: AsyncSession = Depends(get_db_session)):
-    db_ticket = await get_ticket_by_id(db, ticket_id)
-    if db_ticket is None:
-        raise HTTPException(status_code=404, detail="Ticket not found")
-    return db_ticket
+async def get_ticket(ticket_id: str, request: Request, db: AsyncSession = Depends(get_db_session)):
+    """
+    Return a ticket, from the ticket cache when it is there; the database session is only used on a miss.
+    Responses carry an ETag, and a request whose If-None-Match matches it gets an empty 304.
+    """
+    cache_id = _cache_id(ticket_id) if Config.TICKET_CACHE_ENABLED else None
+    body, version = await get_cached_ticket(cache_id) if cache_id else (None, None)
+    if body is None:
+        if Config.FAST_JSON_RESPONSES:
+            body = dumps((await get_ticket_row(db, ticket_id, TICKET_FIELDS))._asdict())
+        else:
+            db_ticket = await get_ticket_by_id(db, ticket_id)
+            body = TicketResponse.model_validate(db_ticket, from_attributes=True).model_dump_json().encode()
+        if cache_id:
+            await cache_ticket(cache_id, body, version)
+
+    headers = {"ETag": etag(body), "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/ticket/{ticket_id}/timings", response_model=List[ProcessingRunResponse])
+async def get_ticket_timings(ticket_id: str, limit: int = Query(20, ge=1, le=100),
+                             db: AsyncSession = Depends(get_db_session)):
+    """
+    Return the timing breakdown of the latest processing attempts of a ticket, newest first.
+    """
+    await get_ticket_by_id(db, ticket_id)
+    return await get_processing_runs(db, ticket_id, limit)
+
+
+@app.get("/tickets/timings")
+async def get_tickets_timings(hours: float = Query(24, gt=0), db: AsyncSession = Depends(get_db_session)):
+    """
+    Return p50/p95/p99 milliseconds of the queue wait, the whole attempt and each stage
+    over the processing attempts of the last `hours`.
+    """
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return {"since": since, **await get_processing_percentiles(db, since)}
+
+
+@app.get("/tickets/stats")
+async def get_tickets_stats(since: Optional[datetime] = None, until: Optional[datetime] = None, hourly: bool = False,
+                            db: AsyncSession = Depends(get_db_session)):
+    """
+    Return ticket counts by status, category and priority, mean confidences and mean processing time
+    of the tickets created in the whole hours between `since` and `until`, with a per-hour series if `hourly`.
+    """
+    return await get_ticket_stats(db, since, until, hourly)
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    field_list = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in field_list if field not in TICKET_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return field_list
+
+
+async def _ndjson_tickets(fields: List[str], **filters):
+    # The request's session is closed before the body is streamed, so the stream needs its own
+    async with AsyncSessionLocal() as db:
+        async for row in stream_all_tickets(db, fields, **filters):
+            if Config.FAST_JSON_RESPONSES:
+                yield dumps(row._asdict()) + b"\n"
+            else:
+                yield json.dumps(jsonable_encoder(row._asdict())) + "\n"
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _response_events(ticket_id: str):
+    """
+    Relay the chunks of a ticket's initial response as server-sent events until it is complete.
+    While nothing is being streamed (the ticket is still queued, or streaming is disabled),
+    fall back to the stored response once it appears.
+    """
+    last_id = "0"
+    deadline = time.monotonic() + Config.RESPONSE_STREAM_TIMEOUT
+    while time.monotonic() < deadline:
+        entries = await read_response_stream(ticket_id, last_id)
+        if not entries and last_id == "0":
+            async with AsyncSessionLocal() as db:
+                ticket = await get_ticket_by_id(db, ticket_id)
+            if ticket.initial_response is not None:
+                yield _sse("token", ticket.initial_response)
+                yield _sse("done", {})
+                return
+            yield ": keep-alive\n\n"
+        for last_id, fields in entries:
+            if "delta" in fields:
+                yield _sse("token", fields["delta"])
+            else:
+                yield _sse("done" if "done" in fields else "error", {})
+                return
+    yield _sse("error", {"detail": "Timed out waiting for the response"})
+
+
+@app.get("/ticket/{ticket_id}/response/stream")
+async def get_ticket_response_stream(ticket_id: str, db: AsyncSession = Depends(get_db_session)):
+    """
+    Stream the initial response of a ticket as server-sent events while it is being generated.
+    """
+    ticket = await get_ticket_by_id(db, ticket_id)
+    if ticket.initial_response is not None:
+        events = iter([_sse("token", ticket.initial_response), _sse("done", {})])
+    else:
+        events = _response_events(ticket_id)
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.get("/tickets", response_model=List[TicketResponse])
-async def get_tickets(category: Optional[str] = None, priority: Optional[str] = None, status: Optional[str] = None,
+async def get_tickets(response: Response, category: Optional[str] = None, priority: Optional[str] = None,
+                      status: Optional[str] = None, cursor: Optional[str] = None, fields: Optional[str] = None,
+                      limit: Optional[int] = Query(None, ge=1, le=Config.TICKETS_MAX_PAGE_SIZE),
+                      format: str = Query("json", pattern="^(json|ndjson)$"),
                       db: AsyncSession = Depends(get_db_session)):
-    tickets = await get_all_tickets(db, category, priority, status)
+    """
+    List tickets ordered by creation time. Without `limit` or `cursor` every matching ticket is returned;
+    with either, one page is returned and the cursor for the next page is in the X-Next-Cursor header.
+    `fields` restricts the returned columns, `format=ndjson` streams every matching ticket instead of a page.
+    """
+    field_list = _parse_fields(fields)
+    if format == "ndjson":
+        return StreamingResponse(
+            _ndjson_tickets(field_list or list(TICKET_FIELDS), category=category, priority=priority, status=status,
+                            cursor=cursor),
+            media_type="application/x-ndjson",
+        )
+
+    if Config.FAST_JSON_RESPONSES:
+        # Plain rows encoded as they are, without building and validating a TicketResponse per ticket
+        field_list = field_list or list(TICKET_FIELDS)
+    if cursor and limit is None:
+        limit = Config.TICKETS_PAGE_SIZE
+    tickets = await get_all_tickets(db, category, priority, status, limit=limit, cursor=cursor, fields=field_list)
+    headers = {}
+    if limit and len(tickets) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(tickets[-1].created_at, tickets[-1].id)
+    if Config.FAST_JSON_RESPONSES:
+        return Response(dump_rows(tickets), media_type="application/json", headers=headers)
+    if field_list:
+        return JSONResponse(jsonable_encoder([ticket._asdict() for ticket in tickets]), headers=headers)
+    response.headers.update(headers)
     return tickets
 
 
+@app.get("/tickets/search", response_model=List[TicketResponse])
+async def get_tickets_search(response: Response, q: str = Query(..., min_length=1, max_length=500),
+                             category: Optional[str] = None, priority: Optional[str] = None,
+                             status: Optional[str] = None, cursor: Optional[str] = None,
+                             limit: int = Query(Config.TICKETS_PAGE_SIZE, ge=1, le=Config.TICKETS_MAX_PAGE_SIZE),
+                             db: AsyncSession = Depends(get_db_session)):
+    """
+    Full-text search over the subject, body and initial response of tickets, best matches first.
+    `q` takes web search syntax ("quoted phrases", OR, -excluded); the cursor for the next page
+    is returned in the X-Next-Cursor header.
+    """
+    rows = await search_tickets(db, q, category, priority, status, limit=limit, cursor=cursor)
+    if len(rows) == limit:
+        ticket, rank = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_search_cursor(rank, ticket.id)
+    return [ticket for ticket, _ in rows]
+
+
 @app.post("/process")
-async def post_process(db: AsyncSession = Depends(get_db_session)):
+async def post_process(background_tasks: BackgroundTasks,
+                       mode: str = Query("realtime", pattern="^(realtime|batch)$")):
     """
     Manually trigger processing of all unprocessed tickets.
+    Tickets are claimed and enqueued in the background, poll GET /process/{job_id} for progress.
+    `mode=batch` sends them to the providers' batch APIs instead, for backlogs that need no real-time answers;
+    the run is queued for `python -m app.batch --watch`, which waits for the batch jobs outside the web process.
+    """
+    if mode == "batch":
+        job_id = await queue_batch_run()
+        return {"message": "Batch processing of unprocessed tickets queued", "job_id": job_id}
+    job_id = await start_processing_run()
+    background_tasks.add_task(run_processing, job_id)
+    return {"message": "Processing of unprocessed tickets started", "job_id": job_id}
+
+
+@app.get("/process/{job_id}")
+async def get_process(job_id: str):
+    processing_run = await get_processing_run(job_id)
+    if processing_run is None:
+        raise HTTPException(status_code=404, detail="Processing run not found")
+    return {"job_id": job_id, **processing_run}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Expose the metrics of this process in the Prometheus text format.
     """
-    job_id, ticket_count = await enqueue_all_unprocessed_tickets(db)
-    if not job_id:
-        return {"message": "No unprocessed tickets to process", "job_id": None}
-    return {"message": f"Processing started for {ticket_count} tickets", "job_id": job_id}
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,268 @@
+import asyncio
+import bisect
+import logging
+import random
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets (seconds) sized for AI calls, which take from a fraction of a second to minutes
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(ABC):
+    """
+    A metric family in the Prometheus text format. Label values are given positionally to `labels()`,
+    which returns the child for that combination; children are created on first use and kept.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        Create the value of one label combination.
+        """
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """
+        Return the sample lines of every child.
+        """
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+    _new_child = _Value
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in list(self._children.items())]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry=None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of this process. Collectors run before every render to refresh gauges whose values
+    are read from elsewhere (pool statistics, queue lengths) rather than updated as events happen.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collector.__name__} failed: {e!r}")
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+ai_request_duration = Histogram(
+    "ai_request_duration_seconds", "Duration of AI completion calls.", ("provider", "model", "stage", "outcome"))
+ai_requests_in_flight = Gauge("ai_requests_in_flight", "AI completion calls in progress.", ("provider",))
+ai_tokens = Counter("ai_tokens_total", "Tokens used by AI calls.", ("provider", "model", "direction"))
+ai_cost = Counter("ai_cost_usd_total", "Estimated cost of AI calls in US dollars.", ("provider", "model"))
+stage_duration = Histogram(
+    "ticket_stage_duration_seconds", "Duration of ticket processing stages, including the wait for a provider slot.",
+    ("stage", "outcome"))
+tickets_processed = Counter("tickets_processed_total", "Tickets processed, by outcome.", ("outcome",))
+tickets_in_flight = Gauge("tickets_in_flight", "Tickets being processed.")
+queue_depth = Gauge("ticket_queue_depth", "Tickets waiting in the processing queue.")
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests until the response headers are sent.",
+    ("method", "route", "status"), buckets=HTTP_BUCKETS)
+# Mirrors of the database pool and completion cache statistics, refreshed by their collectors
+db_pool_connections = Gauge("db_pool_connections", "Database pool connections by state.", ("state",))
+db_pool_checkouts = Counter("db_pool_checkouts_total", "Database pool checkouts.")
+db_pool_checkout_wait = Counter("db_pool_checkout_wait_seconds_total", "Time spent waiting for a pooled connection.")
+completion_cache_lookups = Counter("completion_cache_lookups_total", "Completion cache lookups by result.",
+                                   ("result",))
+ticket_cache_lookups = Counter("ticket_cache_lookups_total", "GET /ticket/{id} cache lookups by result.", ("result",))
+
+# Processing stage of the current task, so that AI calls can be broken down by stage
+_stage: ContextVar[str] = ContextVar('metrics_stage', default='none')
+
+
+def set_stage(stage: str):
+    """
+    Attribute the AI calls made from the current task (and the tasks it starts) to a processing stage.
+    """
+    _stage.set(stage)
+
+
+def current_stage() -> str:
+    return _stage.get()
+
+
+def _parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    prices = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, price = item.partition("=")
+        input_price, _, output_price = price.partition(":")
+        prices[model.strip()] = (float(input_price), float(output_price))
+    return prices
+
+
+_prices = None
+
+
+def record_tokens(provider: str, model: str, input_tokens: Optional[int], output_tokens: Optional[int]):
+    """
+    Count the tokens of an AI call and their cost at the model's MODEL_PRICES (per million tokens).
+    """
+    global _prices
+    if _prices is None:
+        _prices = _parse_prices(Config.MODEL_PRICES)
+    input_tokens, output_tokens = input_tokens or 0, output_tokens or 0
+    ai_tokens.labels(provider, model, "input").inc(input_tokens)
+    ai_tokens.labels(provider, model, "output").inc(output_tokens)
+    if model in _prices:
+        input_price, output_price = _prices[model]
+        ai_cost.labels(provider, model).inc((input_tokens * input_price + output_tokens * output_price) / 1e6)
+
+
+def sample_payload() -> bool:
+    """
+    Decide whether the payload of an AI call is logged, for PAYLOAD_LOG_SAMPLE_RATE of the calls.
+    """
+    rate = Config.PAYLOAD_LOG_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        # Collectors may block on Redis, keep them off the event loop
+        body = (await asyncio.get_running_loop().run_in_executor(None, render)).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: " + CONTENT_TYPE.encode()
+                     + b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int) -> asyncio.AbstractServer:
+    """
+    Serve the metrics of a process without a web app (the async worker) over plain HTTP on the given port.
+    """
+    return await asyncio.start_server(_serve_metrics, port=port)
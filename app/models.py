@@ -1,13 +1,21 @@
 import enum
 import uuid
 
-from sqlalchemy import Column, String, Text, Enum, DateTime, Float
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import (BigInteger, Column, Computed, String, Text, Enum, DateTime, Float, ForeignKey, Index, Integer,
+                        text)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR, UUID
+from sqlalchemy.orm import declarative_base, deferred
 from sqlalchemy.sql import func
 
 Base = declarative_base()
 
+# Text search configuration of Ticket.search_vector; queries have to use the same one
+SEARCH_CONFIG = 'english'
+# Subject matches rank above body matches, which rank above matches in the response
+SEARCH_VECTOR = (f"setweight(to_tsvector('{SEARCH_CONFIG}', subject), 'A') || "
+                 f"setweight(to_tsvector('{SEARCH_CONFIG}', body), 'B') || "
+                 f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(initial_response, '')), 'C')")
+
 
 class TicketStatus(enum.Enum):
     submitted = 'submitted'
@@ -31,6 +39,21 @@ class TicketCategory(enum.Enum):
 
 class Ticket(Base):
     __tablename__ = 'tickets'
+    __table_args__ = (
+        # Keyset pagination order of GET /tickets
+        Index('ix_tickets_created_at_id', 'created_at', 'id'),
+        # Tickets waiting to be claimed for processing
+        Index('ix_tickets_pending', 'created_at', postgresql_where=text("status = 'submitted'")),
+        # GET /tickets filters, in keyset order
+        Index('ix_tickets_status_created_at', 'status', 'created_at', 'id'),
+        Index('ix_tickets_category_created_at', 'category', 'created_at', 'id'),
+        Index('ix_tickets_priority_created_at', 'priority', 'created_at', 'id'),
+        # GET /tickets/search
+        Index('ix_tickets_search_vector', 'search_vector', postgresql_using='gin'),
+        # ON DELETE SET NULL of reused_from_ticket_id, without scanning every ticket for each deleted one
+        Index('ix_tickets_reused_from_ticket_id', 'reused_from_ticket_id',
+              postgresql_where=text("reused_from_ticket_id IS NOT NULL")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     subject = Column(String(255), nullable=False)
@@ -44,6 +67,78 @@ class Ticket(Base):
     priority_confidence = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     processed_at = Column(DateTime(timezone=True), nullable=True)
+    # Tokens used by the AI calls made for the ticket
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    # Stages that failed in the last attempt under the 'partial' policy, retried by the next processing run
+    failed_stages = Column(ARRAY(String(16)), nullable=True)
+    # Where the category and priority came from: 'ai', 'local' (classifier) or 'reused' (near-duplicate)
+    labels_source = Column(String(16), nullable=True)
+    # Near-duplicate whose category, priority and response were reused instead of calling the AI models
+    reused_from_ticket_id = Column(UUID(as_uuid=True), ForeignKey('tickets.id', ondelete='SET NULL'), nullable=True)
+    # Maintained by the database; deferred so ticket queries do not load it
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR, persisted=True)))
 
     def __repr__(self):
         return f"<Ticket {self.id} - {self.subject}>"
+
+
+class TicketOutbox(Base):
+    """
+    Tickets committed but not yet handed to the processing queue, written in the same transaction as the ticket
+    and moved to the queue by the outbox relay.
+    """
+    __tablename__ = 'ticket_outbox'
+
+    id = Column(BigInteger, primary_key=True)
+    ticket_id = Column(UUID(as_uuid=True), ForeignKey('tickets.id', ondelete='CASCADE'), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<TicketOutbox {self.id} - {self.ticket_id}>"
+
+
+class TicketProcessingRun(Base):
+    """
+    Timing breakdown of one processing attempt of a ticket.
+    """
+    __tablename__ = 'ticket_processing_runs'
+    __table_args__ = (
+        Index('ix_ticket_processing_runs_ticket_id_started_at', 'ticket_id', 'started_at'),
+        # Aggregates over a time range
+        Index('ix_ticket_processing_runs_started_at', 'started_at'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    ticket_id = Column(UUID(as_uuid=True), ForeignKey('tickets.id', ondelete='CASCADE'), nullable=False)
+    # When the ticket was queued (if known) and picked up by a worker
+    enqueued_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    duration_ms = Column(Integer, nullable=False)
+    # processed, partial, reused or failed
+    outcome = Column(String(16), nullable=False)
+    # Stage name -> start/end offsets from started_at in milliseconds, plus provider, model and tokens of AI stages
+    stages = Column(JSONB, nullable=False)
+
+    def __repr__(self):
+        return f"<TicketProcessingRun {self.id} - {self.ticket_id}>"
+
+
+class TicketStatsHourly(Base):
+    """
+    Ticket counts and sums per hour of creation, status, category and priority, kept up to date by statement-level
+    triggers on tickets (see the b6e1d0c4a9f2 migration). Missing categories and priorities are stored as ''.
+    """
+    __tablename__ = 'ticket_stats_hourly'
+
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    status = Column(String(32), primary_key=True)
+    category = Column(String(32), primary_key=True)
+    priority = Column(String(32), primary_key=True)
+    tickets = Column(BigInteger, nullable=False)
+    category_confidence_sum = Column(Float, nullable=False)
+    category_confidence_count = Column(BigInteger, nullable=False)
+    priority_confidence_sum = Column(Float, nullable=False)
+    priority_confidence_count = Column(BigInteger, nullable=False)
+    processing_seconds_sum = Column(Float, nullable=False)
+    processed_count = Column(BigInteger, nullable=False)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.config import Config
+from app.crud import claim_outbox_entries
+from app.database import AsyncSessionLocal
+from app.processing import enqueue_tickets_async
+
+logger = logging.getLogger(__name__)
+
+
+async def relay_outbox(limit: int) -> int:
+    """
+    Move up to `limit` outbox entries to the processing queue and return how many were moved.
+    The entries are only deleted once the queue has accepted the tickets, so each committed ticket is queued
+    at least once; it is queued twice only if the delete fails to commit after the push.
+    """
+    async with AsyncSessionLocal() as db:
+        entries = await claim_outbox_entries(db, limit)
+        if not entries:
+            return 0
+        try:
+            await enqueue_tickets_async([ticket_id for ticket_id, _ in entries],
+                                        [created_at.timestamp() for _, created_at in entries])
+        except Exception:
+            await db.rollback()
+            raise
+        await db.commit()
+    return len(entries)
+
+
+class OutboxRelay:
+    """
+    Background task relaying the outbox to the processing queue in batches. It drains the outbox whenever notify()
+    is called and otherwise every `poll_interval` seconds, picking up the entries of other processes and of failed
+    attempts. Concurrent relays skip each other's entries.
+    """
+
+    def __init__(self, batch_size: int = Config.OUTBOX_BATCH_SIZE, poll_interval: float = Config.OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    async def run(self):
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                relayed = await relay_outbox(self.batch_size)
+            except Exception:
+                logger.exception("Outbox relay failed")
+                relayed = 0
+            if relayed == self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+_relay: Optional[OutboxRelay] = None
+
+
+async def start_outbox_relay() -> asyncio.Task:
+    """
+    Start the relay of this process on the running event loop.
+    """
+    global _relay
+    _relay = OutboxRelay()
+    return asyncio.ensure_future(_relay.run())
+
+
+async def stop_outbox_relay(task: asyncio.Task):
+    """
+    Stop the relay after its current batch; an interrupted batch stays in the outbox.
+    """
+    global _relay
+    if _relay is not None:
+        _relay.stop()
+        _relay = None
+    await task
+
+
+def notify_outbox():
+    """
+    Wake up the relay of this process, if it runs one, to queue newly committed tickets right away.
+    """
+    if _relay is not None:
+        _relay.notify()
@@ -1,16 +1,32 @@
+import asyncio
+import contextlib
+import functools
 import logging
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
 
 import redis
-from rq import Queue
+from rq import Queue, get_current_job
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.ai import categorize_ticket, prioritize_ticket, generate_response, openai_model, anthropic_model
+from app import metrics
+from app.ai import AIModel, categorize_ticket, prioritize_ticket, triage_ticket, generate_response
+from app.classifier import get_classifier
 from app.config import Config
-from app.crud import get_all_unprocessed_tickets, update_ticket, get_ticket_by_id
+from app.crud import claim_unprocessed_tickets, create_processing_run, update_ticket, get_ticket_by_id
 from app.database import AsyncSessionLocal
-from app.models import TicketStatus
+from app.dedup import get_duplicate_index
+from app.models import Ticket, TicketStatus
+from app.prompts import track_usage
+from app.ratelimit import provider_semaphore
+from app.redis_client import get_async_redis
+from app.registry import get_task_model
 from app.schemas import TicketUpdateRequest
+from app.streaming import ResponseStream
+from app.ticket_cache import invalidate_tickets
+from app.timings import ProcessingTimer
 
 # Connect to Redis
 redis_conn = redis.Redis(host=Config.REDIS_HOST, port=Config.REDIS_PORT)
@@ -20,66 +36,376 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def enqueue_all_unprocessed_tickets(db: AsyncSession):
+def queue_entry(ticket_id, enqueued_at: Optional[float] = None) -> str:
     """
-    Fetch all unprocessed tickets, update their status to 'processing', and enqueue them for further processing.
+    Encode a ticket id for the async worker queue together with the time it is enqueued (now by default).
     """
-    tickets = await get_all_unprocessed_tickets(db)
-    if not tickets:
-        return None, 0  # No tickets to process
+    return f"{ticket_id}|{enqueued_at if enqueued_at is not None else time.time():.3f}"
 
-    job_ids = []
-    for ticket in tickets:
-        # Update the ticket status directly assuming db session handles transactions
-        ticket.status = TicketStatus.processing
-        db.add(ticket)
-        await db.commit()  # Ensure the status update is committed before enqueueing
 
-        job = queue.enqueue('app.processing.process_ticket', ticket.id)
-        job_ids.append(job.id)
+def parse_queue_entry(entry: str) -> (str, Optional[float]):
+    ticket_id, _, enqueued_at = entry.partition("|")
+    return ticket_id, float(enqueued_at) if enqueued_at else None
 
-    return job_ids[0] if job_ids else None, len(tickets)
 
+def _collect_queue_depth():
+    depth = redis_conn.llen(Config.TICKET_QUEUE_KEY) if Config.QUEUE_BACKEND == 'async' else queue.count
+    metrics.queue_depth.labels().set(depth)
 
-def enqueue_single_ticket(ticket_id: str):
+
+metrics.REGISTRY.add_collector(_collect_queue_depth)
+
+
+def enqueue_tickets(ticket_ids: list) -> list:
+    """
+    Enqueue a batch of tickets in a single Redis round-trip and return the ids of the queued jobs.
+    """
+    if Config.QUEUE_BACKEND == 'async':
+        redis_conn.rpush(Config.TICKET_QUEUE_KEY, *(queue_entry(ticket_id) for ticket_id in ticket_ids))
+        return [str(ticket_id) for ticket_id in ticket_ids]
+    jobs = queue.enqueue_many([
+        Queue.prepare_data('app.processing.process_ticket', (ticket_id,)) for ticket_id in ticket_ids
+    ])
+    return [job.id for job in jobs]
+
+
+async def enqueue_tickets_async(ticket_ids: list, enqueued_at: Optional[list] = None) -> list:
+    """
+    Enqueue a batch of tickets without blocking the event loop and return the ids of the queued jobs.
+    The async worker queue is written with the async Redis client, with `enqueued_at` (Unix times) as the enqueue
+    times if given; RQ jobs are created in a thread.
+    """
+    if Config.QUEUE_BACKEND == 'async':
+        enqueued_at = enqueued_at or [None] * len(ticket_ids)
+        await get_async_redis().rpush(Config.TICKET_QUEUE_KEY, *(
+            queue_entry(ticket_id, at) for ticket_id, at in zip(ticket_ids, enqueued_at)))
+        return [str(ticket_id) for ticket_id in ticket_ids]
+    return await asyncio.get_running_loop().run_in_executor(None, enqueue_tickets, ticket_ids)
+
+
+async def enqueue_all_unprocessed_tickets(db: AsyncSession, run_id: str = None):
+    """
+    Claim all submitted tickets in chunks of PROCESS_CHUNK_SIZE and enqueue each chunk in one Redis round-trip.
+    A chunk's claim is only committed once it has been enqueued.
+    Progress is recorded under the processing run when a run id is given.
+    """
+    first_job_id, ticket_count = None, 0
+    while True:
+        ticket_ids = await claim_unprocessed_tickets(db, Config.PROCESS_CHUNK_SIZE)
+        if not ticket_ids:
+            break
+        try:
+            job_ids = await enqueue_tickets_async(ticket_ids)
+        except Exception:
+            await db.rollback()
+            raise
+        await db.commit()
+        await invalidate_tickets(ticket_ids)
+
+        first_job_id = first_job_id or job_ids[0]
+        ticket_count += len(ticket_ids)
+        if run_id:
+            await record_enqueued(run_id, len(ticket_ids))
+
+    return first_job_id, ticket_count
+
+
+def _processing_run_key(run_id: str) -> str:
+    return f"processing_run:{run_id}"
+
+
+async def start_processing_run(run_id: Optional[str] = None, status: str = 'running') -> str:
+    """
+    Register a new processing run, or start a queued one, and return its tracking id.
+    """
+    run_id = run_id or str(uuid.uuid4())
+    async with get_async_redis().pipeline() as pipe:
+        pipe.hset(_processing_run_key(run_id), mapping={'status': status, 'enqueued': 0})
+        pipe.expire(_processing_run_key(run_id), Config.PROCESSING_RUN_TTL)
+        await pipe.execute()
+    return run_id
+
+
+async def record_enqueued(run_id: str, count: int):
+    await get_async_redis().hincrby(_processing_run_key(run_id), 'enqueued', count)
+
+
+async def finish_processing_run(run_id: str, status: str):
+    await get_async_redis().hset(_processing_run_key(run_id), 'status', status)
+
+
+async def run_processing(run_id: str):
+    """
+    Drain all unprocessed tickets for a processing run, meant to run in the background.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            _, ticket_count = await enqueue_all_unprocessed_tickets(db, run_id)
+        logger.info(f"Processing run {run_id} enqueued {ticket_count} tickets")
+        run_status = 'finished'
+    except Exception:
+        logger.exception(f"Processing run {run_id} failed")
+        run_status = 'failed'
+    await finish_processing_run(run_id, run_status)
+
+
+async def get_processing_run(run_id: str):
+    """
+    Return the status and enqueued ticket count of a processing run, or None if it is unknown or expired.
     """
-    Enqueue a single ticket for processing based on its ID.
-    This function allows immediate processing of a newly created ticket.
+    run = await get_async_redis().hgetall(_processing_run_key(run_id))
+    if not run:
+        return None
+    return {'status': run[b'status'].decode(), 'enqueued': int(run[b'enqueued'])}
+
+
+async def _run_stage(stage: str, model: AIModel, func, *args, timer: Optional[ProcessingTimer] = None):
+    """
+    Run a single processing stage under its provider concurrency limit and stage timeout.
+    The timeout only covers the call itself, not the time spent waiting for a free slot.
+    """
+    metrics.set_stage(stage)
+    # The stage's own tokens, still added to the ticket's
+    usage = track_usage(nested=True)
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        with timer.stage(stage) if timer else contextlib.nullcontext() as timing:
+            # Routing models hold the slot of each provider they actually call themselves
+            limit = contextlib.nullcontext() if model.limits_concurrency else provider_semaphore(model.provider)
+            async with limit:
+                result = await asyncio.wait_for(func(model, *args),
+                                                timeout=getattr(Config, f'{stage.upper()}_TIMEOUT'))
+        outcome = "ok"
+        return result
+    finally:
+        metrics.stage_duration.labels(stage, outcome).observe(time.perf_counter() - started)
+        if timer:
+            usage.provider = usage.provider or model.provider
+            usage.model = usage.model or getattr(model, 'model', None)
+            timer.add_usage(timing, usage)
+
+
+async def _gather_stages(stages: dict) -> dict:
+    """
+    Run the given stage coroutines concurrently and return their results keyed by stage name.
+
+    With the 'fail' policy the first failing stage cancels the remaining ones and its exception is raised.
+    With the 'partial' policy every stage runs to completion and failed stages map to their exception.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in stages.values()]
+    if Config.PARTIAL_FAILURE_POLICY == 'partial':
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    else:
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+    return dict(zip(stages, results))
+
+
+def _classify_locally(subject: str, body: str) -> dict:
+    """
+    Return the local classifier's confident predictions as stage results ('categorize' and/or 'prioritize').
+    """
+    classifier = get_classifier()
+    if classifier is None:
+        return {}
+    category, category_confidence, priority, priority_confidence = classifier.predict_batch([subject], [body])[0]
+    predictions = {}
+    if category_confidence >= Config.CLASSIFIER_THRESHOLD:
+        predictions['categorize'] = (category, category_confidence)
+    if priority_confidence >= Config.CLASSIFIER_THRESHOLD:
+        predictions['prioritize'] = (priority, priority_confidence)
+    return predictions
+
+
+def _kept_results(ticket: Ticket) -> dict:
+    """
+    Return the stored results of a ticket in the form of the stage results that produce them.
     """
-    logger.info(f"Enqueuing ticket with ID: {ticket_id} for processing")
-    queue.enqueue('app.processing.process_ticket', ticket_id)
-    return f"Ticket {ticket_id} enqueued for processing"
+    kept = {}
+    if ticket.category is not None:
+        kept['categorize'] = (ticket.category.value, ticket.category_confidence)
+    if ticket.priority is not None:
+        kept['prioritize'] = (ticket.priority.value, ticket.priority_confidence)
+    if ticket.initial_response is not None:
+        kept['response'] = ticket.initial_response
+    return kept
 
 
-async def process_ticket(ticket_id: str):
+async def _find_duplicate(db: AsyncSession, ticket: Ticket, signature) -> Optional[Ticket]:
+    """
+    Return the processed near-duplicate of the ticket whose results can be reused, if there is one.
+    """
+    try:
+        match = await get_duplicate_index().find(signature, Config.DEDUP_THRESHOLD)
+    except Exception as e:
+        logger.warning(f"Duplicate lookup failed for ticket {ticket.id}: {e!r}")
+        return None
+    if match is None:
+        return None
+    source = await db.get(Ticket, uuid.UUID(match[0]))
+    if (source is None or source.id == ticket.id or source.status != TicketStatus.processed
+            or source.category is None or source.priority is None or source.initial_response is None):
+        return None
+    logger.info(f"Ticket {ticket.id} is a near-duplicate of ticket {source.id} (similarity {match[1]:.2f})")
+    return source
+
+
+async def _index_ticket(ticket_id, signature):
+    try:
+        await get_duplicate_index().add(ticket_id, signature)
+    except Exception as e:
+        logger.warning(f"Failed to index ticket {ticket_id} for duplicate detection: {e!r}")
+
+
+def _job_enqueued_at() -> Optional[datetime]:
+    # Tickets queued as RQ jobs carry their enqueue time on the job
+    job = get_current_job()
+    if job is None or job.enqueued_at is None:
+        return None
+    return job.enqueued_at.replace(tzinfo=timezone.utc)
+
+
+async def _save_timings(ticket_id, timer: ProcessingTimer, outcome: str):
+    try:
+        async with AsyncSessionLocal() as db:
+            await create_processing_run(db, timer.as_row(uuid.UUID(str(ticket_id)), outcome))
+    except Exception as e:
+        logger.warning(f"Failed to store processing timings of ticket {ticket_id}: {e!r}")
+
+
+async def process_ticket(ticket_id: str, enqueued_at: Optional[float] = None):
     """
     Process a single ticket using AI services to categorize, prioritize,
     and generate an initial response.
+    The stages are independent of each other, so they run concurrently.
+    `enqueued_at` is the Unix time the ticket was queued, for the timing breakdown of the attempt.
     """
+    timer = ProcessingTimer(datetime.fromtimestamp(enqueued_at, timezone.utc) if enqueued_at is not None
+                            else _job_enqueued_at())
+    metrics.tickets_in_flight.labels().inc()
+    outcome = "failed"
+    try:
+        outcome = await _process_ticket(ticket_id, timer)
+    finally:
+        metrics.tickets_in_flight.labels().dec()
+        metrics.tickets_processed.labels(outcome).inc()
+        if Config.PROCESSING_TIMINGS_ENABLED and outcome != "missing":
+            await _save_timings(ticket_id, timer, outcome)
+
+
+async def _process_ticket(ticket_id: str, timer: ProcessingTimer) -> str:
     async with AsyncSessionLocal() as db:
-        ticket = await get_ticket_by_id(db, ticket_id)
-        if not ticket:
-            print(f"No ticket found with ID: {ticket_id}")
-            return
+        with timer.stage('load'):
+            ticket = await get_ticket_by_id(db, ticket_id)
+            if not ticket:
+                print(f"No ticket found with ID: {ticket_id}")
+                return "missing"
 
-        logger.info(f"Processing ticket: {ticket_id}")
+            logger.info(f"Processing ticket: {ticket_id}")
+            signature = get_duplicate_index().signature(ticket.subject, ticket.body) if Config.DEDUP_ENABLED else None
+            source = await _find_duplicate(db, ticket, signature) if signature is not None else None
+            # End the read transaction so the connection goes back to the pool while the AI calls run
+            await db.commit()
+
+        if source is not None:
+            # Reuse the results of a near-duplicate processed ticket instead of calling the AI models
+            with timer.stage('update'):
+                await update_ticket(db, ticket.id, TicketUpdateRequest(
+                    status=TicketStatus.processed, processed_at=datetime.utcnow(),
+                    category=source.category.value, category_confidence=source.category_confidence,
+                    priority=source.priority.value, priority_confidence=source.priority_confidence,
+                    initial_response=source.initial_response, reused_from_ticket_id=source.id,
+                    input_tokens=0, output_tokens=0, failed_stages=None, labels_source='reused',
+                ))
+            logger.info(f"Ticket processed: {ticket_id}")
+            return "reused"
+
+        # Confident local predictions replace the matching AI triage stages
+        local = _classify_locally(ticket.subject, ticket.body)
+        if local:
+            logger.info(f"Classified ticket {ticket_id} locally: {', '.join(local)}")
+        # A retry of a partially processed ticket keeps the results of the stages that succeeded before
+        kept = _kept_results(ticket) if ticket.failed_stages else {}
+        if kept:
+            logger.info(f"Retrying stages {', '.join(ticket.failed_stages)} of ticket {ticket_id}")
+        known = {**local, **{stage: kept[stage] for stage in ('categorize', 'prioritize') if stage in kept}}
 
         # AI Integration: Categorize, prioritize, and generate response
-        category, category_confidence = await categorize_ticket(openai_model, ticket.subject, ticket.body)
-        priority, priority_confidence = await prioritize_ticket(openai_model, ticket.subject, ticket.body)
-        initial_response = await generate_response(anthropic_model, ticket.subject, ticket.body)
-
-        # Prepare the ticket update payload
-        ticket_update_data = TicketUpdateRequest(
-            status=TicketStatus.processed,
-            category=category,
-            category_confidence=category_confidence,
-            priority=priority,
-            priority_confidence=priority_confidence,
-            initial_response=initial_response,
-            processed_at=datetime.utcnow()
-        )
+        triage_model, response_model = get_task_model('triage'), get_task_model('response')
+        usage = track_usage()
+        stages = {}
+        if Config.TRIAGE_MODE == 'combined':
+            if len(known) < 2:
+                stages['triage'] = _run_stage('triage', triage_model, triage_ticket, ticket.subject, ticket.body,
+                                              timer=timer)
+                known = {}
+        else:
+            if 'categorize' not in known:
+                stages['categorize'] = _run_stage('categorize', triage_model, categorize_ticket,
+                                                  ticket.subject, ticket.body, timer=timer)
+            if 'prioritize' not in known:
+                stages['prioritize'] = _run_stage('prioritize', triage_model, prioritize_ticket,
+                                                  ticket.subject, ticket.body, timer=timer)
+        response_stream = None
+        if 'response' not in kept:
+            # Streamed responses are relayed to GET /ticket/{id}/response/stream while they are generated
+            response_stream = ResponseStream(ticket.id) if Config.STREAM_RESPONSES else None
+            # An already known category bounds the response length
+            respond = (functools.partial(generate_response, category=known['categorize'][0])
+                       if 'categorize' in known else generate_response)
+            stages['response'] = _run_stage('response', response_model, respond, ticket.subject, ticket.body,
+                                            response_stream.publish if response_stream else None, timer=timer)
+        results = {}
+        try:
+            results = await _gather_stages(stages)
+        finally:
+            if response_stream:
+                await response_stream.close(error=not isinstance(results.get('response'), str))
+        results.update(known)
+        if 'response' in kept:
+            results['response'] = kept['response']
+
+        failed = {stage: result for stage, result in results.items() if isinstance(result, BaseException)}
+        if len(failed) == len(results):
+            raise next(iter(failed.values()))
+        for stage, error in failed.items():
+            logger.warning(f"Stage {stage} failed for ticket {ticket_id}: {error!r}")
+        succeeded = {stage: result for stage, result in results.items() if stage not in failed}
+
+        # Prepare the ticket update payload, leaving the fields of failed stages empty. A partially processed
+        # ticket goes back to 'submitted' with its failed stages recorded, so the next processing run retries them
+        updates = dict(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+        if kept:
+            updates['input_tokens'] += ticket.input_tokens or 0
+            updates['output_tokens'] += ticket.output_tokens or 0
+        if failed:
+            updates.update(status=TicketStatus.submitted, failed_stages=sorted(failed))
+        else:
+            updates.update(status=TicketStatus.processed, processed_at=datetime.utcnow(), failed_stages=None)
+        if 'triage' in succeeded:
+            (updates['category'], updates['category_confidence'],
+             updates['priority'], updates['priority_confidence']) = succeeded['triage']
+        if 'categorize' in succeeded:
+            updates['category'], updates['category_confidence'] = succeeded['categorize']
+        if 'prioritize' in succeeded:
+            updates['priority'], updates['priority_confidence'] = succeeded['prioritize']
+        if 'category' in updates or 'priority' in updates:
+            # Only AI labels are used to train the local classifier; labels kept from an earlier attempt keep its source
+            from_local = any(stage not in kept or ticket.labels_source == 'local' for stage in known)
+            updates['labels_source'] = 'local' if from_local else 'ai'
+        if 'response' in succeeded:
+            updates['initial_response'] = succeeded['response']
+        ticket_update_data = TicketUpdateRequest(**updates)
 
         # Update the ticket with new data
-        await update_ticket(db, ticket.id, ticket_update_data)
+        with timer.stage('update'):
+            await update_ticket(db, ticket.id, ticket_update_data)
+            if signature is not None and {'category', 'priority', 'initial_response'} <= updates.keys():
+                await _index_ticket(ticket.id, signature)
         logger.info(f"Ticket processed: {ticket_id}")
+        return "processed" if not failed else "partial"
@@ -0,0 +1,156 @@
+import re
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from app.config import Config
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts are estimated without it
+    tiktoken = None
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_QUOTE_HEADER_RE = re.compile(r"^(On\s.+\swrote:|-{2,}\s*(Original|Forwarded) Message\s*-{2,})$", re.IGNORECASE)
+_SIGNATURE_RE = re.compile(r"^(--|Sent from my .+|Get Outlook for .+)$", re.IGNORECASE)
+
+# Completion sizes of the classification tasks, which answer with a small JSON object
+MAX_TOKENS = {
+    'categorize': 50,
+    'prioritize': 50,
+    'triage': 100,
+}
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding cannot be downloaded
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of the text with tiktoken when it is available, otherwise estimate them
+    as one token per word or punctuation mark, and at least one per four characters.
+    """
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(len(_WORD_RE.findall(text)), len(text) // 4)
+
+
+def strip_quotes_and_signature(body: str) -> str:
+    """
+    Drop quoted earlier messages of an email thread and the sender's signature.
+    """
+    lines = body.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
+        # Everything after a reply header or a signature delimiter is quoted or boilerplate
+        if (_QUOTE_HEADER_RE.match(stripped) or _SIGNATURE_RE.match(stripped)
+                or (stripped.startswith("From:") and next_line.startswith(("Sent:", "Date:")))):
+            break
+        if not stripped.startswith(">"):
+            kept.append(line.rstrip())
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+    # A body that is nothing but a quote is kept as it is
+    return text or body.strip()
+
+
+def truncate(text: str, budget: int) -> str:
+    """
+    Shorten a text over `budget` tokens to its head and tail, which is where pasted logs and threads
+    usually carry the question and the error.
+    """
+    total = count_tokens(text)
+    if total <= budget:
+        return text
+    head_budget = budget * 2 // 3
+    tail_budget = budget - head_budget
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        head = encoding.decode(tokens[:head_budget])
+        tail = encoding.decode(tokens[len(tokens) - tail_budget:])
+    else:
+        chars_per_token = len(text) / total
+        head = text[:int(head_budget * chars_per_token)]
+        tail = text[len(text) - int(tail_budget * chars_per_token):]
+    return f"{head}\n[... {total - budget} tokens omitted ...]\n{tail}"
+
+
+def fit_body(body: str, task: str) -> str:
+    """
+    Prepare a ticket body for the prompt of a task ('triage' or 'response'), within the task's token budget.
+    """
+    budget = getattr(Config, f'{task.upper()}_PROMPT_TOKEN_BUDGET')
+    return truncate(strip_quotes_and_signature(body), budget)
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        category, _, limit = item.partition("=")
+        limits[category.strip()] = int(limit)
+    return limits
+
+
+_response_limits = None
+
+
+def max_tokens_for(task: str, category=None) -> int:
+    """
+    Return the completion size of a task; responses are sized by category when it is already known.
+    """
+    global _response_limits
+    if task != 'response':
+        return MAX_TOKENS[task]
+    if _response_limits is None:
+        _response_limits = _parse_limits(Config.RESPONSE_MAX_TOKENS_BY_CATEGORY)
+    category = getattr(category, 'value', category)
+    return _response_limits.get(category, Config.RESPONSE_MAX_TOKENS)
+
+
+class TokenUsage:
+    """
+    Tokens used by the AI calls of a ticket, or of one of its stages when `parent` is the ticket's usage.
+    `provider` and `model` are those of the last call recorded.
+    """
+
+    def __init__(self, parent: Optional['TokenUsage'] = None):
+        self.parent = parent
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.provider = None
+        self.model = None
+
+
+_usage: ContextVar[Optional[TokenUsage]] = ContextVar('token_usage', default=None)
+
+
+def track_usage(nested: bool = False) -> TokenUsage:
+    """
+    Start adding up the tokens of the AI calls made from the current context, including the tasks it starts.
+    A nested usage also adds its tokens to the usage tracked so far.
+    """
+    usage = TokenUsage(_usage.get() if nested else None)
+    _usage.set(usage)
+    return usage
+
+
+def record_usage(input_tokens: Optional[int], output_tokens: Optional[int], provider: Optional[str] = None,
+                 model: Optional[str] = None):
+    usage = _usage.get()
+    while usage is not None:
+        usage.input_tokens += input_tokens or 0
+        usage.output_tokens += output_tokens or 0
+        usage.provider, usage.model = provider or usage.provider, model or usage.model
+        usage = usage.parent
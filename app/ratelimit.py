@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Mapping, Optional, Tuple
+
+from app.config import Config
+from app.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Per provider: requests limit, requests remaining, tokens limit, tokens remaining
+RATE_LIMIT_HEADERS = {
+    "openai": ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests",
+               "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"),
+    "anthropic": ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining",
+                  "anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining"),
+}
+
+
+def estimate_tokens(system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+    """
+    Upper estimate of what a completion counts against the tokens-per-minute quota:
+    the prompt at roughly four characters per token, plus the full max_tokens.
+    """
+    return (len(system_prompt) + len(user_prompt)) // 4 + 1 + max_tokens
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = _header_number(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return _header_number(headers, "retry-after")
+
+
+class BucketStore(ABC):
+    @abstractmethod
+    async def take(self, key: str, capacity: float, rate: float, amount: float,
+                   ceiling: Optional[float] = None) -> float:
+        """
+        Refill the bucket at `rate` per second up to `capacity`, lower it to `ceiling` if given, and take `amount`
+        from it. The bucket may go into debt; returns the seconds to wait until the debt is paid off.
+        """
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    Buckets of this process only.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+
+    async def take(self, key: str, capacity: float, rate: float, amount: float,
+                   ceiling: Optional[float] = None) -> float:
+        now = time.monotonic()
+        level, updated_at = self._buckets.get(key, (capacity, now))
+        level = min(capacity, level + (now - updated_at) * rate)
+        if ceiling is not None:
+            level = min(level, ceiling)
+        level -= amount
+        self._buckets[key] = (level, now)
+        return max(0.0, -level / rate)
+
+
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'level', 'updated_at')
+local level = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+level = math.min(capacity, level + math.max(0, now - updated_at) * rate)
+if ARGV[4] ~= '' then
+    level = math.min(level, tonumber(ARGV[4]))
+end
+level = level - tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return tostring(math.max(0, -level / rate))
+"""
+
+
+class RedisBucketStore(BucketStore):
+    """
+    Buckets shared by every process using the same Redis, updated atomically by a Lua script.
+    """
+
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+
+    async def take(self, key: str, capacity: float, rate: float, amount: float,
+                   ceiling: Optional[float] = None) -> float:
+        script = get_async_redis().register_script(_TAKE_SCRIPT)
+        wait = await script(keys=[key], args=[capacity, rate, amount, "" if ceiling is None else ceiling,
+                                              time.time(), self.ttl])
+        return float(wait)
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limits of one provider.
+    The allowed rate adapts by additive increase / multiplicative decrease: a 429 cuts it and pauses every caller
+    for the retry-after period, each successful call wins part of it back. The limits themselves follow the
+    provider's rate-limit headers, so the quota can be used up to its actual size.
+    """
+
+    def __init__(self, provider: str, rpm: float, tpm: float, store: BucketStore, burst_seconds: float = 5,
+                 max_retries: int = 5, increase: float = 0.05, decrease: float = 0.5, min_factor: float = 0.05):
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+        self.store = store
+        self.burst_seconds = burst_seconds
+        self.max_retries = max_retries
+        self.increase = increase
+        self.decrease = decrease
+        self.min_factor = min_factor
+        self.factor = 1.0
+
+    def _rates(self) -> Tuple[float, float]:
+        return self.rpm * self.factor / 60, self.tpm * self.factor / 60
+
+    async def _take(self, requests: float, tokens: float,
+                    ceilings: Tuple[Optional[float], Optional[float]] = (None, None)) -> float:
+        request_rate, token_rate = self._rates()
+        waits = await asyncio.gather(
+            self.store.take(f"ratelimit:{self.provider}:requests", request_rate * self.burst_seconds,
+                            request_rate, requests, ceilings[0]),
+            self.store.take(f"ratelimit:{self.provider}:tokens", token_rate * self.burst_seconds,
+                            token_rate, tokens, ceilings[1]),
+        )
+        return max(waits)
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until one request of `tokens` tokens fits in both limits.
+        """
+        wait = await self._take(1, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def on_response(self, headers: Mapping[str, str]):
+        self.factor = min(1.0, self.factor + self.increase)
+        names = RATE_LIMIT_HEADERS.get(self.provider)
+        if names is None:
+            return
+        requests_limit, requests_remaining, tokens_limit, tokens_remaining = (
+            _header_number(headers, name) for name in names)
+        if requests_limit:
+            self.rpm = requests_limit
+        if tokens_limit:
+            self.tpm = tokens_limit
+        # Other clients may share the quota: never assume more is left than the provider reports
+        request_rate, token_rate = self._rates()
+        if ((requests_remaining is not None and requests_remaining < request_rate * self.burst_seconds)
+                or (tokens_remaining is not None and tokens_remaining < token_rate * self.burst_seconds)):
+            await self._take(0, 0, (requests_remaining, tokens_remaining))
+
+    async def on_rate_limited(self, retry_after: float):
+        self.factor = max(self.min_factor, self.factor * self.decrease)
+        request_rate, token_rate = self._rates()
+        await self._take(0, 0, (-request_rate * retry_after, -token_rate * retry_after))
+
+    async def run(self, call: Callable[[], Awaitable], tokens: int, retry_on: Tuple[type, ...] = ()):
+        """
+        Make a raw-response API call within the limits, retrying 429s, server errors and `retry_on` errors.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(tokens)
+            try:
+                response = await call()
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                retryable = status == 429 or (status is not None and status >= 500) or isinstance(e, retry_on)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                if status == 429:
+                    retry_after = _retry_after(e.response.headers) or 1.0
+                    logger.warning(f"{self.provider} rate limited, retrying in {retry_after}s")
+                    await self.on_rate_limited(retry_after)
+                else:
+                    await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+                continue
+            await self.on_response(response.headers)
+            return response
+
+
+_rate_limiters = {}
+
+
+def get_rate_limiter(provider: str) -> Optional[RateLimiter]:
+    """
+    Return the process-wide rate limiter of the provider, or None when RATE_LIMIT_BACKEND is 'none'.
+    """
+    if Config.RATE_LIMIT_BACKEND == 'none':
+        return None
+    if provider not in _rate_limiters:
+        store = RedisBucketStore() if Config.RATE_LIMIT_BACKEND == 'redis' else MemoryBucketStore()
+        limits = {
+            "openai": (Config.OPENAI_RPM, Config.OPENAI_TPM),
+            "anthropic": (Config.ANTHROPIC_RPM, Config.ANTHROPIC_TPM),
+        }
+        rpm, tpm = limits[provider]
+        _rate_limiters[provider] = RateLimiter(provider, rpm, tpm, store, burst_seconds=Config.RATE_LIMIT_BURST_SECONDS,
+                                               max_retries=Config.RATE_LIMIT_MAX_RETRIES)
+    return _rate_limiters[provider]
+
+
+# Semaphores are bound to the event loop they are first used on, so keep one set per loop
+_provider_semaphores = weakref.WeakKeyDictionary()
+
+
+def provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """
+    Return the semaphore limiting concurrent requests to the given AI provider on the running loop.
+    """
+    semaphores = _provider_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if provider not in semaphores:
+        limit = getattr(Config, f'{provider.upper()}_MAX_CONCURRENCY')
+        semaphores[provider] = asyncio.Semaphore(limit)
+    return semaphores[provider]
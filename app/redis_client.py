@@ -0,0 +1,19 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+
+from app.config import Config
+
+# Async Redis connections are bound to the event loop they were opened on, so keep one client per loop
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Return the async Redis client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = aioredis.Redis(host=Config.REDIS_HOST, port=Config.REDIS_PORT)
+    return _clients[loop]
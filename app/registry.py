@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from app.ai import AIModel, AnthropicModel, OpenAIModel
+from app.config import Config
+from app.routing import RoutingModel
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {
+    "openai": OpenAIModel,
+    "anthropic": AnthropicModel,
+}
+
+# Shared by every ticket processed in this process; created on first use
+_models = {}
+_task_models = {}
+
+
+def get_model(provider: str, model: str) -> AIModel:
+    """
+    Return the client of the given provider and model, creating it on first use.
+    """
+    key = (provider, model)
+    if key not in _models:
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown AI provider: {provider}")
+        _models[key] = PROVIDERS[provider](model)
+    return _models[key]
+
+
+def get_task_model(task: str) -> AIModel:
+    """
+    Return the model configured for a pipeline task ('triage' or 'response'),
+    routed through its fallback model when one is configured and routing is enabled.
+    """
+    if task not in _task_models:
+        prefix = task.upper()
+        model = get_model(getattr(Config, f'{prefix}_PROVIDER'), getattr(Config, f'{prefix}_MODEL'))
+        fallback_provider = getattr(Config, f'{prefix}_FALLBACK_PROVIDER')
+        if Config.ROUTING_ENABLED and fallback_provider:
+            model = RoutingModel(model, get_model(fallback_provider, getattr(Config, f'{prefix}_FALLBACK_MODEL')))
+        _task_models[task] = model
+    return _task_models[task]
+
+
+async def warm_up(tasks: Iterable[str] = ('triage', 'response')):
+    """
+    Create the models of the given tasks and open their provider connections; failures are only logged.
+    """
+    for task in tasks:
+        get_task_model(task)
+    models = list(_models.values())
+    results = await asyncio.gather(*(model.warm_up() for model in models), return_exceptions=True)
+    for model, result in zip(models, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up of {model.provider} model {model.model} failed: {result!r}")
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+import numpy as np
+
+from app.ai import AIModel
+from app.config import Config
+from app.ratelimit import provider_semaphore
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    """
+    Latencies and outcomes of the calls to one provider during the last `window` seconds.
+    Calls cancelled by a faster hedge have no outcome, but their latency counts as a lower bound.
+    """
+
+    def __init__(self, window: float, max_samples: int = 1000):
+        self.window = window
+        self._samples = deque(maxlen=max_samples)
+
+    def record(self, kind: str, latency: float, ok: Optional[bool]):
+        self._samples.append((time.monotonic(), kind, latency, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return self._samples
+
+    def percentile(self, kind: str, q: float, min_samples: int) -> Optional[float]:
+        latencies = [latency for _, sample_kind, latency, ok in self._recent()
+                     if sample_kind == kind and ok is not False]
+        if len(latencies) < min_samples:
+            return None
+        return float(np.percentile(latencies, q))
+
+    def error_rate(self, min_samples: int) -> Optional[float]:
+        outcomes = [ok for _, _, _, ok in self._recent() if ok is not None]
+        if len(outcomes) < min_samples:
+            return None
+        return 1 - sum(outcomes) / len(outcomes)
+
+
+class RoutingModel(AIModel):
+    """
+    Sends requests to the primary model, hedging with a duplicate request to the secondary when the primary takes
+    longer than its recent p95 latency (or fails) and keeping whichever answers first.
+    While the primary's recent error rate is above the threshold, the secondary becomes the primary.
+    Each call holds a concurrency slot of the provider it goes to, so hedges respect the secondary's limit too.
+    """
+    limits_concurrency = True
+
+    def __init__(self, primary: AIModel, secondary: AIModel, hedge_percentile: float = Config.ROUTING_HEDGE_PERCENTILE,
+                 error_threshold: float = Config.ROUTING_ERROR_THRESHOLD, window: float = Config.ROUTING_WINDOW,
+                 min_samples: int = Config.ROUTING_MIN_SAMPLES):
+        self.primary = primary
+        self.secondary = secondary
+        # Reported as the provider in metrics and usage
+        self.provider = primary.provider
+        self.hedge_percentile = hedge_percentile
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        # Keyed by model rather than provider: primary and secondary may be two models of the same provider
+        self.stats = {model: ProviderStats(window) for model in (primary, secondary)}
+
+    def _healthy(self, model: AIModel) -> bool:
+        error_rate = self.stats[model].error_rate(self.min_samples)
+        return error_rate is None or error_rate < self.error_threshold
+
+    def _order(self) -> Tuple[AIModel, AIModel]:
+        if not self._healthy(self.primary) and self._healthy(self.secondary):
+            return self.secondary, self.primary
+        return self.primary, self.secondary
+
+    async def _timed(self, model: AIModel, kind: str, call: Awaitable):
+        stats = self.stats[model]
+        started = time.monotonic()
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            # A hedged-away call was at least this slow; keep it so the tail stays visible in the percentiles
+            stats.record(kind, time.monotonic() - started, ok=None)
+            raise
+        except Exception:
+            stats.record(kind, time.monotonic() - started, ok=False)
+            raise
+        stats.record(kind, time.monotonic() - started, ok=True)
+        return result
+
+    async def _hedged(self, kind: str, call: Callable[[AIModel], Awaitable],
+                      discard: Optional[Callable[[object], None]] = None):
+        primary, secondary = self._order()
+        tasks = {asyncio.ensure_future(self._timed(primary, kind, call(primary))): primary}
+        winner = None
+        try:
+            hedge_after = self.stats[primary].percentile(kind, self.hedge_percentile, self.min_samples)
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done or next(iter(done)).exception() is not None:
+                logger.info(f"Hedging {kind} request from {primary.provider} to {secondary.provider}")
+                tasks[asyncio.ensure_future(self._timed(secondary, kind, call(secondary)))] = secondary
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif discard and task is not winner and not task.cancelled() and task.exception() is None:
+                    discard(task.result())
+
+    @staticmethod
+    async def _limited(model: AIModel, call: Awaitable):
+        async with provider_semaphore(model.provider):
+            return await call
+
+    async def get_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+        return await self._hedged("completion", lambda model: self._limited(
+            model, model.get_completion(system_prompt, user_prompt, max_tokens)))
+
+    async def stream_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        # Only the wait for the first chunk is hedged: chunks already relayed cannot be taken back
+        async def first_chunk(model: AIModel):
+            semaphore = provider_semaphore(model.provider)
+            await semaphore.acquire()
+            # The slot is held until the stream is exhausted or closed
+            iterator = _releasing(model.stream_completion(system_prompt, user_prompt, max_tokens), semaphore)
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, None
+            except BaseException:
+                await iterator.aclose()
+                raise
+
+        iterator, chunk = await self._hedged(
+            "stream", first_chunk, discard=lambda result: asyncio.ensure_future(result[0].aclose()))
+        if chunk is None:
+            return
+        yield chunk
+        async for chunk in iterator:
+            yield chunk
+
+
+async def _releasing(iterator: AsyncIterator[str], semaphore: asyncio.Semaphore) -> AsyncIterator[str]:
+    try:
+        async for chunk in iterator:
+            yield chunk
+    finally:
+        semaphore.release()
@@ -1,9 +1,9 @@
 import enum
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, computed_field
 
 
 class TicketStatus(str, enum.Enum):
@@ -28,10 +28,11 @@ class TicketCategory(str, enum.Enum):
 
 # Schema for ticket submission
 class TicketCreateRequest(BaseModel):
-    subject: str = Field(..., example="Cannot access my account")
+    # subject and customer_email are VARCHAR(255) columns
+    subject: str = Field(..., max_length=255, example="Cannot access my account")
     body: str = Field(...,
                       example="I've been trying to log in for the past hour but keep getting an 'invalid credentials' error.")
-    customer_email: EmailStr = Field(..., example="user@example.com")
+    customer_email: EmailStr = Field(..., max_length=255, example="user@example.com")
 
 
 # Schema for ticket output
@@ -48,6 +49,14 @@ class TicketResponse(BaseModel):
     priority_confidence: Optional[float] = None
     created_at: datetime
     processed_at: Optional[datetime] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    reused_from_ticket_id: Optional[UUID] = None
+    failed_stages: Optional[List[str]] = None
+    labels_source: Optional[str] = None
+
+
+TICKET_FIELDS = tuple(TicketResponse.model_fields)
 
 
 class TicketCreationResponse(BaseModel):
@@ -56,6 +65,18 @@ class TicketCreationResponse(BaseModel):
     message: str
 
 
+class BulkTicketError(BaseModel):
+    row: int
+    detail: str
+
+
+class BulkTicketCreationResponse(BaseModel):
+    ticket_ids: List[UUID]
+    accepted: int
+    rejected: int
+    errors: List[BulkTicketError]
+
+
 # Schema for updating a ticket's status
 class TicketUpdateRequest(BaseModel):
     status: TicketStatus
@@ -65,3 +86,25 @@ class TicketUpdateRequest(BaseModel):
     category_confidence: Optional[float] = None
     priority_confidence: Optional[float] = None
     processed_at: Optional[datetime] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    reused_from_ticket_id: Optional[UUID] = None
+    failed_stages: Optional[List[str]] = None
+    labels_source: Optional[str] = None
+
+
+# Timing breakdown of a processing attempt; stage offsets are milliseconds from started_at
+class ProcessingRunResponse(BaseModel):
+    id: int
+    enqueued_at: Optional[datetime] = None
+    started_at: datetime
+    duration_ms: int
+    outcome: str
+    stages: Dict[str, dict]
+
+    @computed_field
+    @property
+    def queue_wait_ms(self) -> Optional[int]:
+        if self.enqueued_at is None:
+            return None
+        return round((self.started_at - self.enqueued_at).total_seconds() * 1000)
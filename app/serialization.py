@@ -0,0 +1,43 @@
+import datetime
+import decimal
+import enum
+import json
+import uuid
+from typing import Iterable
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used without it
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        # Same format as pydantic and orjson with OPT_UTC_Z
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """
+    Encode rows of database values (UUIDs, datetimes, enums) as compact JSON, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dump_rows(rows: Iterable) -> bytes:
+    """
+    Encode SQLAlchemy rows as a JSON array of objects keyed by column name, without building models.
+    """
+    return dumps([dict(row._mapping) for row in rows])
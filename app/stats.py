@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Same aggregation as the ticket_stats_apply() trigger, over the tickets themselves
+REBUILD_SQL = """
+    INSERT INTO ticket_stats_hourly
+    SELECT date_trunc('hour', created_at), status::text, coalesce(category::text, ''), coalesce(priority::text, ''),
+           count(*),
+           coalesce(sum(category_confidence), 0), count(category_confidence),
+           coalesce(sum(priority_confidence), 0), count(priority_confidence),
+           coalesce(sum(extract(epoch FROM processed_at - created_at)), 0), count(processed_at - created_at)
+    FROM tickets
+    WHERE created_at >= date_trunc('hour', CAST(:since AS timestamptz))
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+async def rebuild(since: Optional[datetime] = None) -> int:
+    """
+    Recompute the hourly ticket statistics from the hour containing `since` onwards (all of them by default),
+    for backfills and after changes made with the triggers disabled. Returns the number of rollup rows written.
+    """
+    since = since or datetime(1970, 1, 1, tzinfo=timezone.utc)
+    async with AsyncSessionLocal() as db:
+        # Ticket writes wait at their trigger until the rebuild commits, and are then applied on top of it
+        await db.execute(text("LOCK TABLE ticket_stats_hourly IN EXCLUSIVE MODE"))
+        await db.execute(text("DELETE FROM ticket_stats_hourly WHERE bucket >= date_trunc('hour', CAST(:since AS timestamptz))"),
+                         {"since": since})
+        result = await db.execute(text(REBUILD_SQL), {"since": since})
+        await db.commit()
+    return result.rowcount
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild the hourly ticket statistics from the tickets table.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Only rebuild the hours from this ISO timestamp (UTC unless it has an offset) onwards")
+    args = parser.parse_args()
+    since = args.since
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    rows = asyncio.run(rebuild(since))
+    logger.info(f"Rebuilt {rows} hourly ticket statistics rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+from typing import List, Tuple
+
+from app.config import Config
+from app.redis_client import get_async_redis
+
+
+def response_stream_key(ticket_id) -> str:
+    return f"ticket:{ticket_id}:response"
+
+
+class ResponseStream:
+    """
+    Publishes the chunks of a ticket's initial response to a Redis stream while it is generated,
+    so that readers can relay them before the ticket has finished processing.
+    Redis is only touched once the first chunk is published.
+    """
+
+    def __init__(self, ticket_id):
+        self.key = response_stream_key(ticket_id)
+        self._started = False
+
+    async def publish(self, delta: str):
+        redis = get_async_redis()
+        if self._started:
+            await redis.xadd(self.key, {"delta": delta})
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            # Drop the chunks of an earlier, failed attempt, and expire the stream even if close() is never reached
+            pipe.delete(self.key)
+            pipe.xadd(self.key, {"delta": delta})
+            pipe.expire(self.key, Config.RESPONSE_STREAM_TTL)
+            await pipe.execute()
+        self._started = True
+
+    async def close(self, error: bool = False):
+        if not self._started:
+            return
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.xadd(self.key, {"error" if error else "done": ""})
+            pipe.expire(self.key, Config.RESPONSE_STREAM_TTL)
+            await pipe.execute()
+
+
+async def read_response_stream(ticket_id, last_id: str = "0", block_ms: int = 1000) -> List[Tuple[str, dict]]:
+    """
+    Return the stream entries after `last_id` as (entry id, fields), waiting up to `block_ms` for new ones.
+    Each entry has a 'delta' field with a chunk of the response, or a 'done' or 'error' marker.
+    """
+    result = await get_async_redis().xread({response_stream_key(ticket_id): last_id}, block=block_ms)
+    if not result:
+        return []
+    _, entries = result[0]
+    return [
+        (entry_id.decode(), {field.decode(): value.decode() for field, value in fields.items()})
+        for entry_id, fields in entries
+    ]
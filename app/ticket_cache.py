@@ -0,0 +1,77 @@
+import hashlib
+import logging
+from typing import Iterable, Optional, Tuple
+
+from app import metrics
+from app.config import Config
+from app.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Stores a loaded ticket only if no invalidation happened since its version was read, so a reader that loaded
+# the ticket before a concurrent update cannot put the old version back into the cache
+_FILL_SCRIPT = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version == ARGV[2] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+end
+"""
+
+
+def ticket_cache_key(ticket_id) -> str:
+    return f"ticket:{ticket_id}:cached"
+
+
+def _version_key(ticket_id) -> str:
+    return f"ticket:{ticket_id}:version"
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+async def get_cached_ticket(ticket_id) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Return the cached serialized ticket, or None, and the invalidation version to pass to cache_ticket on a miss.
+    Redis errors count as a miss whose result is not cached.
+    """
+    try:
+        body, version = await get_async_redis().mget([ticket_cache_key(ticket_id), _version_key(ticket_id)])
+    except Exception as e:
+        metrics.ticket_cache_lookups.labels("error").inc()
+        logger.warning(f"Ticket cache lookup failed: {e!r}")
+        return None, None
+    metrics.ticket_cache_lookups.labels("hit" if body is not None else "miss").inc()
+    return body, (version or b"").decode()
+
+
+async def cache_ticket(ticket_id, body: bytes, version: Optional[str]):
+    """
+    Store a serialized ticket read after get_cached_ticket returned `version`, unless it has been invalidated since.
+    """
+    if version is None:
+        return
+    try:
+        script = get_async_redis().register_script(_FILL_SCRIPT)
+        await script(keys=[ticket_cache_key(ticket_id), _version_key(ticket_id)],
+                     args=[body, version, Config.TICKET_CACHE_TTL])
+    except Exception as e:
+        logger.warning(f"Ticket cache store failed: {e!r}")
+
+
+async def invalidate_tickets(ticket_ids: Iterable):
+    """
+    Drop the cached tickets and bump their versions. Call it after the change has been committed.
+    Failures are logged, not raised: the change is already committed, and stale entries expire after TICKET_CACHE_TTL.
+    """
+    if not Config.TICKET_CACHE_ENABLED:
+        return
+    try:
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            for ticket_id in ticket_ids:
+                pipe.incr(_version_key(ticket_id))
+                pipe.expire(_version_key(ticket_id), Config.TICKET_CACHE_TTL)
+                pipe.delete(ticket_cache_key(ticket_id))
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Ticket cache invalidation failed: {e!r}")
@@ -0,0 +1,47 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.prompts import TokenUsage
+
+
+class ProcessingTimer:
+    """
+    Timing breakdown of one processing attempt of a ticket. Stages are recorded as start and end offsets in
+    milliseconds from the start of the attempt, with the provider, model and tokens of their AI calls.
+    """
+
+    def __init__(self, enqueued_at: Optional[datetime] = None):
+        self.enqueued_at = enqueued_at
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.stages = {}
+
+    def _offset(self) -> int:
+        return round((time.perf_counter() - self._started) * 1000)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the block as the named stage; the yielded dict takes extra attributes of the stage.
+        """
+        timing = {"start": self._offset()}
+        self.stages[name] = timing
+        try:
+            yield timing
+            timing["ok"] = True
+        except BaseException:
+            timing["ok"] = False
+            raise
+        finally:
+            timing["end"] = self._offset()
+
+    @staticmethod
+    def add_usage(timing: dict, usage: TokenUsage):
+        timing.update(provider=usage.provider, model=usage.model, input_tokens=usage.input_tokens,
+                      output_tokens=usage.output_tokens)
+
+    def as_row(self, ticket_id, outcome: str) -> dict:
+        return dict(ticket_id=ticket_id, enqueued_at=self.enqueued_at, started_at=self.started_at,
+                    duration_ms=self._offset(), outcome=outcome, stages=self.stages)
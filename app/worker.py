@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from app.config import Config
+from app.crud import update_ticket_status
+from app.database import AsyncSessionLocal, use_pool_profile
+from app.metrics import start_metrics_server
+from app.models import TicketStatus
+from app.processing import parse_queue_entry, process_ticket, queue_entry
+from app.redis_client import get_async_redis
+from app.registry import warm_up
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Failed attempts of the tickets being retried, by ticket id
+ATTEMPTS_KEY = f"{Config.TICKET_QUEUE_KEY}:attempts"
+
+
+class TicketWorker:
+    """
+    Pulls ticket ids from the Redis queue in batches and processes up to `concurrency` of them at once
+    on a single event loop, sharing the AI clients and the database pool between tickets.
+    A failed ticket is queued again up to `max_attempts` times, then put back to 'submitted' for the next
+    `POST /process` and recorded in the `<queue>:failed` list.
+    """
+
+    def __init__(self, redis_client, concurrency: int = Config.WORKER_CONCURRENCY,
+                 batch_size: int = Config.WORKER_BATCH_SIZE, poll_timeout: int = Config.WORKER_POLL_TIMEOUT,
+                 max_attempts: int = Config.WORKER_MAX_ATTEMPTS):
+        self.redis = redis_client
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.max_attempts = max_attempts
+        self._tasks = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """
+        Stop pulling new tickets; tickets already in flight are finished before run() returns.
+        """
+        logger.info("Worker shutting down, finishing in-flight tickets")
+        self._stopping.set()
+
+    async def run(self):
+        while not self._stopping.is_set():
+            free = self.concurrency - len(self._tasks)
+            if not free:
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            for entry in await self._fetch(min(free, self.batch_size)):
+                task = asyncio.ensure_future(self._process(*parse_queue_entry(entry)))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        logger.info("Worker stopped")
+
+    async def _fetch(self, count: int) -> list:
+        ticket_ids = await self.redis.lpop(Config.TICKET_QUEUE_KEY, count)
+        if ticket_ids:
+            return [ticket_id.decode() for ticket_id in ticket_ids]
+        # Block briefly on an empty queue; the short timeout keeps shutdown responsive
+        item = await self.redis.blpop([Config.TICKET_QUEUE_KEY], timeout=self.poll_timeout)
+        return [item[1].decode()] if item else []
+
+    async def _process(self, ticket_id: str, enqueued_at: Optional[float]):
+        try:
+            await process_ticket(ticket_id, enqueued_at)
+        except Exception:
+            logger.exception(f"Failed to process ticket {ticket_id}")
+            await self._retry(ticket_id)
+        else:
+            await self.redis.hdel(ATTEMPTS_KEY, ticket_id)
+
+    async def _retry(self, ticket_id: str):
+        attempts = await self.redis.hincrby(ATTEMPTS_KEY, ticket_id, 1)
+        if attempts < self.max_attempts:
+            await self.redis.rpush(Config.TICKET_QUEUE_KEY, queue_entry(ticket_id))
+            return
+        logger.error(f"Giving up on ticket {ticket_id} after {attempts} attempts")
+        # Otherwise it would stay 'processing' and never be claimed again
+        async with AsyncSessionLocal() as db:
+            await update_ticket_status(db, ticket_id, TicketStatus.submitted)
+        await self.redis.hdel(ATTEMPTS_KEY, ticket_id)
+        await self.redis.rpush(f"{Config.TICKET_QUEUE_KEY}:failed", ticket_id)
+
+
+async def run_worker():
+    if Config.MODEL_WARM_UP:
+        await warm_up()
+    metrics_server = await start_metrics_server(Config.METRICS_PORT) if Config.METRICS_PORT else None
+    worker = TicketWorker(get_async_redis())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+    if metrics_server:
+        metrics_server.close()
+
+
+def main():
+    # One pooled engine shared by every ticket processed on this loop
+    use_pool_profile('worker')
+    asyncio.run(run_worker())
+
+
+if __name__ == '__main__':
+    main()
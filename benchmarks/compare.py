@@ -0,0 +1,46 @@
+"""
+Compare two load benchmark results: python -m benchmarks.compare baseline.json candidate.json
+"""
+import argparse
+import json
+from typing import List, Optional
+
+SECTIONS = ("submit", "processing", "list")
+STATISTICS = ("throughput", "p50", "p95", "p99", "max")
+
+
+def compare(baseline: dict, candidate: dict) -> List[tuple]:
+    """
+    Return (metric, baseline, candidate, relative change) for every statistic present in both results.
+    """
+    rows = []
+    for section in SECTIONS:
+        for statistic in STATISTICS:
+            before = baseline.get(section, {}).get(statistic)
+            after = candidate.get(section, {}).get(statistic)
+            if before is None or after is None:
+                continue
+            change: Optional[float] = (after - before) / before if before else None
+            rows.append((f"{section}.{statistic}", before, after, change))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load benchmark results.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{'metric':<24}{(baseline.get('commit') or 'baseline')[:12]:>14}{(candidate.get('commit') or 'candidate')[:12]:>14}"
+          f"{'change':>10}")
+    for metric, before, after, change in compare(baseline, candidate):
+        change_text = f"{change:+.1%}" if change is not None else "n/a"
+        print(f"{metric:<24}{before:>14.3f}{after:>14.3f}{change_text:>10}")
+
+
+if __name__ == '__main__':
+    main()
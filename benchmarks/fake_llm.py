@@ -0,0 +1,235 @@
+"""
+Fake OpenAI and Anthropic API server for load benchmarks.
+
+Point the app at it with OPENAI_BASE_URL=http://<host>:<port>/v1 and ANTHROPIC_BASE_URL=http://<host>:<port>.
+Completions take a log-normally distributed time to the first token plus the output tokens at a fixed rate,
+and a share of the requests can be made to fail with a 500 or a 429.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+import uuid
+from typing import List, Optional
+
+from aiohttp import web
+
+WORDS = ("thank you for reaching out we are sorry to hear about the trouble with your account our team is looking "
+         "into the issue and will follow up shortly please let us know if there is anything else").split()
+
+
+class FakeLLM:
+    """
+    Latency, errors and rate limits of the fake providers; `seed` makes a run reproducible.
+    """
+
+    def __init__(self, latency_median: float = 0.5, latency_sigma: float = 0.5, tokens_per_second: float = 100,
+                 response_tokens: int = 150, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 rpm: Optional[int] = None, seed: Optional[int] = None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.random = random.Random(seed)
+        self._requests = collections.deque()
+        self.stats = collections.Counter()
+
+    def first_token_delay(self) -> float:
+        if self.latency_median <= 0:
+            return 0.0
+        return self.random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+    def token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _requests_in_window(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        return len(self._requests)
+
+    def rate_limit_headers(self, provider: str) -> dict:
+        if not self.rpm:
+            return {}
+        remaining = str(max(self.rpm - self._requests_in_window(), 0))
+        if provider == "openai":
+            return {"x-ratelimit-limit-requests": str(self.rpm), "x-ratelimit-remaining-requests": remaining}
+        return {"anthropic-ratelimit-requests-limit": str(self.rpm), "anthropic-ratelimit-requests-remaining": remaining}
+
+    def failure(self, provider: str) -> Optional[web.Response]:
+        """
+        Return the injected error response for this request, if it gets one.
+        """
+        if self.rpm and self._requests_in_window() >= self.rpm:
+            retry_after = max(self._requests[0] + 60 - time.monotonic(), 0.1)
+            return self._error(provider, 429, "rate_limit_error", {"retry-after": f"{retry_after:.1f}"})
+        self._requests.append(time.monotonic())
+        if self.random.random() < self.rate_limit_rate:
+            return self._error(provider, 429, "rate_limit_error", {"retry-after": "1"})
+        if self.random.random() < self.error_rate:
+            return self._error(provider, 500, "api_error")
+        return None
+
+    def _error(self, provider: str, status: int, error_type: str, headers: Optional[dict] = None) -> web.Response:
+        self.stats[str(status)] += 1
+        error = {"type": error_type, "message": f"Injected {status}"}
+        body = {"error": error} if provider == "openai" else {"type": "error", "error": error}
+        return web.json_response(body, status=status, headers={**(headers or {}), **self.rate_limit_headers(provider)})
+
+    def completion(self, system_prompt: str, max_tokens: int) -> List[str]:
+        """
+        Return the completion of a prompt of the app as a list of tokens: the JSON its triage prompts expect,
+        or filler text for initial responses.
+        """
+        if "categorizes" in system_prompt:
+            text = json.dumps({"category": self.random.choice(["Account Access", "Payment Issue", "Technical Problem"]),
+                               "confidence": 0.9})
+        elif "prioritizes" in system_prompt:
+            text = json.dumps({"priority": self.random.choice(["Low", "Medium", "High"]), "confidence": 0.9})
+        elif "triages" in system_prompt:
+            text = json.dumps({"category": "Technical Problem", "category_confidence": 0.9,
+                               "priority": "Medium", "priority_confidence": 0.9})
+        else:
+            count = min(self.response_tokens, max_tokens)
+            return [self.random.choice(WORDS) + " " for _ in range(count)]
+        # Triage answers are short, stream them in a few chunks
+        return [text[i:i + 8] for i in range(0, len(text), 8)]
+
+
+def prompt_tokens(*texts: str) -> int:
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+async def _generate(llm: FakeLLM, tokens: List[str]):
+    await asyncio.sleep(llm.first_token_delay())
+    delay = llm.token_delay()
+    for i, token in enumerate(tokens):
+        if i and delay:
+            await asyncio.sleep(delay)
+        yield token
+
+
+async def _sse(request: web.Request, provider: str, llm: FakeLLM) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **llm.rate_limit_headers(provider)})
+    await response.prepare(request)
+    return response
+
+
+async def openai_chat_completions(request: web.Request) -> web.StreamResponse:
+    llm: FakeLLM = request.app["llm"]
+    body = await request.json()
+    failure = llm.failure("openai")
+    if failure is not None:
+        return failure
+    messages = body["messages"]
+    system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+    tokens = llm.completion(system_prompt, body.get("max_tokens") or llm.response_tokens)
+    usage = {"prompt_tokens": prompt_tokens(*(m["content"] for m in messages)), "completion_tokens": len(tokens)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    completion_id, created = f"chatcmpl-{uuid.uuid4().hex}", int(time.time())
+    llm.stats["openai"] += 1
+
+    def chunk(delta: dict, finish_reason=None, **extra) -> bytes:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None
+                   else [], **extra}
+        return f"data: {json.dumps(payload)}\n\n".encode()
+
+    if not body.get("stream"):
+        text = "".join([token async for token in _generate(llm, tokens)])
+        return web.json_response({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }, headers=llm.rate_limit_headers("openai"))
+
+    response = await _sse(request, "openai", llm)
+    await response.write(chunk({"role": "assistant", "content": ""}))
+    async for token in _generate(llm, tokens):
+        await response.write(chunk({"content": token}))
+    await response.write(chunk({}, "stop"))
+    if (body.get("stream_options") or {}).get("include_usage"):
+        await response.write(chunk(None, usage=usage))
+    await response.write(b"data: [DONE]\n\n")
+    return response
+
+
+async def anthropic_messages(request: web.Request) -> web.StreamResponse:
+    llm: FakeLLM = request.app["llm"]
+    body = await request.json()
+    failure = llm.failure("anthropic")
+    if failure is not None:
+        return failure
+    system_prompt = body.get("system") or ""
+    tokens = llm.completion(system_prompt, body["max_tokens"])
+    input_tokens = prompt_tokens(system_prompt, *(m["content"] for m in body["messages"]))
+    message = {"id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant", "model": body["model"],
+               "stop_reason": None, "stop_sequence": None}
+    llm.stats["anthropic"] += 1
+
+    if not body.get("stream"):
+        text = "".join([token async for token in _generate(llm, tokens)])
+        return web.json_response({
+            **message, "stop_reason": "end_turn", "content": [{"type": "text", "text": text}],
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens)},
+        }, headers=llm.rate_limit_headers("anthropic"))
+
+    async def event(name: str, data: dict):
+        await response.write(f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode())
+
+    response = await _sse(request, "anthropic", llm)
+    await event("message_start", {"message": {**message, "content": [],
+                                              "usage": {"input_tokens": input_tokens, "output_tokens": 1}}})
+    await event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+    async for token in _generate(llm, tokens):
+        await event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": token}})
+    await event("content_block_stop", {"index": 0})
+    await event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                  "usage": {"output_tokens": len(tokens)}})
+    await event("message_stop", {})
+    return response
+
+
+async def list_models(request: web.Request) -> web.Response:
+    return web.json_response({"object": "list", "data": []})
+
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(dict(request.app["llm"].stats))
+
+
+def create_app(llm: FakeLLM) -> web.Application:
+    app = web.Application()
+    app["llm"] = llm
+    app.router.add_post("/v1/chat/completions", openai_chat_completions)
+    app.router.add_post("/v1/messages", anthropic_messages)
+    app.router.add_get("/v1/models", list_models)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-median", type=float, default=0.5, help="median seconds to the first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal shape of the first token delay")
+    parser.add_argument("--tokens-per-second", type=float, default=100, help="output rate, 0 for no delay")
+    parser.add_argument("--response-tokens", type=int, default=150, help="length of generated responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--rpm", type=int, help="requests per minute before every request gets a 429")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    llm = FakeLLM(args.latency_median, args.latency_sigma, args.tokens_per_second, args.response_tokens,
+                  args.error_rate, args.rate_limit_rate, args.rpm, args.seed)
+    web.run_app(create_app(llm), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Import-time benchmark: imports a module (app.main by default) in fresh interpreters without any provider API keys
+and reports the wall time and the `-X importtime` breakdown as JSON, including the slowest imports.
+
+    python -m benchmarks.import_time --repeat 5 --output benchmarks/results/import.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.load import git_commit, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr: str) -> Dict[str, dict]:
+    """
+    Parse `-X importtime` output into the self and cumulative import time (seconds) of each module.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not self_us.isdigit():
+            # The header line
+            continue
+        modules[name] = {"self": int(self_us) / 1e6, "cumulative": int(cumulative_us) / 1e6}
+    return modules
+
+
+def import_once(module: str) -> (float, Dict[str, dict]):
+    env = {key: value for key, value in os.environ.items() if key not in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY')}
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env, cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, parse_importtime(result.stderr)
+
+
+def run(module: str, repeat: int, top: int) -> dict:
+    walls, totals, runs = [], [], []
+    for _ in range(repeat):
+        wall, modules = import_once(module)
+        walls.append(wall)
+        totals.append(modules[module]["cumulative"])
+        runs.append(modules)
+    # The breakdown of the median run, so a single slow start does not skew it
+    median_run = runs[sorted(range(repeat), key=lambda i: totals[i])[repeat // 2]]
+    slowest: List[tuple] = sorted(median_run.items(), key=lambda item: item[1]["cumulative"], reverse=True)[:top]
+    return {
+        "commit": git_commit(),
+        "module": module,
+        "wall": summarize(walls),
+        "import": summarize(totals),
+        "app_modules": {name: timing for name, timing in median_run.items() if name.split(".")[0] == "app"},
+        "slowest": [{"module": name, **timing} for name, timing in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="number of slowest imports to report")
+    parser.add_argument("--budget", type=float, help="fail when the median import takes longer (seconds)")
+    parser.add_argument("--output", help="file to write the JSON result to, stdout by default")
+    args = parser.parse_args()
+
+    result = run(args.module, args.repeat, args.top)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.budget is not None and result["import"]["p50"] > args.budget:
+        sys.exit(f"Importing {args.module} took {result['import']['p50']:.3f} s, over the {args.budget} s budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Load generator: submits tickets through POST /ticket, waits for the workers to process them and reports
+submit latency, submit-to-processed latency and throughput as JSON, optionally followed by GET /tickets paging.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import Ticket, TicketStatus
+
+SUBJECTS = ["Cannot log in", "Charged twice", "App crashes on start", "Feature idea: dark mode", "Refund request",
+            "Password reset email never arrives", "Export to CSV fails", "Invoice shows the wrong address"]
+WORDS = ("account payment error page login invoice refund crash update browser mobile email password export report "
+         "settings billing subscription plan team invite notification sync timeout").split()
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean": float(np.mean(values)), "p50": float(p50), "p95": float(p95),
+            "p99": float(p99), "max": float(max(values))}
+
+
+def make_ticket(rng: random.Random) -> dict:
+    # A unique marker per ticket keeps the completion cache and duplicate reuse out of the measurement
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 200)))
+    return {"subject": rng.choice(SUBJECTS), "body": f"{body}\n\nReference {uuid.uuid4()}",
+            "customer_email": "load-test@example.com"}
+
+
+async def submit_tickets(client: httpx.AsyncClient, count: int, concurrency: int, rate: Optional[float],
+                         seed: Optional[int]) -> Tuple[List[str], List[float], int, float]:
+    """
+    Submit `count` tickets from `concurrency` senders, at most `rate` per second when given.
+    Returns the created ticket ids, the request latencies, the number of failed requests and the elapsed time.
+    """
+    rng = random.Random(seed)
+    tickets = [make_ticket(rng) for _ in range(count)]
+    ticket_ids, latencies, errors = [], [], 0
+    queue = asyncio.Queue()
+    for i, ticket in enumerate(tickets):
+        queue.put_nowait((i, ticket))
+    started = time.perf_counter()
+
+    async def sender():
+        nonlocal errors
+        while not queue.empty():
+            i, ticket = queue.get_nowait()
+            if rate:
+                await asyncio.sleep(max(started + i / rate - time.perf_counter(), 0))
+            request_started = time.perf_counter()
+            try:
+                response = await client.post("/ticket", json=ticket)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - request_started)
+            ticket_ids.append(response.json()["ticket_id"])
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return ticket_ids, latencies, errors, time.perf_counter() - started
+
+
+async def wait_for_processed(ticket_ids: List[str], timeout: float,
+                             poll_interval: float) -> Dict[str, Tuple[datetime, datetime]]:
+    """
+    Poll the database until every ticket is processed or the timeout passes.
+    Returns the creation and processing time of each processed ticket.
+    """
+    pending = {uuid.UUID(ticket_id) for ticket_id in ticket_ids}
+    processed = {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        ids = list(pending)
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(ids), 1000):
+                rows = await db.execute(
+                    select(Ticket.id, Ticket.created_at, Ticket.processed_at)
+                    .where(Ticket.id.in_(ids[start:start + 1000]), Ticket.status == TicketStatus.processed)
+                )
+                for ticket_id, created_at, processed_at in rows:
+                    processed[str(ticket_id)] = (created_at, processed_at)
+                    pending.discard(ticket_id)
+        if pending:
+            await asyncio.sleep(poll_interval)
+    return processed
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def page_tickets(client: httpx.AsyncClient, requests: int, page_size: int) -> List[float]:
+    """
+    Page through GET /tickets with its cursor, restarting from the first page at the end, and time each page.
+    """
+    latencies, cursor = [], None
+    for _ in range(requests):
+        params = {"limit": page_size, **({"cursor": cursor} if cursor else {})}
+        started = time.perf_counter()
+        response = await client.get("/tickets", params=params)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        cursor = response.headers.get("X-Next-Cursor")
+    return latencies
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.request_timeout,
+                                 limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        ticket_ids, submit_latencies, submit_errors, submit_elapsed = await submit_tickets(
+            client, args.tickets, args.concurrency, args.rate, args.seed)
+        processed = await wait_for_processed(ticket_ids, args.timeout, args.poll_interval)
+        list_latencies = await page_tickets(client, args.list_requests, args.page_size) if args.list_requests else []
+
+    result = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "submit": {**summarize(submit_latencies), "errors": submit_errors,
+                   "throughput": len(ticket_ids) / submit_elapsed if submit_elapsed else None},
+    }
+    if processed:
+        times = [(_utc(created_at), _utc(processed_at)) for created_at, processed_at in processed.values()]
+        first_created = min(created_at for created_at, _ in times)
+        last_processed = max(processed_at for _, processed_at in times)
+        elapsed = (last_processed - first_created).total_seconds()
+        result["processing"] = {
+            **summarize([(processed_at - created_at).total_seconds() for created_at, processed_at in times]),
+            "unprocessed": len(ticket_ids) - len(processed),
+            "throughput": len(processed) / elapsed if elapsed > 0 else None,
+        }
+    else:
+        result["processing"] = {"count": 0, "unprocessed": len(ticket_ids)}
+    if list_latencies:
+        result["list"] = summarize(list_latencies)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--tickets", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent POST /ticket requests")
+    parser.add_argument("--rate", type=float, help="tickets submitted per second, as fast as possible by default")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the tickets to be processed")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--request-timeout", type=float, default=30)
+    parser.add_argument("--list-requests", type=int, default=0, help="GET /tickets pages to time afterwards")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="file to write the JSON result to, stdout by default")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if result["processing"]["unprocessed"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of GET /tickets response encoding: the response_model path (ORM objects validated through
+TicketResponse by FastAPI, then JSON-encoded) against the FAST_JSON_RESPONSES path (selected rows encoded directly).
+
+    python -m benchmarks.serialization --tickets 1000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy.engine.result import result_tuple
+
+from app import serialization
+from app.models import Ticket, TicketCategory, TicketPriority, TicketStatus
+from app.schemas import TICKET_FIELDS, TicketResponse
+from benchmarks.load import WORDS
+
+
+def make_values(count: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    created_at = datetime(2024, 7, 1, tzinfo=timezone.utc)
+    values = []
+    for i in range(count):
+        created_at += timedelta(seconds=rng.randint(1, 600))
+        values.append(dict(
+            id=uuid.UUID(int=rng.getrandbits(128)), subject=f"Ticket {i}",
+            body=" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))),
+            customer_email=f"customer{i}@example.com", status=TicketStatus.processed,
+            category=rng.choice(list(TicketCategory)), priority=rng.choice(list(TicketPriority)),
+            initial_response=" ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 300))),
+            category_confidence=rng.random(), priority_confidence=rng.random(), created_at=created_at,
+            processed_at=created_at + timedelta(seconds=rng.randint(1, 60)), input_tokens=rng.randint(100, 2000),
+            output_tokens=rng.randint(50, 500), reused_from_ticket_id=None, failed_stages=None,
+            labels_source='ai',
+        ))
+    return values
+
+
+def time_it(encode: Callable[[], bytes], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=1000, help="tickets per page")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    values = make_values(args.tickets, args.seed)
+    tickets = [Ticket(**ticket) for ticket in values]
+    row_type = result_tuple(list(TICKET_FIELDS))
+    rows = [row_type(tuple(ticket[field] for field in TICKET_FIELDS)) for ticket in values]
+    field = create_response_field(name="response", type_=List[TicketResponse])
+    loop = asyncio.new_event_loop()
+
+    def response_model_path() -> bytes:
+        content = loop.run_until_complete(serialize_response(field=field, response_content=tickets))
+        return JSONResponse(content).body
+
+    paths = {"response_model": response_model_path, "fast": lambda: serialization.dump_rows(rows)}
+    # Both paths have to produce the same document
+    assert json.loads(response_model_path()) == json.loads(paths["fast"]())
+
+    encoder = "orjson" if serialization.orjson is not None else "json"
+    print(f"{args.tickets} tickets per page, best and median of {args.repeat}, fast path encoder: {encoder}")
+    results = {}
+    for name, encode in paths.items():
+        timings = sorted(time_it(encode, args.repeat))
+        results[name] = timings[len(timings) // 2]
+        print(f"{name:<16}{timings[0] * 1000:>10.2f} ms{results[name] * 1000:>10.2f} ms")
+    print(f"speedup: {results['response_model'] / results['fast']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
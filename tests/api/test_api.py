@@ -1,7 +1,14 @@
+import json
+import uuid
+
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
 from app.main import app
+from app.models import TicketOutbox
 
 
 @pytest_asyncio.fixture
@@ -49,3 +56,164 @@ async def test_process_tickets(client):
     response = await client.post("/process")
     assert response.status_code == 200
     assert "message" in response.json()
+
+
+@pytest.mark.asyncio
+async def test_list_tickets_paginates_with_cursor(client):
+    for i in range(3):
+        await client.post("/ticket", json={
+            "subject": f"Paginated Ticket {i}",
+            "body": "This ticket is for testing pagination.",
+            "customer_email": "page@example.com"
+        })
+    first_page = await client.get("/tickets", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 2
+    cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = await client.get("/tickets", params={"limit": 2, "cursor": cursor})
+    assert second_page.status_code == 200
+    first_ids = {ticket["id"] for ticket in first_page.json()}
+    assert not first_ids & {ticket["id"] for ticket in second_page.json()}
+
+    # Without limit or cursor every ticket is returned, as before pagination existed
+    everything = await client.get("/tickets")
+    assert len(everything.json()) >= 3
+    assert "X-Next-Cursor" not in everything.headers
+
+
+@pytest.mark.asyncio
+async def test_list_tickets_with_field_projection(client):
+    response = await client.get("/tickets", params={"fields": "subject,status", "limit": 5})
+    assert response.status_code == 200
+    for ticket in response.json():
+        assert set(ticket) == {"id", "created_at", "subject", "status"}
+
+    response = await client.get("/tickets", params={"fields": "password"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_list_tickets_as_ndjson_stream(client):
+    response = await client.get("/tickets", params={"format": "ndjson", "fields": "subject"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    for line in response.text.splitlines():
+        assert "subject" in json.loads(line)
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_tickets(client):
+    tickets = [
+        {"subject": "Bulk Ticket 1", "body": "First bulk ticket.", "customer_email": "bulk1@example.com"},
+        {"subject": "Bulk Ticket 2", "body": "Second bulk ticket.", "customer_email": "not-an-email"},
+        {"subject": "Bulk Ticket 3", "body": "Third bulk ticket.", "customer_email": "bulk3@example.com"},
+    ]
+    response = await client.post("/tickets/bulk", content="\n".join(json.dumps(ticket) for ticket in tickets),
+                                 headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 201
+    assert response.json()["accepted"] == 2
+    assert response.json()["errors"][0]["row"] == 2
+
+    ticket_id = response.json()["ticket_ids"][0]
+    response = await client.get(f"/ticket/{ticket_id}")
+    assert response.json()["subject"] == "Bulk Ticket 1"
+
+
+@pytest.mark.asyncio
+async def test_metrics_labels_requests_by_route(client):
+    await client.get("/ticket/00000000-0000-0000-0000-000000000000")
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/ticket/{ticket_id}",status="404"}' in response.text
+
+
+@pytest.mark.asyncio
+async def test_ticket_timings(client):
+    create_response = await client.post("/ticket", json={
+        "subject": "Ticket for timings",
+        "body": "This ticket is for testing timings.",
+        "customer_email": "timings@example.com"
+    })
+    ticket_id = create_response.json()["ticket_id"]
+
+    response = await client.get(f"/ticket/{ticket_id}/timings")
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+
+    response = await client.get("/tickets/timings", params={"hours": 1})
+    assert response.status_code == 200
+    assert {"runs", "queue_wait_ms", "total_ms", "stages"} <= response.json().keys()
+
+
+@pytest.mark.asyncio
+async def test_ticket_stats(client):
+    before = (await client.get("/tickets/stats")).json()
+    await client.post("/ticket", json={
+        "subject": "Ticket for stats",
+        "body": "This ticket is for testing stats.",
+        "customer_email": "stats@example.com"
+    })
+
+    response = await client.get("/tickets/stats", params={"hourly": True})
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["total"] == before["total"] + 1
+    assert sum(hour["tickets"] for hour in stats["hourly"]) == stats["total"]
+
+
+@pytest.mark.asyncio
+async def test_search_tickets(client):
+    marker = f"searchmarker{uuid.uuid4().hex[:8]}"
+    create_response = await client.post("/ticket", json={
+        "subject": "Refund for a duplicate charge",
+        "body": f"I was charged twice, error code {marker}.",
+        "customer_email": "search@example.com"
+    })
+    ticket_id = create_response.json()["ticket_id"]
+
+    response = await client.get("/tickets/search", params={"q": marker})
+    assert response.status_code == 200
+    assert [ticket["id"] for ticket in response.json()] == [ticket_id]
+
+    response = await client.get("/tickets/search", params={"q": marker, "category": "feature_request"})
+    assert all(ticket["id"] != ticket_id for ticket in response.json())
+
+
+@pytest.mark.asyncio
+async def test_get_ticket_etag(client):
+    create_response = await client.post("/ticket", json={
+        "subject": "Ticket for etags",
+        "body": "This ticket is for testing ETags.",
+        "customer_email": "etag@example.com"
+    })
+    ticket_id = create_response.json()["ticket_id"]
+
+    response = await client.get(f"/ticket/{ticket_id}")
+    assert response.status_code == 200
+    assert response.json()["id"] == ticket_id
+    tag = response.headers["ETag"]
+
+    response = await client.get(f"/ticket/{ticket_id}", headers={"If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == tag
+
+    response = await client.get(f"/ticket/{ticket_id}", headers={"If-None-Match": '"something-else"'})
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_create_ticket_writes_outbox_entry(client):
+    response = await client.post("/ticket", json={
+        "subject": "Ticket for the outbox",
+        "body": "This ticket is for testing the outbox.",
+        "customer_email": "outbox@example.com"
+    })
+    ticket_id = uuid.UUID(response.json()["ticket_id"])
+
+    # The test client does not run the lifespan, so no relay has picked the entry up
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(TicketOutbox.ticket_id).where(TicketOutbox.ticket_id == ticket_id))
+        assert result.scalars().all() == [ticket_id]
@@ -0,0 +1,4 @@
+import os
+
+# Every test runs on its own event loop, and pooled asyncpg connections cannot move between loops
+os.environ.setdefault('DB_POOL_MODE', 'null')
@@ -1,9 +1,10 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest_asyncio
 
-from app.ai import OpenAIModel, AnthropicModel, categorize_ticket, prioritize_ticket, generate_response
+from app.ai import OpenAIModel, AnthropicModel, categorize_ticket, prioritize_ticket, triage_ticket, generate_response
+from app.ratelimit import MemoryBucketStore, RateLimiter
 
 
 @pytest_asyncio.fixture(params=[OpenAIModel(), AnthropicModel()])
@@ -27,8 +28,64 @@ async def test_prioritize_ticket(ai_model):
     assert confidence == 0.90
 
 
+@pytest.mark.asyncio
+async def test_triage_ticket(ai_model):
+    ai_model.get_completion = AsyncMock(return_value='{"category": "Payment Issue", "category_confidence": 0.8, "priority": "Low", "priority_confidence": 0.7}')
+    category, category_confidence, priority, priority_confidence = await triage_ticket(ai_model, "Subject", "Body")
+    assert category.value == "payment_issue"
+    assert category_confidence == 0.8
+    assert priority.value == "low"
+    assert priority_confidence == 0.7
+    ai_model.get_completion.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_triage_ticket_rejects_responses_outside_schema(ai_model):
+    ai_model.get_completion = AsyncMock(return_value='{"category": "Payment Issue", "confidence": 0.8, "priority": "Low"}')
+    with pytest.raises(ValueError):
+        await triage_ticket(ai_model, "Subject", "Body")
+
+    ai_model.get_completion = AsyncMock(return_value='{"category": "Payment Issue", "category_confidence": 1.5, "priority": "Low", "priority_confidence": 0.7}')
+    with pytest.raises(ValueError):
+        await triage_ticket(ai_model, "Subject", "Body")
+
+
 @pytest.mark.asyncio
 async def test_generate_response(ai_model):
     ai_model.get_completion = AsyncMock(return_value="This is a response.")
     response = await generate_response(ai_model, "Subject", "Body")
     assert response == "This is a response."
+
+
+@pytest.mark.asyncio
+async def test_generate_response_streams_deltas(ai_model):
+    async def stream_completion(system_prompt, user_prompt, max_tokens):
+        for delta in ["This is ", "a ", "response."]:
+            yield delta
+
+    ai_model.stream_completion = stream_completion
+    ai_model.get_completion = AsyncMock()
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    response = await generate_response(ai_model, "Subject", "Body", on_delta=on_delta)
+    assert response == "This is a response."
+    assert deltas == ["This is ", "a ", "response."]
+    ai_model.get_completion.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_openai_completion_goes_through_rate_limiter():
+    model = OpenAIModel()
+    raw_response = MagicMock(headers={"x-ratelimit-limit-requests": "900"})
+    raw_response.parse = MagicMock(return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="Hi"))],
+                                                        usage=None))
+    model.client = MagicMock()
+    model.client.chat.completions.with_raw_response.create = AsyncMock(return_value=raw_response)
+    limiter = RateLimiter("openai", rpm=500, tpm=200000, store=MemoryBucketStore())
+    with patch('app.ai.get_rate_limiter', return_value=limiter), \
+         patch('app.decorators.get_completion_cache', return_value=None):
+        assert await model.get_completion("System", "User", max_tokens=10) == "Hi"
+    assert limiter.rpm == 900
@@ -0,0 +1,219 @@
+import json
+import uuid
+from collections import namedtuple
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.batch import (BATCH_CHUNKS_KEY, BatchRequest, FakeBatchBackend, _run, fake_completion, openai_batch_jsonl,
+                       parse_openai_batch_output, process_batch, queue_batch_run, resume_batches)
+from app.config import Config
+from app.models import TicketStatus
+
+TicketRow = namedtuple("TicketRow", ["id", "subject", "body"])
+
+
+def test_openai_batch_jsonl_packs_one_request_per_line():
+    requests = [BatchRequest("a:triage", "System", "User", 100), BatchRequest("a:response", "System", "User", 4096)]
+    lines = openai_batch_jsonl("gpt-4o-mini", requests).decode().splitlines()
+    assert len(lines) == 2
+    entry = json.loads(lines[0])
+    assert entry["custom_id"] == "a:triage"
+    assert entry["url"] == "/v1/chat/completions"
+    assert entry["body"]["model"] == "gpt-4o-mini"
+    assert entry["body"]["messages"][1] == {"role": "user", "content": "User"}
+
+
+def test_parse_openai_batch_output_marks_failed_requests():
+    output = "\n".join([
+        json.dumps({"custom_id": "a", "response": {"status_code": 200,
+                                                   "body": {"choices": [{"message": {"content": "Hi"}}]}}}),
+        json.dumps({"custom_id": "b", "response": None, "error": {"message": "boom"}}),
+    ])
+    assert parse_openai_batch_output(output) == {"a": "Hi", "b": None}
+
+
+@pytest.mark.asyncio
+async def test_fake_backend_completes_after_polls():
+    backend = FakeBatchBackend(polls_until_done=2)
+    batch_id = await backend.submit([BatchRequest("a:response", "System", "User", 10)])
+    assert await backend.poll(batch_id) is None
+    assert await backend.poll(batch_id) is None
+    assert await backend.poll(batch_id) == {"a:response": fake_completion(BatchRequest("a:response", "", "", 0))}
+
+
+def _session():
+    session = MagicMock()
+    session.return_value.__aenter__.return_value = MagicMock()
+    return session
+
+
+class FakeRedis:
+    """
+    The few Redis commands used to keep track of in-flight batch chunks and queued runs.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.hashes = {}
+        self.lists = {}
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    async def expire(self, key, ttl):
+        return key in self.keys
+
+    async def delete(self, key):
+        self.keys.pop(key, None)
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field.encode()] = value.encode()
+
+    async def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field.encode(), None)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value.encode())
+
+    async def lpop(self, key):
+        values = self.lists.get(key)
+        return values.pop(0) if values else None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy", ["fail", "partial"])
+async def test_process_batch_writes_results_back_in_bulk(policy):
+    done, failed = uuid.uuid4(), uuid.uuid4()
+    tickets = [TicketRow(done, "Refund", "Charged twice"), TicketRow(failed, "Login", "Cannot log in")]
+
+    def respond(request):
+        # The second ticket's response fails
+        return None if request.custom_id == f"{failed}:response" else fake_completion(request)
+
+    backend = FakeBatchBackend(respond)
+    redis = FakeRedis()
+    with patch.object(Config, 'PARTIAL_FAILURE_POLICY', policy), \
+         patch.object(Config, 'BATCH_POLL_INTERVAL', 0), \
+         patch('app.batch.get_async_redis', return_value=redis), \
+         patch('app.batch.get_batch_backend', return_value=backend), \
+         patch('app.batch.AsyncSessionLocal', _session()), \
+         patch('app.batch.get_tickets_for_processing', AsyncMock(return_value=tickets)), \
+         patch('app.batch.bulk_update_tickets', new_callable=AsyncMock) as mock_bulk_update:
+        processed = await process_batch([done, failed])
+
+    assert len(backend.batches) == 2
+    # The chunk is no longer tracked once its results are written
+    assert not redis.hashes[BATCH_CHUNKS_KEY] and not redis.keys
+    updates = {update["id"]: update for update in mock_bulk_update.call_args.args[1]}
+    assert updates[done]["status"] == TicketStatus.processed
+    assert updates[done]["category"].value == "other"
+    assert updates[done]["initial_response"] == fake_completion(BatchRequest("x:response", "", "", 0))
+    assert updates[done]["failed_stages"] is None
+    assert updates[done]["labels_source"] == "ai"
+    assert processed == 1
+    if policy == "partial":
+        assert updates[failed]["status"] == TicketStatus.submitted
+        assert updates[failed]["failed_stages"] == ["response"]
+        assert updates[failed]["category"].value == "other"
+        assert "initial_response" not in updates[failed]
+    else:
+        assert updates[failed] == {"id": failed, "status": TicketStatus.submitted}
+
+
+class FailingSubmitBackend(FakeBatchBackend):
+    async def submit(self, requests):
+        raise RuntimeError("provider unavailable")
+
+
+def _released(mock_bulk_update, ticket_ids) -> bool:
+    return mock_bulk_update.call_args.args[1] == [{"id": ticket_id, "status": TicketStatus.submitted}
+                                                  for ticket_id in ticket_ids]
+
+
+@pytest.mark.asyncio
+async def test_process_batch_cancels_jobs_and_releases_tickets_on_failure():
+    ticket_ids = [uuid.uuid4(), uuid.uuid4()]
+    tickets = [TicketRow(ticket_id, "Refund", "Charged twice") for ticket_id in ticket_ids]
+    triage_backend = FakeBatchBackend()
+    with patch('app.batch.get_async_redis', return_value=FakeRedis()), \
+         patch('app.batch.get_batch_backend', side_effect=[triage_backend, FailingSubmitBackend()]), \
+         patch('app.batch.AsyncSessionLocal', _session()), \
+         patch('app.batch.get_tickets_for_processing', AsyncMock(return_value=tickets)), \
+         patch('app.batch.bulk_update_tickets', new_callable=AsyncMock) as mock_bulk_update:
+        with pytest.raises(RuntimeError):
+            await process_batch(ticket_ids)
+    # The triage job submitted before the failure is cancelled and no ticket is left in 'processing'
+    assert not triage_backend.batches
+    assert _released(mock_bulk_update, ticket_ids)
+
+
+@pytest.mark.asyncio
+async def test_process_batch_retries_polls_and_cancels_jobs_at_the_deadline():
+    ticket_id = uuid.uuid4()
+    backend = FakeBatchBackend(polls_until_done=1000)
+    backend.poll = AsyncMock(side_effect=[ConnectionError("reset"), None, None, None, None])
+    with patch.object(Config, 'BATCH_POLL_INTERVAL', 0.01), \
+         patch.object(Config, 'BATCH_TIMEOUT', 0.01), \
+         patch('app.batch.get_async_redis', return_value=FakeRedis()), \
+         patch('app.batch.get_batch_backend', return_value=backend), \
+         patch('app.batch.AsyncSessionLocal', _session()), \
+         patch('app.batch.get_tickets_for_processing', AsyncMock(return_value=[TicketRow(ticket_id, "a", "b")])), \
+         patch('app.batch.bulk_update_tickets', new_callable=AsyncMock) as mock_bulk_update:
+        assert await process_batch([ticket_id]) == 0
+    # The failed poll was retried instead of failing the chunk
+    assert backend.poll.await_count >= 2
+    assert not backend.batches
+    assert _released(mock_bulk_update, [ticket_id])
+
+
+@pytest.mark.asyncio
+async def test_resume_batches_collects_chunks_without_a_lease():
+    orphaned, running = uuid.uuid4(), uuid.uuid4()
+    backend = FakeBatchBackend(polls_until_done=0)
+    redis = FakeRedis()
+    for chunk_id, ticket_id in (("orphaned", orphaned), ("running", running)):
+        jobs = {task: await backend.submit([BatchRequest(f"{ticket_id}:{task}", "", "", 10)])
+                for task in ("triage", "response")}
+        await redis.hset(BATCH_CHUNKS_KEY, chunk_id, json.dumps({
+            "ticket_ids": [str(ticket_id)], "jobs": jobs, "deadline": 2e9}))
+    # The process collecting this chunk is still alive
+    await redis.set("batch:chunk:running:lease", 1)
+
+    with patch('app.batch.get_async_redis', return_value=redis), \
+         patch('app.batch.get_batch_backend', return_value=backend), \
+         patch('app.batch.AsyncSessionLocal', _session()), \
+         patch('app.batch.get_tickets_for_processing',
+               AsyncMock(return_value=[TicketRow(orphaned, "Refund", "Charged twice")])) as mock_get_tickets, \
+         patch('app.batch.bulk_update_tickets', new_callable=AsyncMock) as mock_bulk_update:
+        assert await resume_batches() == 1
+    mock_get_tickets.assert_awaited_once_with(mock_get_tickets.call_args.args[0], [orphaned])
+    assert mock_bulk_update.call_args.args[1][0]["status"] == TicketStatus.processed
+    assert list(redis.hashes[BATCH_CHUNKS_KEY]) == [b"running"]
+
+
+@pytest.mark.asyncio
+async def test_batch_runs_are_queued_by_the_api_and_started_by_the_cli():
+    redis = FakeRedis()
+    with patch('app.batch.get_async_redis', return_value=redis), \
+         patch('app.batch.start_processing_run', AsyncMock(side_effect=lambda run_id=None, status='running':
+                                                           run_id or "queued-run")) as mock_start, \
+         patch('app.batch.run_batch_processing', new_callable=AsyncMock) as mock_run:
+        run_id = await queue_batch_run()
+        mock_start.assert_awaited_once_with(status='queued')
+        mock_run.assert_not_awaited()
+
+        await _run(watch=False)
+        mock_start.assert_awaited_with(run_id)
+        mock_run.assert_awaited_once_with(run_id)
+
+        # Nothing queued any more, so the next run is a new one
+        await _run(watch=False)
+        assert mock_run.await_count == 2
+        assert mock_run.call_args.args[0] != run_id
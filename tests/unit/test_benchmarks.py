@@ -0,0 +1,87 @@
+import json
+from unittest.mock import patch
+
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+
+from app.ai import AnthropicModel, OpenAIModel, categorize_ticket, generate_response
+from app.prompts import track_usage
+from app.schemas import TicketCategory
+from benchmarks.compare import compare
+from benchmarks.fake_llm import FakeLLM, create_app
+from benchmarks.import_time import parse_importtime
+from benchmarks.load import summarize
+
+
+@pytest_asyncio.fixture
+async def fake_llm():
+    llm = FakeLLM(latency_median=0, tokens_per_second=0, response_tokens=5, seed=1)
+    server = TestServer(create_app(llm))
+    await server.start_server()
+    yield llm, str(server.make_url(""))
+    await server.close()
+
+
+def models(base_url):
+    openai_model, anthropic_model = OpenAIModel(), AnthropicModel()
+    openai_model.client = openai_model.client.with_options(base_url=f"{base_url}/v1", max_retries=0)
+    anthropic_model.client = anthropic_model.client.with_options(base_url=base_url, max_retries=0)
+    return openai_model, anthropic_model
+
+
+@pytest.mark.asyncio
+async def test_fake_llm_serves_both_providers(fake_llm):
+    llm, base_url = fake_llm
+    with patch('app.ai.get_rate_limiter', return_value=None), \
+         patch('app.decorators.get_completion_cache', return_value=None):
+        for model in models(base_url):
+            category, confidence = await categorize_ticket(model, "Cannot log in", "Help")
+            assert isinstance(category, TicketCategory) and confidence == 0.9
+
+            usage = track_usage()
+            deltas = []
+
+            async def on_delta(delta):
+                deltas.append(delta)
+
+            response = await generate_response(model, "Cannot log in", "Help", on_delta=on_delta)
+            assert len(deltas) == 5 and response == "".join(deltas)
+            assert usage.input_tokens > 0 and usage.output_tokens == 5
+    assert llm.stats == {"openai": 2, "anthropic": 2}
+
+
+@pytest.mark.asyncio
+async def test_fake_llm_injects_rate_limits(fake_llm):
+    llm, base_url = fake_llm
+    llm.rate_limit_rate = 1.0
+    openai_model, _ = models(base_url)
+    with patch('app.ai.get_rate_limiter', return_value=None), \
+         patch('app.decorators.get_completion_cache', return_value=None):
+        with pytest.raises(Exception) as error:
+            await openai_model.get_completion("System", "User", 10)
+    assert error.value.status_code == 429
+    assert llm.stats["429"] == 1
+
+
+def test_summarize_and_compare():
+    baseline = {"processing": {**summarize([1.0, 2.0, 3.0, 4.0]), "throughput": 10.0}}
+    candidate = {"processing": {**summarize([1.0, 1.0, 2.0, 2.0]), "throughput": 12.0}}
+    assert baseline["processing"]["p50"] == 2.5
+    rows = {metric: change for metric, _, _, change in compare(baseline, candidate)}
+    assert rows["processing.throughput"] == pytest.approx(0.2)
+    assert rows["processing.p50"] == pytest.approx(-0.4)
+    json.dumps(baseline)
+
+
+def test_parse_importtime_reads_self_and_cumulative_times():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   app.config",
+        "import time:      1500 |       2620 | app.main",
+        "some other warning",
+    ])
+    assert parse_importtime(stderr) == {
+        "app.config": {"self": 0.00012, "cumulative": 0.00012},
+        "app.main": {"self": 0.0015, "cumulative": 0.00262},
+    }
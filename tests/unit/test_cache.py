@@ -0,0 +1,178 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.ai import categorize_ticket
+from app.cache import CompletionCache, MemoryCacheBackend
+from app.decorators import cached, cached_stream
+from app.schemas import TicketCategory
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_size=2)
+    await backend.set("a", "1", ttl=60)
+    await backend.set("b", "2", ttl=60)
+    assert await backend.get("a") == "1"
+    await backend.set("c", "3", ttl=60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == "1"
+    assert len(backend) == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_expires_entries():
+    backend = MemoryCacheBackend()
+    await backend.set("a", "1", ttl=0)
+    assert await backend.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_counts_hits_and_misses():
+    cache = CompletionCache(MemoryCacheBackend(), ttl=60)
+    call = AsyncMock(return_value="completion")
+    key = cache.key("gpt-3.5-turbo", "system", "user", 50)
+    assert await cache.get_or_call(key, call) == "completion"
+    assert await cache.get_or_call(key, call) == "completion"
+    call.assert_awaited_once()
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 0, "errors": 0}
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_coalesces_in_flight_requests():
+    cache = CompletionCache(MemoryCacheBackend(), ttl=60)
+
+    async def slow_call():
+        await asyncio.sleep(0.05)
+        return "completion"
+
+    call = AsyncMock(side_effect=slow_call)
+    key = cache.key("gpt-3.5-turbo", "system", "user", 50)
+    results = await asyncio.gather(*(cache.get_or_call(key, call) for _ in range(5)))
+    assert results == ["completion"] * 5
+    call.assert_awaited_once()
+    assert cache.coalesced == 4
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_cancels_the_call_when_every_caller_is_cancelled():
+    cache = CompletionCache(MemoryCacheBackend(), ttl=60)
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def hanging_call():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    key = cache.key("gpt-3.5-turbo", "system", "user", 50)
+    callers = [asyncio.ensure_future(cache.get_or_call(key, hanging_call)) for _ in range(2)]
+    await started.wait()
+    callers[0].cancel()
+    await asyncio.sleep(0)
+    # Another caller still waits for the result
+    assert not cancelled.is_set()
+    callers[1].cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.gather(*callers, return_exceptions=True)
+
+    # A later request starts a new call instead of joining the cancelled one
+    assert await cache.get_or_call(key, AsyncMock(return_value="completion")) == "completion"
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_timeout_cancels_the_provider_call():
+    cache = CompletionCache(MemoryCacheBackend(), ttl=60)
+    cancelled = asyncio.Event()
+
+    async def hanging_call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(cache.get_or_call("key", hanging_call), 0.01)
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+def test_completion_cache_key_covers_the_whole_request():
+    key = CompletionCache.key("gpt-3.5-turbo", "system", "user", 50)
+    assert key != CompletionCache.key("gpt-4o", "system", "user", 50)
+    assert key != CompletionCache.key("gpt-3.5-turbo", "system", "user", 100)
+    assert key != CompletionCache.key("gpt-3.5-turbo", "other system", "user", 50)
+
+
+@pytest.mark.asyncio
+async def test_cached_decorator_reuses_completions():
+    class FakeModel:
+        model = "fake"
+        calls = 0
+
+        @cached
+        async def get_completion(self, system_prompt, user_prompt, max_tokens):
+            self.calls += 1
+            return f"{user_prompt} answered"
+
+    model = FakeModel()
+    with patch('app.decorators.get_completion_cache', return_value=CompletionCache(MemoryCacheBackend(), ttl=60)):
+        assert await model.get_completion("system", "question", max_tokens=10) == "question answered"
+        assert await model.get_completion("system", "question", max_tokens=10) == "question answered"
+    assert model.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_stream_decorator_shares_entries_with_get_completion():
+    class FakeModel:
+        model = "fake"
+        calls = 0
+
+        @cached
+        async def get_completion(self, system_prompt, user_prompt, max_tokens):
+            self.calls += 1
+            return f"{user_prompt} answered"
+
+        @cached_stream
+        async def stream_completion(self, system_prompt, user_prompt, max_tokens):
+            self.calls += 1
+            for delta in (user_prompt, " streamed"):
+                yield delta
+
+    async def stream(prompt):
+        return [delta async for delta in model.stream_completion("system", prompt, max_tokens=10)]
+
+    model = FakeModel()
+    with patch('app.decorators.get_completion_cache', return_value=CompletionCache(MemoryCacheBackend(), ttl=60)):
+        assert await stream("question") == ["question", " streamed"]
+        # A streamed completion is replayed as one chunk and serves the non-streaming call as well
+        assert await stream("question") == ["question streamed"]
+        assert await model.get_completion("system", "question", max_tokens=10) == "question streamed"
+        await model.get_completion("system", "other", max_tokens=10)
+        assert await stream("other") == ["other answered"]
+    assert model.calls == 2
+
+
+
+@pytest.mark.asyncio
+async def test_cached_decorator_does_not_store_completions_the_caller_cannot_parse():
+    class FakeModel:
+        model = "fake"
+        calls = 0
+
+        @cached
+        async def get_completion(self, system_prompt, user_prompt, max_tokens):
+            self.calls += 1
+            return "not json" if self.calls == 1 else '{"category": "Other", "confidence": 0.9}'
+
+    model = FakeModel()
+    with patch('app.decorators.get_completion_cache', return_value=CompletionCache(MemoryCacheBackend(), ttl=60)):
+        with pytest.raises(ValueError):
+            await categorize_ticket(model, "Subject", "Body")
+        # The malformed answer was not cached, so the retry asks the provider again and caches the valid one
+        assert await categorize_ticket(model, "Subject", "Body") == (TicketCategory.other, 0.9)
+        assert await categorize_ticket(model, "Subject", "Body") == (TicketCategory.other, 0.9)
+    assert model.calls == 2
@@ -0,0 +1,76 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app import classifier as classifier_module
+from app.classifier import HashingVectorizer, TicketClassifier, find_classifier, get_classifier
+from app.config import Config
+from app.schemas import TicketCategory, TicketPriority
+
+EXAMPLES = [
+    ("Cannot log in", "I forgot my password and the reset email never arrives", TicketCategory.account_access,
+     TicketPriority.high),
+    ("Charged twice", "My credit card was billed twice for the invoice this month", TicketCategory.payment_issue,
+     TicketPriority.medium),
+    ("Dark mode please", "It would be great if you could add a dark mode option", TicketCategory.feature_request,
+     TicketPriority.low),
+]
+
+
+def _train(**fit_options):
+    rows = EXAMPLES * 20
+    return TicketClassifier.train([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows],
+                                  [r[3] for r in rows], n_features=2 ** 12, **fit_options)
+
+
+def test_sparse_products_match_dense():
+    features = HashingVectorizer(64).transform(["Login", "", "Refund"], ["password reset", "", "refund my card"])
+    dense = np.zeros((features.n_rows, features.n_features))
+    np.add.at(dense, (np.repeat(np.arange(features.n_rows), np.diff(features.indptr)), features.indices), features.data)
+    weights = np.random.default_rng(0).normal(size=(64, 3))
+    values = np.random.default_rng(1).normal(size=(3, 3))
+    np.testing.assert_allclose(features.dot(weights), dense @ weights, rtol=1e-5)
+    np.testing.assert_allclose(features.transpose_dot(values), dense.T @ values, rtol=1e-5)
+    np.testing.assert_allclose(features.take(np.array([2, 0])).dot(weights), (dense @ weights)[[2, 0]], rtol=1e-5)
+    assert np.allclose(np.linalg.norm(dense[[0, 2]], axis=1), 1)
+
+
+def test_predict_batch_scores_many_tickets():
+    classifier = _train(epochs=20)
+    predictions = classifier.predict_batch(
+        ["Password reset", "Billed twice", "Feature idea"],
+        ["I cannot log in, the reset email never arrives", "My card was billed twice", "Please add a dark mode"],
+    )
+    assert [p[0] for p in predictions] == [TicketCategory.account_access, TicketCategory.payment_issue,
+                                           TicketCategory.feature_request]
+    assert [p[2] for p in predictions] == [TicketPriority.high, TicketPriority.medium, TicketPriority.low]
+    assert all(0.5 < p[1] <= 1 and 0.5 < p[3] <= 1 for p in predictions)
+
+
+def test_save_and_load_latest_version(tmp_path):
+    classifier = _train(epochs=2)
+    classifier.version = "20240101000000"
+    classifier.save(str(tmp_path))
+    newer = _train(epochs=2)
+    newer.version = "20240201000000"
+    newer.save(str(tmp_path))
+
+    assert find_classifier(str(tmp_path)).endswith("ticket-classifier-20240201000000.npz")
+    assert find_classifier(str(tmp_path), "20240101000000").endswith("ticket-classifier-20240101000000.npz")
+    assert find_classifier(str(tmp_path), "missing") is None
+
+    loaded = TicketClassifier.load(find_classifier(str(tmp_path)))
+    assert loaded.version == "20240201000000"
+    subjects, bodies = [r[0] for r in EXAMPLES], [r[1] for r in EXAMPLES]
+    assert loaded.predict_batch(subjects, bodies) == newer.predict_batch(subjects, bodies)
+
+
+def test_get_classifier_loads_once(tmp_path):
+    _train(epochs=1).save(str(tmp_path))
+    with patch.object(Config, 'CLASSIFIER_DIR', str(tmp_path)), \
+         patch.object(Config, 'CLASSIFIER_VERSION', None), \
+         patch.object(classifier_module, '_classifier', None), \
+         patch.object(classifier_module, '_classifier_loaded', False), \
+         patch.object(TicketClassifier, 'load', wraps=TicketClassifier.load) as mock_load:
+        assert get_classifier() is get_classifier()
+        mock_load.assert_called_once()
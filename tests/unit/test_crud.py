@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app.crud import (_pending_tickets_query, _search_query, _tickets_query, decode_cursor, decode_search_cursor,
+                      encode_cursor, encode_search_cursor, get_ticket_stats)
+from app.database import AsyncSessionLocal
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 7, 10, 12, 30, tzinfo=timezone.utc)
+    ticket_id = uuid.uuid4()
+    assert decode_cursor(encode_cursor(created_at, ticket_id)) == (created_at, ticket_id)
+
+
+def test_decode_invalid_cursor():
+    with pytest.raises(HTTPException) as exc_info:
+        decode_cursor("not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+
+def test_search_cursor_round_trip():
+    # Ranks are float4 in the database, the cursor has to give back exactly the same value
+    rank = 0.1 + 0.2
+    ticket_id = uuid.uuid4()
+    assert decode_search_cursor(encode_search_cursor(rank, ticket_id)) == (rank, ticket_id)
+
+
+def test_search_query_combines_filters():
+    compiled = str(_search_query("refund", category="payment_issue", status="processed",
+                                 cursor=encode_search_cursor(0.5, uuid.uuid4())).compile(dialect=postgresql.dialect()))
+    assert "search_vector @@ websearch_to_tsquery('english'::regconfig" in compiled
+    assert "tickets.category = " in compiled and "tickets.status = " in compiled
+    assert "tickets.priority" not in compiled.split("WHERE")[1]
+    assert compiled.endswith("DESC, tickets.id DESC")
+
+
+async def _explain(query) -> str:
+    compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    async with AsyncSessionLocal() as db:
+        # The test table is tiny, so make sequential scans unattractive to see which index the planner picks
+        await db.execute(text("SET LOCAL enable_seqscan = off"))
+        result = await db.execute(text(f"EXPLAIN {compiled}"))
+        return "\n".join(result.scalars().all())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query, index", [
+    (_tickets_query(), "ix_tickets_created_at_id"),
+    (_tickets_query(status="processed"), "ix_tickets_status_created_at"),
+    (_tickets_query(category="payment_issue"), "ix_tickets_category_created_at"),
+    (_tickets_query(priority="high"), "ix_tickets_priority_created_at"),
+    # The status index covers the pending tickets too, but the claim query must use the smaller partial one
+    (_pending_tickets_query(100), "ix_tickets_pending"),
+    (_search_query("refund"), "ix_tickets_search_vector"),
+])
+async def test_ticket_queries_use_indexes(query, index):
+    plan = await _explain(query)
+    assert "Seq Scan" not in plan
+    assert index in plan, plan
+
+
+@pytest.mark.asyncio
+async def test_get_ticket_stats_aggregates_rollup_rows():
+    db = AsyncMock()
+    db.execute.return_value = [
+        ("processed", "payment_issue", "high", 3, 2.4, 3, 1.5, 2, 30.0, 3),
+        ("processed", "", "", 1, 0.0, 0, 0.0, 0, 10.0, 1),
+        ("submitted", "", "", 1, 0.0, 0, 0.0, 0, 0.0, 0),
+        ("processing", "", "", 1, 0.0, 0, 0.0, 0, 0.0, 0),
+        # Hours whose tickets were all deleted again keep a zero row
+        ("submitted", "account_access", "low", 0, 0.0, 0, 0.0, 0, 0.0, 0),
+    ]
+
+    stats = await get_ticket_stats(db)
+
+    assert stats["total"] == 6
+    assert stats["by_status"] == {"processed": 4, "submitted": 1, "processing": 1}
+    assert stats["by_category"] == {"payment_issue": 3, "none": 3}
+    assert stats["by_priority"] == {"high": 3, "none": 3}
+    assert stats["mean_category_confidence"] == pytest.approx(0.8)
+    assert stats["mean_priority_confidence"] == pytest.approx(0.75)
+    assert stats["mean_processing_seconds"] == pytest.approx(10.0)
+    assert "hourly" not in stats
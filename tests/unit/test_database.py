@@ -0,0 +1,38 @@
+from unittest.mock import patch
+
+from sqlalchemy import NullPool
+
+from app import database
+from app.config import Config
+from app.database import InstrumentedQueuePool, create_engine, get_pool_stats
+
+
+def test_create_engine_uses_pool_profile():
+    with patch.object(Config, 'DB_POOL_MODE', 'queue'):
+        web_engine = create_engine('web')
+        worker_engine = create_engine('worker')
+    assert isinstance(web_engine.pool, InstrumentedQueuePool)
+    assert web_engine.pool.size() == Config.DB_POOL_SIZE
+    assert worker_engine.pool.size() == Config.WORKER_DB_POOL_SIZE
+
+
+def test_create_engine_null_pool_mode():
+    with patch.object(Config, 'DB_POOL_MODE', 'null'):
+        engine = create_engine('web')
+    assert isinstance(engine.pool, NullPool)
+
+
+def test_get_pool_stats_reports_saturation():
+    with patch.object(Config, 'DB_POOL_MODE', 'queue'):
+        engine = create_engine('web')
+    with patch.object(database, 'async_engine', engine):
+        stats = get_pool_stats()
+    assert stats["mode"] == "queue"
+    assert stats["size"] == Config.DB_POOL_SIZE
+    assert stats["checked_out"] == 0
+    assert stats["saturation"] == 0.0
+
+    with patch.object(Config, 'DB_POOL_MODE', 'null'):
+        engine = create_engine('web')
+    with patch.object(database, 'async_engine', engine):
+        assert get_pool_stats() == {"mode": "null"}
@@ -0,0 +1,83 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app.dedup import DuplicateIndex, MinHasher, shingles
+
+
+class FakeRedis:
+    """
+    Just enough of the Redis API for the duplicate index.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def smembers(self, key):
+        self.calls.append(lambda: set(self.redis.data.get(key, set())))
+
+    def sadd(self, key, value):
+        self.calls.append(lambda: self.redis.data.setdefault(key, set()).add(value.encode()))
+
+    def set(self, key, value, ex=None):
+        self.calls.append(lambda: self.redis.data.__setitem__(key, value))
+
+    def expire(self, key, ttl):
+        self.calls.append(lambda: True)
+
+    async def execute(self):
+        return [call() for call in self.calls]
+
+
+def test_signature_similarity_tracks_jaccard():
+    hasher = MinHasher(num_perm=256)
+    text = "I cannot log in to my account since this morning, the page keeps spinning forever"
+    near = text + " please help"
+    other = "Please add an export to CSV button on the invoices page of the billing settings"
+    a, b, c = shingles(text), shingles(near), shingles(other)
+    jaccard = len(np.intersect1d(a, b)) / len(np.union1d(a, b))
+    estimate = np.mean(hasher.signature(text) == hasher.signature(near))
+    assert abs(estimate - jaccard) < 0.1
+    assert np.mean(hasher.signature(text) == hasher.signature(other)) < 0.1
+    assert len(c) > 0
+
+
+@pytest.mark.asyncio
+async def test_index_finds_near_duplicates_only():
+    index = DuplicateIndex(MinHasher(128), bands=16, ttl=60)
+    redis = FakeRedis()
+    with patch('app.dedup.get_async_redis', return_value=redis):
+        original = index.signature("Can't log in", "Since this morning the login page says my password is wrong "
+                                                   "even after resetting it twice")
+        await index.add("ticket-1", original)
+        duplicate = index.signature("Can't log in", "Since this morning the login page says my password is wrong "
+                                                    "even after resetting it twice!!")
+        unrelated = index.signature("Refund", "I would like a refund for the annual plan I bought by mistake")
+
+        match = await index.find(duplicate, threshold=0.8)
+        assert match[0] == "ticket-1" and match[1] >= 0.8
+        assert await index.find(unrelated, threshold=0.8) is None
+
+
+def test_bands_must_divide_signature():
+    with pytest.raises(ValueError):
+        DuplicateIndex(MinHasher(100), bands=16, ttl=60)
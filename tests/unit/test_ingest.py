@@ -0,0 +1,91 @@
+import json
+import uuid
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.ingest import ingest_tickets, iter_json_array, iter_ndjson
+
+TICKETS = [
+    {"subject": "Cannot log in", "body": "Invalid credentials error.", "customer_email": "one@example.com"},
+    {"subject": "Refund", "body": "I was charged twice.", "customer_email": "two@example.com"},
+    {"subject": "Dark mode", "body": "Please add dark mode.", "customer_email": "three@example.com"},
+]
+
+
+async def _chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def _collect(rows):
+    return [row async for row in rows]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+async def test_iter_json_array_across_chunk_boundaries(chunk_size):
+    data = json.dumps(TICKETS + [12345]).encode()
+    rows = await _collect(iter_json_array(_chunked(data, chunk_size)))
+    assert rows == [(1, TICKETS[0], None), (2, TICKETS[1], None), (3, TICKETS[2], None), (4, 12345, None)]
+
+
+@pytest.mark.asyncio
+async def test_iter_json_array_empty_and_malformed():
+    assert await _collect(iter_json_array(_chunked(b" [ ] ", 2))) == []
+
+    rows = await _collect(iter_json_array(_chunked(b'[{"subject": "a"} {"subject": "b"}]', 5)))
+    assert rows[0] == (1, {"subject": "a"}, None)
+    assert rows[1][0] == 2 and rows[1][2].startswith("Invalid JSON")
+
+    rows = await _collect(iter_json_array(_chunked(b'{"subject": "a"}', 5)))
+    assert rows == [(1, None, "Invalid JSON: expected an array")]
+
+
+@pytest.mark.asyncio
+async def test_iter_ndjson_reports_malformed_lines_and_continues():
+    data = "\n".join([json.dumps(TICKETS[0]), "{not json", "", json.dumps(TICKETS[1])]).encode()
+    rows = await _collect(iter_ndjson(_chunked(data, 3)))
+    assert rows[0] == (1, TICKETS[0], None)
+    assert rows[1][0] == 2 and rows[1][2].startswith("Invalid JSON")
+    assert rows[2] == (3, TICKETS[1], None)
+
+
+@pytest.mark.asyncio
+async def test_ingest_tickets_inserts_valid_rows_in_chunks():
+    async def rows():
+        yield 1, TICKETS[0], None
+        yield 2, {"subject": "Missing body", "customer_email": "not-an-email"}, None
+        yield 3, TICKETS[1], None
+        yield 4, None, "Invalid JSON: Expecting value"
+        yield 5, TICKETS[2], None
+
+    async def fake_bulk_create(db, tickets):
+        return [uuid.uuid4() for _ in tickets]
+
+    with patch('app.ingest.bulk_create_tickets', AsyncMock(side_effect=fake_bulk_create)) as mock_bulk_create:
+        ticket_ids, errors = await ingest_tickets(None, rows(), chunk_size=2)
+    assert len(ticket_ids) == 3
+    assert [len(call.args[1]) for call in mock_bulk_create.call_args_list] == [2, 1]
+    assert [error.row for error in errors] == [2, 4]
+    assert "body" in errors[0].detail and "customer_email" in errors[0].detail
+
+
+@pytest.mark.asyncio
+async def test_ingest_tickets_reports_the_rows_of_a_failed_chunk():
+    async def rows():
+        yield 1, TICKETS[0], None
+        yield 2, TICKETS[1], None
+        yield 3, {**TICKETS[2], "subject": "x" * 256}, None
+        yield 4, TICKETS[2], None
+
+    stored = [uuid.uuid4(), uuid.uuid4()]
+    mock_bulk_create = AsyncMock(side_effect=[stored, HTTPException(status_code=400, detail="duplicate key")])
+    with patch('app.ingest.bulk_create_tickets', mock_bulk_create):
+        ticket_ids, errors = await ingest_tickets(None, rows(), chunk_size=2)
+    # The first chunk is committed and its ids are still returned
+    assert ticket_ids == stored
+    assert [error.row for error in errors] == [3, 4]
+    assert "subject" in errors[0].detail
+    assert errors[1].detail == "Not stored: duplicate key"
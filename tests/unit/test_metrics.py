@@ -0,0 +1,154 @@
+import asyncio
+import socket
+from unittest.mock import patch
+
+import pytest
+
+from app import metrics
+from app.config import Config
+from app.decorators import instrumented, instrumented_stream
+from app.metrics import Counter, Gauge, Histogram, Registry, record_tokens
+
+
+def test_render_counters_and_gauges():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests.", ("method",), registry=registry)
+    in_flight = Gauge("in_flight", "In flight.", registry=registry)
+    requests.labels("GET").inc()
+    requests.labels("GET").inc(2)
+    requests.labels('a"b').inc(0.5)
+    in_flight.labels().inc()
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GET"} 3\n'
+        'requests_total{method="a\\"b"} 0.5\n'
+        "# HELP in_flight In flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 1\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.labels("response").observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="response",le="0.1"} 2',
+        'latency_seconds_bucket{stage="response",le="1"} 3',
+        'latency_seconds_bucket{stage="response",le="+Inf"} 4',
+        'latency_seconds_sum{stage="response"} 3.65',
+        'latency_seconds_count{stage="response"} 4',
+    ]
+
+
+def test_labels_must_match_label_names():
+    counter = Counter("labelled_total", "Labelled.", ("a", "b"), registry=Registry())
+    with pytest.raises(ValueError):
+        counter.labels("x")
+
+
+def test_failing_collector_does_not_break_render():
+    registry = Registry()
+    Gauge("depth", "Depth.", registry=registry).labels().set(4)
+
+    def broken():
+        raise ConnectionError("redis is down")
+
+    registry.add_collector(broken)
+    assert "depth 4" in registry.render()
+
+
+def test_record_tokens_counts_tokens_and_cost():
+    with patch.object(metrics, '_prices', None), \
+         patch.object(Config, 'MODEL_PRICES', 'priced-model=2:10'):
+        record_tokens("openai", "priced-model", 1000, 100)
+        record_tokens("openai", "unpriced-model", 10, None)
+
+    assert metrics.ai_tokens.labels("openai", "priced-model", "output").value >= 100
+    assert metrics.ai_cost.labels("openai", "priced-model").value >= 0.003
+    assert ("openai", "unpriced-model") not in metrics.ai_cost._children
+
+
+class FakeModel:
+    provider = "fake"
+    model = "fake-model"
+
+    @instrumented
+    async def get_completion(self, system_prompt, user_prompt, max_tokens):
+        if user_prompt == "fail":
+            raise RuntimeError("provider error")
+        return "completion"
+
+
+@pytest.mark.asyncio
+async def test_instrumented_times_calls_by_stage_and_skips_payload_logging():
+    async def call(stage, user_prompt):
+        metrics.set_stage(stage)
+        return await FakeModel().get_completion("System", user_prompt, 10)
+
+    with patch('app.decorators.logger') as mock_logger:
+        assert await asyncio.ensure_future(call("triage", "User")) == "completion"
+        with pytest.raises(RuntimeError):
+            await asyncio.ensure_future(call("response", "fail"))
+        mock_logger.info.assert_not_called()
+
+    assert metrics.ai_request_duration.labels("fake", "fake-model", "triage", "ok").counts[-1] == 0
+    assert sum(metrics.ai_request_duration.labels("fake", "fake-model", "triage", "ok").counts) == 1
+    assert sum(metrics.ai_request_duration.labels("fake", "fake-model", "response", "error").counts) == 1
+    assert metrics.ai_requests_in_flight.labels("fake").value == 0
+
+
+@pytest.mark.asyncio
+async def test_instrumented_logs_sampled_payloads():
+    with patch.object(Config, 'PAYLOAD_LOG_SAMPLE_RATE', 1.0), patch('app.decorators.logger') as mock_logger:
+        await FakeModel().get_completion("System", "User", 10)
+    assert "completion" in mock_logger.info.call_args.args[0]
+
+
+class FakeStreamingModel:
+    provider = "fake-stream"
+    model = "fake-model"
+
+    @instrumented_stream
+    async def stream_completion(self, system_prompt, user_prompt, max_tokens):
+        for delta in ("com", "ple", "tion"):
+            yield delta
+
+
+@pytest.mark.asyncio
+async def test_instrumented_stream_times_until_the_stream_is_exhausted_or_closed():
+    metrics.set_stage("response")
+    with patch.object(Config, 'PAYLOAD_LOG_SAMPLE_RATE', 1.0), patch('app.decorators.logger') as mock_logger:
+        stream = FakeStreamingModel().stream_completion("System", "User", 10)
+        assert [delta async for delta in stream] == ["com", "ple", "tion"]
+    assert "completion" in mock_logger.info.call_args.args[0]
+
+    stream = FakeStreamingModel().stream_completion("System", "User", 10)
+    assert await stream.__anext__() == "com"
+    assert metrics.ai_requests_in_flight.labels("fake-stream").value == 1
+    await stream.aclose()
+
+    assert sum(metrics.ai_request_duration.labels("fake-stream", "fake-model", "response", "ok").counts) == 1
+    assert sum(metrics.ai_request_duration.labels("fake-stream", "fake-model", "response", "error").counts) == 1
+    assert metrics.ai_requests_in_flight.labels("fake-stream").value == 0
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_the_registry():
+    server = await metrics.start_metrics_server(0)
+    # Each listening socket gets its own port, connect over IPv4
+    port = next(sock.getsockname()[1] for sock in server.sockets if sock.family == socket.AF_INET)
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        server.close()
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE ai_request_duration_seconds histogram" in response
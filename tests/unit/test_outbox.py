@@ -0,0 +1,82 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.outbox import OutboxRelay, relay_outbox
+
+
+def _session(entries):
+    db = MagicMock()
+    db.commit = AsyncMock()
+    db.rollback = AsyncMock()
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+    return db, patch('app.outbox.AsyncSessionLocal', return_value=session), \
+        patch('app.outbox.claim_outbox_entries', AsyncMock(return_value=entries))
+
+
+@pytest.mark.asyncio
+async def test_relay_outbox_commits_after_enqueueing():
+    created_at = datetime(2024, 7, 10, 12, 30, tzinfo=timezone.utc)
+    entries = [(uuid.uuid4(), created_at), (uuid.uuid4(), created_at)]
+    db, session_patch, claim_patch = _session(entries)
+    with session_patch, claim_patch, patch('app.outbox.enqueue_tickets_async', new_callable=AsyncMock) as mock_enqueue:
+        assert await relay_outbox(10) == 2
+    mock_enqueue.assert_awaited_once_with([ticket_id for ticket_id, _ in entries], [created_at.timestamp()] * 2)
+    db.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_relay_outbox_keeps_entries_when_enqueueing_fails():
+    db, session_patch, claim_patch = _session([(uuid.uuid4(), datetime.now(timezone.utc))])
+    with session_patch, claim_patch, \
+         patch('app.outbox.enqueue_tickets_async', AsyncMock(side_effect=ConnectionError("Redis is down"))):
+        with pytest.raises(ConnectionError):
+            await relay_outbox(10)
+    db.rollback.assert_awaited_once()
+    db.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_relay_outbox_does_nothing_when_empty():
+    db, session_patch, claim_patch = _session([])
+    with session_patch, claim_patch, patch('app.outbox.enqueue_tickets_async', new_callable=AsyncMock) as mock_enqueue:
+        assert await relay_outbox(10) == 0
+    mock_enqueue.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_relay_drains_full_batches_and_wakes_up_on_notify():
+    relay = OutboxRelay(batch_size=2, poll_interval=60)
+    # Two full batches are relayed back to back, then the relay waits until it is notified
+    batches = [2, 2, 1, 1]
+    with patch('app.outbox.relay_outbox', AsyncMock(side_effect=lambda limit: batches.pop(0))) as mock_relay:
+        task = asyncio.ensure_future(relay.run())
+        await asyncio.sleep(0.01)
+        assert mock_relay.await_count == 3
+        relay.notify()
+        await asyncio.sleep(0.01)
+        assert mock_relay.await_count == 4
+        relay.stop()
+        await asyncio.wait_for(task, 1)
+
+
+@pytest.mark.asyncio
+async def test_relay_survives_failures():
+    relay = OutboxRelay(batch_size=10, poll_interval=0.01)
+    calls = []
+
+    async def flaky(limit):
+        calls.append(limit)
+        if len(calls) == 1:
+            raise ConnectionError("Database is down")
+        relay.stop()
+        return 0
+
+    with patch('app.outbox.relay_outbox', flaky):
+        await asyncio.wait_for(relay.run(), 1)
+    assert len(calls) == 2
@@ -1,3 +1,5 @@
+import asyncio
+import time
 import uuid
 from unittest.mock import AsyncMock, patch, MagicMock
 
@@ -5,9 +7,20 @@ import pytest
 import pytest_asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import Config
 from app.database import AsyncSessionLocal
 from app.models import Ticket, TicketStatus
-from app.processing import enqueue_all_unprocessed_tickets, enqueue_single_ticket, process_ticket
+from app.models import TicketCategory as ModelTicketCategory, TicketPriority as ModelTicketPriority
+from app.schemas import TicketCategory, TicketPriority
+from app.prompts import record_usage
+from app.processing import (enqueue_all_unprocessed_tickets, enqueue_tickets, enqueue_tickets_async, parse_queue_entry,
+                            process_ticket)
+
+
+@pytest.fixture(autouse=True)
+def mock_create_processing_run():
+    with patch('app.processing.create_processing_run', new_callable=AsyncMock) as mock:
+        yield mock
 
 
 @pytest_asyncio.fixture
@@ -18,7 +31,7 @@ async def db_session():
 
 @pytest.mark.asyncio
 async def test_enqueue_all_unprocessed_tickets_no_tickets(db_session: AsyncSession):
-    with patch('app.processing.get_all_unprocessed_tickets', AsyncMock(return_value=[])):
+    with patch('app.processing.claim_unprocessed_tickets', AsyncMock(return_value=[])):
         job_id, ticket_count = await enqueue_all_unprocessed_tickets(db_session)
         assert job_id is None
         assert ticket_count == 0
@@ -26,35 +39,81 @@ async def test_enqueue_all_unprocessed_tickets_no_tickets(db_session: AsyncSessi
 
 @pytest.mark.asyncio
 async def test_enqueue_all_unprocessed_tickets_with_tickets(db_session: AsyncSession):
-    mock_tickets = [
-        Ticket(
-            id=uuid.uuid4(),
-            subject="Test Subject 1",
-            body="Test Body 1",
-            customer_email="test1@example.com",
-            status=TicketStatus.submitted
-        ),
-        Ticket(
-            id=uuid.uuid4(),
-            subject="Test Subject 2",
-            body="Test Body 2",
-            customer_email="test2@example.com",
-            status=TicketStatus.submitted
-        )
-    ]
-    with patch('app.processing.get_all_unprocessed_tickets', AsyncMock(return_value=mock_tickets)), \
+    chunks = [[uuid.uuid4(), uuid.uuid4()], [uuid.uuid4()], []]
+    with patch('app.processing.claim_unprocessed_tickets', AsyncMock(side_effect=chunks)), \
          patch('app.processing.queue', MagicMock()) as mock_queue:
+        mock_queue.enqueue_many.side_effect = lambda job_datas: [MagicMock(id=f"job-{i}") for i, _ in enumerate(job_datas)]
         job_id, ticket_count = await enqueue_all_unprocessed_tickets(db_session)
-        assert ticket_count == len(mock_tickets)
-        assert mock_queue.enqueue.call_count == len(mock_tickets)
+        assert job_id == "job-0"
+        assert ticket_count == 3
+        assert mock_queue.enqueue_many.call_count == 2
+        mock_queue.enqueue.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_enqueue_single_ticket():
-    ticket_id = str(uuid.uuid4())
-    with patch('app.processing.queue.enqueue', new_callable=MagicMock) as mock_enqueue:
-        enqueue_single_ticket(ticket_id)
-        mock_enqueue.assert_called_once_with('app.processing.process_ticket', ticket_id)
+async def test_enqueue_all_unprocessed_tickets_rolls_back_claim_when_enqueue_fails(db_session: AsyncSession):
+    with patch('app.processing.claim_unprocessed_tickets', AsyncMock(return_value=[uuid.uuid4()])), \
+         patch('app.processing.queue', MagicMock()) as mock_queue, \
+         patch.object(db_session, 'rollback', new_callable=AsyncMock) as mock_rollback, \
+         patch.object(db_session, 'commit', new_callable=AsyncMock) as mock_commit:
+        mock_queue.enqueue_many.side_effect = ConnectionError("Redis is unavailable")
+        with pytest.raises(ConnectionError):
+            await enqueue_all_unprocessed_tickets(db_session)
+        mock_rollback.assert_awaited_once()
+        mock_commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_all_unprocessed_tickets_only_uses_the_async_redis_client(db_session: AsyncSession):
+    ticket_ids = [uuid.uuid4(), uuid.uuid4()]
+    redis = MagicMock()
+    redis.rpush = AsyncMock()
+    redis.hincrby = AsyncMock()
+    with patch.object(Config, 'QUEUE_BACKEND', 'async'), \
+         patch('app.processing.claim_unprocessed_tickets', AsyncMock(side_effect=[ticket_ids, []])), \
+         patch('app.processing.get_async_redis', return_value=redis), \
+         patch('app.processing.redis_conn', MagicMock()) as mock_sync_redis:
+        job_id, ticket_count = await enqueue_all_unprocessed_tickets(db_session, run_id="run-1")
+    assert (job_id, ticket_count) == (str(ticket_ids[0]), 2)
+    redis.rpush.assert_awaited_once()
+    redis.hincrby.assert_awaited_once_with("processing_run:run-1", "enqueued", 2)
+    assert not mock_sync_redis.method_calls
+
+
+def test_enqueue_tickets_async_backend_pushes_ids_in_one_call():
+    ticket_ids = [uuid.uuid4(), uuid.uuid4()]
+    with patch.object(Config, 'QUEUE_BACKEND', 'async'), \
+         patch('app.processing.redis_conn', MagicMock()) as mock_redis:
+        assert enqueue_tickets(ticket_ids) == [str(ticket_id) for ticket_id in ticket_ids]
+        (key, *entries), _ = mock_redis.rpush.call_args
+        assert key == Config.TICKET_QUEUE_KEY
+        assert [parse_queue_entry(entry)[0] for entry in entries] == [str(ticket_id) for ticket_id in ticket_ids]
+        assert all(parse_queue_entry(entry)[1] > 0 for entry in entries)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_tickets_async_uses_the_async_client_and_given_times():
+    ticket_ids = [uuid.uuid4(), uuid.uuid4()]
+    redis = MagicMock()
+    redis.rpush = AsyncMock()
+    with patch.object(Config, 'QUEUE_BACKEND', 'async'), \
+         patch('app.processing.get_async_redis', return_value=redis), \
+         patch('app.processing.redis_conn', MagicMock()) as mock_sync_redis:
+        await enqueue_tickets_async(ticket_ids, [1700000000.0, 1700000001.5])
+    (key, *entries), _ = redis.rpush.call_args
+    assert key == Config.TICKET_QUEUE_KEY
+    assert [parse_queue_entry(entry) for entry in entries] == [(str(ticket_ids[0]), 1700000000.0),
+                                                               (str(ticket_ids[1]), 1700000001.5)]
+    mock_sync_redis.rpush.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_tickets_async_creates_rq_jobs_in_a_thread():
+    ticket_ids = [uuid.uuid4()]
+    with patch.object(Config, 'QUEUE_BACKEND', 'rq'), \
+         patch('app.processing.enqueue_tickets', MagicMock()) as mock_enqueue_tickets:
+        await enqueue_tickets_async(ticket_ids)
+    mock_enqueue_tickets.assert_called_once_with(ticket_ids)
 
 
 @pytest.mark.asyncio
@@ -68,3 +127,280 @@ async def test_process_ticket(db_session: AsyncSession):
          patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
         await process_ticket(ticket_id)
         mock_update_ticket.assert_called_once()
+        assert mock_update_ticket.call_args.args[2].labels_source == "ai"
+
+
+def _delayed(value, delay=0.2):
+    async def stage(*args, **kwargs):
+        await asyncio.sleep(delay)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    return AsyncMock(side_effect=stage)
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_runs_stages_concurrently():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    with patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', _delayed(("technical_problem", 0.95))), \
+         patch('app.processing.prioritize_ticket', _delayed(("high", 0.95))), \
+         patch('app.processing.generate_response', _delayed("Test response")), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        started = time.monotonic()
+        await process_ticket(ticket_id)
+        assert time.monotonic() - started < 0.4
+        mock_update_ticket.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_fail_policy_cancels_remaining_stages():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    response_stage = _delayed("Test response", delay=5)
+    with patch.object(Config, 'PARTIAL_FAILURE_POLICY', 'fail'), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', _delayed(ValueError("Invalid category"), delay=0)), \
+         patch('app.processing.prioritize_ticket', _delayed(("high", 0.95))), \
+         patch('app.processing.generate_response', response_stage), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        started = time.monotonic()
+        with pytest.raises(ValueError):
+            await process_ticket(ticket_id)
+        assert time.monotonic() - started < 1
+        mock_update_ticket.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_partial_policy_keeps_successful_stages():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    with patch.object(Config, 'PARTIAL_FAILURE_POLICY', 'partial'), \
+         patch.object(Config, 'RESPONSE_TIMEOUT', 0.05), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', _delayed(("technical_problem", 0.95), delay=0)), \
+         patch('app.processing.prioritize_ticket', _delayed(("high", 0.9), delay=0)), \
+         patch('app.processing.generate_response', _delayed("Test response", delay=1)), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(ticket_id)
+        updates = mock_update_ticket.call_args.args[2]
+        assert updates.category.value == "technical_problem"
+        assert updates.priority.value == "high"
+        assert updates.initial_response is None
+        # Left for the next processing run to retry the failed stage
+        assert updates.status.value == "submitted"
+        assert updates.failed_stages == ["response"]
+        assert updates.processed_at is None
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_retry_only_runs_failed_stages():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted,
+                         category=ModelTicketCategory.technical_problem, category_confidence=0.95,
+                         priority=ModelTicketPriority.high, priority_confidence=0.9,
+                         failed_stages=["response"], labels_source="local", input_tokens=100, output_tokens=20)
+
+    async def respond(model, subject, body, on_delta=None, category=None):
+        record_usage(50, 10)
+        assert category == "technical_problem"
+        return "Test response"
+
+    with patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', new_callable=AsyncMock) as mock_categorize, \
+         patch('app.processing.prioritize_ticket', new_callable=AsyncMock) as mock_prioritize, \
+         patch('app.processing.generate_response', respond), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(ticket_id)
+    mock_categorize.assert_not_called()
+    mock_prioritize.assert_not_called()
+    updates = mock_update_ticket.call_args.args[2]
+    assert updates.status.value == "processed"
+    assert updates.category.value == "technical_problem"
+    assert updates.initial_response == "Test response"
+    assert updates.failed_stages is None
+    assert updates.labels_source == "local"
+    assert (updates.input_tokens, updates.output_tokens) == (150, 30)
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_combined_triage_mode():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    with patch.object(Config, 'TRIAGE_MODE', 'combined'), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.triage_ticket', AsyncMock(return_value=("technical_problem", 0.95, "high", 0.9))), \
+         patch('app.processing.categorize_ticket', new_callable=AsyncMock) as mock_categorize, \
+         patch('app.processing.prioritize_ticket', new_callable=AsyncMock) as mock_prioritize, \
+         patch('app.processing.generate_response', AsyncMock(return_value="Test response")), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(ticket_id)
+        mock_categorize.assert_not_called()
+        mock_prioritize.assert_not_called()
+        updates = mock_update_ticket.call_args.args[2]
+        assert updates.category.value == "technical_problem"
+        assert updates.priority_confidence == 0.9
+        assert updates.initial_response == "Test response"
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_streams_response():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+
+    async def fake_generate_response(model, subject, body, on_delta):
+        await on_delta("Test ")
+        await on_delta("response")
+        return "Test response"
+
+    with patch.object(Config, 'STREAM_RESPONSES', True), \
+         patch('app.processing.ResponseStream') as mock_response_stream, \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', AsyncMock(return_value=("technical_problem", 0.95))), \
+         patch('app.processing.prioritize_ticket', AsyncMock(return_value=("high", 0.95))), \
+         patch('app.processing.generate_response', fake_generate_response), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        stream = mock_response_stream.return_value
+        stream.publish = AsyncMock()
+        stream.close = AsyncMock()
+        await process_ticket(ticket_id)
+        assert [call.args[0] for call in stream.publish.call_args_list] == ["Test ", "response"]
+        stream.close.assert_awaited_once_with(error=False)
+        assert mock_update_ticket.call_args.args[2].initial_response == "Test response"
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_skips_confident_local_predictions():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    classifier = MagicMock()
+    classifier.predict_batch.return_value = [(TicketCategory.payment_issue, 0.97, TicketPriority.low, 0.6)]
+    with patch.object(Config, 'CLASSIFIER_THRESHOLD', 0.9), \
+         patch('app.processing.get_classifier', return_value=classifier), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', new_callable=AsyncMock) as mock_categorize, \
+         patch('app.processing.prioritize_ticket', AsyncMock(return_value=("high", 0.95))), \
+         patch('app.processing.generate_response', AsyncMock(return_value="Test response")), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(ticket_id)
+        mock_categorize.assert_not_called()
+        updates = mock_update_ticket.call_args.args[2]
+        assert updates.category == TicketCategory.payment_issue
+        assert updates.category_confidence == 0.97
+        assert updates.priority.value == "high"
+        # Partly local labels are kept out of the classifier's training data
+        assert updates.labels_source == "local"
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_reuses_near_duplicate():
+    ticket_id = uuid.uuid4()
+    source_id = uuid.uuid4()
+    mock_ticket = Ticket(id=ticket_id, subject="Can't log in", body="Login fails", status=TicketStatus.submitted)
+    source = Ticket(id=source_id, subject="Can't log in", body="Login fails!", status=TicketStatus.processed,
+                    category=ModelTicketCategory.account_access, category_confidence=0.9,
+                    priority=ModelTicketPriority.high, priority_confidence=0.8, initial_response="Try resetting")
+    index = MagicMock()
+    index.find = AsyncMock(return_value=(str(source_id), 0.93))
+    db = MagicMock()
+    db.get = AsyncMock(return_value=source)
+    db.commit = AsyncMock()
+    session = MagicMock()
+    session.return_value.__aenter__.return_value = db
+    with patch.object(Config, 'DEDUP_ENABLED', True), \
+         patch('app.processing.AsyncSessionLocal', session), \
+         patch('app.processing.get_duplicate_index', return_value=index), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.generate_response', new_callable=AsyncMock) as mock_generate, \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(str(ticket_id))
+        mock_generate.assert_not_called()
+        updates = mock_update_ticket.call_args.args[2]
+        assert updates.reused_from_ticket_id == source_id
+        assert updates.labels_source == "reused"
+        assert updates.category == TicketCategory.account_access
+        assert updates.initial_response == "Try resetting"
+        index.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_adds_processed_ticket_to_duplicate_index():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+    index = MagicMock()
+    index.find = AsyncMock(return_value=None)
+    index.add = AsyncMock()
+    with patch.object(Config, 'DEDUP_ENABLED', True), \
+         patch('app.processing.get_duplicate_index', return_value=index), \
+         patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', AsyncMock(return_value=("technical_problem", 0.95))), \
+         patch('app.processing.prioritize_ticket', AsyncMock(return_value=("high", 0.95))), \
+         patch('app.processing.generate_response', AsyncMock(return_value="Test response")), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock):
+        await process_ticket(ticket_id)
+        index.add.assert_awaited_once()
+        assert index.add.call_args.args[0] == ticket_id
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_records_token_usage():
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+
+    def completion(result, input_tokens, output_tokens):
+        async def stage(*args, **kwargs):
+            record_usage(input_tokens, output_tokens)
+            return result
+        return stage
+
+    with patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', completion(("technical_problem", 0.95), 100, 10)), \
+         patch('app.processing.prioritize_ticket', completion(("high", 0.95), 100, 10)), \
+         patch('app.processing.generate_response', completion("Test response", 200, 300)), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock) as mock_update_ticket:
+        await process_ticket(ticket_id)
+        updates = mock_update_ticket.call_args.args[2]
+        assert (updates.input_tokens, updates.output_tokens) == (400, 320)
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_records_stage_timings(mock_create_processing_run):
+    ticket_id = str(uuid.uuid4())
+    mock_ticket = Ticket(id=ticket_id, subject="Test", body="Test body", status=TicketStatus.submitted)
+
+    async def categorize(model, subject, body):
+        record_usage(100, 10, "openai", "gpt-test")
+        return "technical_problem", 0.95
+
+    with patch('app.processing.get_ticket_by_id', AsyncMock(return_value=mock_ticket)), \
+         patch('app.processing.categorize_ticket', categorize), \
+         patch('app.processing.prioritize_ticket', AsyncMock(side_effect=ValueError("Invalid priority"))), \
+         patch('app.processing.generate_response', AsyncMock(return_value="Test response")), \
+         patch('app.processing.update_ticket', new_callable=AsyncMock), \
+         patch.object(Config, 'PARTIAL_FAILURE_POLICY', 'partial'):
+        await process_ticket(ticket_id, enqueued_at=time.time() - 5)
+
+    run = mock_create_processing_run.call_args.args[1]
+    assert str(run['ticket_id']) == ticket_id
+    assert run['outcome'] == 'partial'
+    assert (run['started_at'] - run['enqueued_at']).total_seconds() >= 5
+    assert set(run['stages']) == {'load', 'categorize', 'prioritize', 'response', 'update'}
+    categorize_timing = run['stages']['categorize']
+    assert categorize_timing['ok'] and categorize_timing['end'] >= categorize_timing['start']
+    assert (categorize_timing['provider'], categorize_timing['model']) == ("openai", "gpt-test")
+    assert (categorize_timing['input_tokens'], categorize_timing['output_tokens']) == (100, 10)
+    assert run['stages']['prioritize']['ok'] is False
+    assert run['duration_ms'] >= run['stages']['update']['end']
+
+
+@pytest.mark.asyncio
+async def test_process_ticket_records_failed_attempts(mock_create_processing_run):
+    ticket_id = str(uuid.uuid4())
+    with patch('app.processing.get_ticket_by_id', AsyncMock(side_effect=ConnectionError("database is down"))):
+        with pytest.raises(ConnectionError):
+            await process_ticket(ticket_id)
+    run = mock_create_processing_run.call_args.args[1]
+    assert run['outcome'] == 'failed'
+    assert run['enqueued_at'] is None
+    assert run['stages']['load']['ok'] is False
@@ -0,0 +1,99 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from app import prompts
+from app.config import Config
+from app.prompts import (count_tokens, fit_body, max_tokens_for, record_usage, strip_quotes_and_signature,
+                         track_usage, truncate)
+from app.schemas import TicketCategory
+
+
+@pytest.fixture(autouse=True)
+def heuristic_token_counts():
+    # Keep counts deterministic whether or not tiktoken is installed
+    with patch.object(prompts, '_encoding', False):
+        yield
+
+
+def test_count_tokens_estimates_words_and_long_strings():
+    assert count_tokens("Cannot log in, help!") == 6
+    assert count_tokens("x" * 400) == 100
+
+
+def test_strip_quotes_and_signature():
+    body = (
+        "My invoice is wrong.\n"
+        "> previous reply\n"
+        "Please fix it.\n"
+        "\n"
+        "--\n"
+        "Jane Doe\n"
+        "ACME Corp\n"
+    )
+    assert strip_quotes_and_signature(body) == "My invoice is wrong.\nPlease fix it."
+
+    thread = "Still broken.\n\nOn Mon, 1 Jan 2024 at 10:00, Support <support@example.com> wrote:\nHave you tried..."
+    assert strip_quotes_and_signature(thread) == "Still broken."
+
+    outlook = "See below\nFrom: Support\nSent: Monday\nSubject: Re: login"
+    assert strip_quotes_and_signature(outlook) == "See below"
+
+    assert strip_quotes_and_signature("> only a quote") == "> only a quote"
+
+
+def test_truncate_keeps_head_and_tail_within_budget():
+    text = " ".join(f"line{i}" for i in range(1000))
+    truncated = truncate(text, 90)
+    assert truncated.startswith("line0 line1")
+    assert truncated.endswith("line999")
+    assert "tokens omitted" in truncated
+    assert count_tokens(truncated) < 120
+    assert truncate("short text", 90) == "short text"
+
+
+def test_fit_body_uses_task_budget():
+    with patch.object(Config, 'TRIAGE_PROMPT_TOKEN_BUDGET', 10):
+        assert "omitted" in fit_body("word " * 100, 'triage')
+
+
+def test_max_tokens_by_task_and_category():
+    with patch.object(prompts, '_response_limits', None), \
+         patch.object(Config, 'RESPONSE_MAX_TOKENS', 1000), \
+         patch.object(Config, 'RESPONSE_MAX_TOKENS_BY_CATEGORY', 'feature_request=300, other=500'):
+        assert max_tokens_for('triage') == 100
+        assert max_tokens_for('response') == 1000
+        assert max_tokens_for('response', TicketCategory.feature_request) == 300
+        assert max_tokens_for('response', TicketCategory.payment_issue) == 1000
+
+
+@pytest.mark.asyncio
+async def test_usage_adds_up_across_tasks():
+    async def call(input_tokens, output_tokens):
+        record_usage(input_tokens, output_tokens)
+
+    async def ticket():
+        usage = track_usage()
+        await asyncio.gather(call(10, 5), call(20, None))
+        return usage
+
+    first, second = await asyncio.gather(ticket(), ticket())
+    assert (first.input_tokens, first.output_tokens) == (30, 5)
+    assert (second.input_tokens, second.output_tokens) == (30, 5)
+    # Nothing is tracked outside a ticket
+    record_usage(1, 1)
+
+
+@pytest.mark.asyncio
+async def test_nested_usage_adds_to_the_ticket():
+    async def stage(input_tokens):
+        usage = track_usage(nested=True)
+        record_usage(input_tokens, 1, "anthropic", "claude-test")
+        return usage
+
+    ticket = track_usage()
+    first, second = await asyncio.gather(stage(10), stage(20))
+    assert (first.input_tokens, second.input_tokens) == (10, 20)
+    assert (first.provider, first.model) == ("anthropic", "claude-test")
+    assert (ticket.input_tokens, ticket.output_tokens) == (30, 2)
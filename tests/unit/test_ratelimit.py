@@ -0,0 +1,76 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import openai
+import pytest
+
+from app.ratelimit import MemoryBucketStore, RateLimiter, estimate_tokens
+
+
+def _rate_limit_error(headers):
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_estimate_tokens_counts_prompt_and_max_tokens():
+    assert estimate_tokens("a" * 40, "b" * 400, 100) == 211
+
+
+@pytest.mark.asyncio
+async def test_bucket_goes_into_debt_and_reports_wait():
+    store = MemoryBucketStore()
+    assert await store.take("key", capacity=10, rate=2, amount=10) == 0
+    wait = await store.take("key", capacity=10, rate=2, amount=4)
+    assert 1.9 < wait <= 2
+    assert await store.take("key", capacity=10, rate=2, amount=0, ceiling=-10) == pytest.approx(5, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_run_backs_off_multiplicatively_on_429():
+    limiter = RateLimiter("openai", rpm=600, tpm=60000, store=MemoryBucketStore())
+    response = MagicMock(headers={})
+    call = AsyncMock(side_effect=[_rate_limit_error({"retry-after-ms": "20"}), response])
+    with patch('app.ratelimit.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+        assert await limiter.run(call, tokens=100) is response
+    assert call.await_count == 2
+    assert limiter.factor == pytest.approx(0.55)
+    # The retry waited out the retry-after pause
+    assert mock_sleep.await_args.args[0] >= 0.02
+
+
+@pytest.mark.asyncio
+async def test_run_does_not_retry_client_errors():
+    limiter = RateLimiter("openai", rpm=600, tpm=60000, store=MemoryBucketStore())
+    call = AsyncMock(side_effect=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        await limiter.run(call, tokens=100)
+    call.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_run_gives_up_after_max_retries():
+    limiter = RateLimiter("openai", rpm=600, tpm=60000, store=MemoryBucketStore(), max_retries=2)
+    call = AsyncMock(side_effect=_rate_limit_error({"retry-after": "0"}))
+    with patch('app.ratelimit.asyncio.sleep', new_callable=AsyncMock):
+        with pytest.raises(openai.RateLimitError):
+            await limiter.run(call, tokens=100)
+    assert call.await_count == 3
+    assert limiter.factor == pytest.approx(0.25)
+
+
+@pytest.mark.asyncio
+async def test_response_headers_update_limits_and_remaining_quota():
+    store = MemoryBucketStore()
+    limiter = RateLimiter("anthropic", rpm=50, tpm=40000, store=store)
+    limiter.factor = 0.5
+    await limiter.on_response({
+        "anthropic-ratelimit-requests-limit": "1000",
+        "anthropic-ratelimit-requests-remaining": "1",
+        "anthropic-ratelimit-tokens-limit": "80000",
+        "anthropic-ratelimit-tokens-remaining": "50000",
+    })
+    assert (limiter.rpm, limiter.tpm) == (1000, 80000)
+    assert limiter.factor == pytest.approx(0.55)
+    # Only one request is left according to the provider, so the second one has to wait
+    assert await store.take("ratelimit:anthropic:requests", 100, 1, 1) == 0
+    assert await store.take("ratelimit:anthropic:requests", 100, 1, 1) > 0
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app import registry
+from app.config import Config
+from app.routing import RoutingModel
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    with patch.object(registry, '_models', {}), patch.object(registry, '_task_models', {}):
+        yield
+
+
+def test_models_are_created_once_on_first_use():
+    fake_model = MagicMock()
+    with patch.dict(registry.PROVIDERS, {"openai": fake_model}):
+        assert registry.get_model("openai", "gpt-4o") is registry.get_model("openai", "gpt-4o")
+    fake_model.assert_called_once_with("gpt-4o")
+
+
+def test_task_model_follows_configuration():
+    with patch.object(Config, 'ROUTING_ENABLED', True), \
+         patch.object(Config, 'RESPONSE_PROVIDER', 'openai'), \
+         patch.object(Config, 'RESPONSE_MODEL', 'gpt-4o'), \
+         patch.object(Config, 'RESPONSE_FALLBACK_PROVIDER', 'anthropic'):
+        model = registry.get_task_model('response')
+        assert isinstance(model, RoutingModel)
+        assert (model.primary.provider, model.primary.model) == ("openai", "gpt-4o")
+        assert model.secondary.provider == "anthropic"
+
+    with patch.object(Config, 'TRIAGE_FALLBACK_PROVIDER', ''):
+        assert registry.get_task_model('triage').provider == Config.TRIAGE_PROVIDER
+
+    with pytest.raises(ValueError):
+        registry.get_model("mistral", "large")
+
+
+@pytest.mark.asyncio
+async def test_warm_up_logs_failures():
+    fine, failing = MagicMock(provider="openai"), MagicMock(provider="anthropic", model="claude")
+    fine.warm_up = AsyncMock()
+    failing.warm_up = AsyncMock(side_effect=ConnectionError("unreachable"))
+    with patch.object(registry, 'get_task_model'), \
+         patch.object(registry, '_models', {("openai", "gpt"): fine, ("anthropic", "claude"): failing}):
+        await registry.warm_up()
+    fine.warm_up.assert_awaited_once()
+    failing.warm_up.assert_awaited_once()
+
+
+IMPORT_CHECK = """
+from unittest.mock import patch
+with patch('openai.AsyncOpenAI') as openai_client, patch('anthropic.AsyncAnthropic') as anthropic_client:
+    import app.main
+assert not openai_client.called and not anthropic_client.called, 'AI clients were created at import time'
+"""
+
+
+def test_import_app_main_creates_no_clients_and_needs_no_api_keys():
+    env = {key: value for key, value in os.environ.items() if key not in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY')}
+    # A fresh interpreter, since app.main is already imported here
+    subprocess.run([sys.executable, "-c", IMPORT_CHECK], env=env, check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from app.ai import AIModel
+from app.config import Config
+from app.ratelimit import provider_semaphore
+from app.routing import RoutingModel
+
+
+class FakeModel(AIModel):
+    def __init__(self, provider: str, delay: float = 0, error: Exception = None):
+        self.provider = provider
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get_completion(self, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return self.provider
+
+    async def stream_completion(self, system_prompt: str, user_prompt: str, max_tokens: int):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        for chunk in (self.provider, "!"):
+            yield chunk
+
+
+def _warm_up(model: RoutingModel, target: AIModel, kind: str = "completion", latency: float = 0.01, count: int = 5):
+    for _ in range(count):
+        model.stats[target].record(kind, latency, ok=True)
+
+
+@pytest.mark.asyncio
+async def test_uses_primary_without_hedging_while_fast():
+    primary, secondary = FakeModel("openai"), FakeModel("anthropic")
+    model = RoutingModel(primary, secondary, min_samples=5)
+    assert await model.get_completion("System", "User", 10) == "openai"
+    assert secondary.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_hedges_slow_primary_and_cancels_it():
+    primary, secondary = FakeModel("openai", delay=1), FakeModel("anthropic", delay=0.01)
+    model = RoutingModel(primary, secondary, min_samples=5)
+    _warm_up(model, primary)
+    assert await model.get_completion("System", "User", 10) == "anthropic"
+    await asyncio.sleep(0)
+    assert primary.cancelled == 1
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_secondary_when_primary_fails():
+    primary, secondary = FakeModel("openai", error=RuntimeError("down")), FakeModel("anthropic")
+    model = RoutingModel(primary, secondary, min_samples=5)
+    assert await model.get_completion("System", "User", 10) == "anthropic"
+
+    secondary.error = RuntimeError("also down")
+    with pytest.raises(RuntimeError):
+        await model.get_completion("System", "User", 10)
+
+
+@pytest.mark.asyncio
+async def test_fails_over_while_primary_error_rate_is_high():
+    primary, secondary = FakeModel("openai"), FakeModel("anthropic")
+    model = RoutingModel(primary, secondary, error_threshold=0.5, min_samples=5)
+    for _ in range(5):
+        model.stats[primary].record("completion", 0.01, ok=False)
+    assert await model.get_completion("System", "User", 10) == "anthropic"
+    assert primary.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_keeps_separate_stats_for_models_of_the_same_provider():
+    primary, secondary = FakeModel("openai"), FakeModel("openai")
+    model = RoutingModel(primary, secondary, error_threshold=0.5, min_samples=5)
+    for _ in range(5):
+        model.stats[primary].record("completion", 0.01, ok=False)
+    assert model.stats[secondary].error_rate(5) is None
+    await model.get_completion("System", "User", 10)
+    assert (primary.calls, secondary.calls) == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_stream_hedges_first_chunk():
+    primary, secondary = FakeModel("openai", delay=1), FakeModel("anthropic", delay=0.01)
+    model = RoutingModel(primary, secondary, min_samples=5)
+    _warm_up(model, primary, kind="stream")
+    chunks = [chunk async for chunk in model.stream_completion("System", "User", 10)]
+    assert chunks == ["anthropic", "!"]
+
+
+async def _join(stream) -> str:
+    return "".join([chunk async for chunk in stream])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["completion", "stream"])
+async def test_hedged_calls_hold_a_slot_of_the_provider_they_go_to(kind):
+    primary, secondary = FakeModel("openai", delay=1), FakeModel("anthropic", delay=0.05)
+    model = RoutingModel(primary, secondary, min_samples=5)
+    _warm_up(model, primary, kind)
+    with patch.object(Config, 'ANTHROPIC_MAX_CONCURRENCY', 1):
+        if kind == "completion":
+            call = asyncio.ensure_future(model.get_completion("System", "User", 10))
+        else:
+            # A stream keeps its slot until the last chunk
+            call = asyncio.ensure_future(_join(model.stream_completion("System", "User", 10)))
+        await asyncio.sleep(0.03)
+        # The hedge to the secondary provider took its only slot
+        assert provider_semaphore("anthropic").locked()
+        assert await call in ("anthropic", "anthropic!")
+    await asyncio.sleep(0)
+    assert not provider_semaphore("openai").locked() and not provider_semaphore("anthropic").locked()
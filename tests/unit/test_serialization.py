@@ -0,0 +1,30 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.engine.result import result_tuple
+
+from app import serialization
+from app.schemas import TICKET_FIELDS, TicketResponse
+from benchmarks.serialization import make_values
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dump_rows_matches_response_model(use_orjson):
+    if use_orjson and serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    values = make_values(3, seed=1)
+    values[0].update(category=None, priority=None, processed_at=None, initial_response="Ünïcode ✓")
+    row_type = result_tuple(list(TICKET_FIELDS))
+    rows = [row_type(tuple(ticket[field] for field in TICKET_FIELDS)) for ticket in values]
+
+    with patch.object(serialization, 'orjson', serialization.orjson if use_orjson else None):
+        encoded = serialization.dump_rows(rows)
+
+    expected = [json.loads(TicketResponse.model_validate(ticket).model_dump_json()) for ticket in values]
+    assert json.loads(encoded) == expected
+
+
+def test_dumps_rejects_unknown_types():
+    with patch.object(serialization, 'orjson', None), pytest.raises(TypeError):
+        serialization.dumps({"value": object()})
@@ -0,0 +1,40 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.streaming import ResponseStream, read_response_stream
+
+
+@pytest.mark.asyncio
+async def test_response_stream_publishes_deltas_and_done_marker():
+    redis = MagicMock()
+    redis.xadd = AsyncMock()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    redis.pipeline.return_value.__aenter__.return_value = pipe
+    with patch('app.streaming.get_async_redis', return_value=redis):
+        stream = ResponseStream("ticket-1")
+        await stream.publish("Hello")
+        await stream.publish(" there")
+        await stream.close()
+    # The first chunk replaces an earlier attempt's stream and sets its expiry, later ones are appended
+    pipe.delete.assert_called_once_with("ticket:ticket-1:response")
+    redis.xadd.assert_awaited_once_with("ticket:ticket-1:response", {"delta": " there"})
+    assert [call.args[1] for call in pipe.xadd.call_args_list] == [{"delta": "Hello"}, {"done": ""}]
+    assert pipe.expire.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_response_stream_does_not_touch_redis_when_nothing_was_published():
+    with patch('app.streaming.get_async_redis') as mock_get_async_redis:
+        await ResponseStream("ticket-1").close(error=True)
+    mock_get_async_redis.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_read_response_stream_decodes_entries():
+    redis = MagicMock()
+    redis.xread = AsyncMock(return_value=[(b"ticket:ticket-1:response", [(b"1-0", {b"delta": b"Hi"}), (b"2-0", {b"done": b""})])])
+    with patch('app.streaming.get_async_redis', return_value=redis):
+        entries = await read_response_stream("ticket-1", "0")
+    assert entries == [("1-0", {"delta": "Hi"}), ("2-0", {"done": ""})]
@@ -0,0 +1,87 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.ticket_cache import cache_ticket, etag, get_cached_ticket, invalidate_tickets
+
+
+class FakeRedis:
+    """
+    Just enough of redis.asyncio.Redis for the ticket cache, with the fill script reimplemented in Python.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def register_script(self, script):
+        async def fill(keys, args):
+            body, version, _ttl = args
+            if (self.data.get(keys[1]) or b"").decode() == version:
+                self.data[keys[0]] = body
+        return fill
+
+    def pipeline(self, transaction=True):
+        redis = self
+        pipe = MagicMock()
+        pipe.incr.side_effect = lambda key: redis.data.__setitem__(key, str(int(redis.data.get(key, 0)) + 1).encode())
+        pipe.delete.side_effect = lambda key: redis.data.pop(key, None)
+        pipe.execute = AsyncMock()
+        context = MagicMock()
+        context.__aenter__ = AsyncMock(return_value=pipe)
+        context.__aexit__ = AsyncMock(return_value=False)
+        return context
+
+
+@pytest.fixture
+def redis():
+    redis = FakeRedis()
+    with patch('app.ticket_cache.get_async_redis', return_value=redis):
+        yield redis
+
+
+@pytest.mark.asyncio
+async def test_miss_then_hit(redis):
+    body, version = await get_cached_ticket("ticket-1")
+    assert body is None
+    await cache_ticket("ticket-1", b'{"id": "ticket-1"}', version)
+    body, _ = await get_cached_ticket("ticket-1")
+    assert body == b'{"id": "ticket-1"}'
+
+
+@pytest.mark.asyncio
+async def test_invalidation_drops_the_cached_ticket(redis):
+    _, version = await get_cached_ticket("ticket-1")
+    await cache_ticket("ticket-1", b"old", version)
+    await invalidate_tickets(["ticket-1"])
+    body, _ = await get_cached_ticket("ticket-1")
+    assert body is None
+
+
+@pytest.mark.asyncio
+async def test_ticket_loaded_before_an_invalidation_is_not_cached(redis):
+    _, version = await get_cached_ticket("ticket-1")
+    # The ticket is updated while the reader is loading the old version from the database
+    await invalidate_tickets(["ticket-1"])
+    await cache_ticket("ticket-1", b"old", version)
+    body, version = await get_cached_ticket("ticket-1")
+    assert body is None
+    await cache_ticket("ticket-1", b"new", version)
+    assert (await get_cached_ticket("ticket-1"))[0] == b"new"
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_fall_back_to_the_database():
+    redis = MagicMock()
+    redis.mget = AsyncMock(side_effect=ConnectionError("down"))
+    with patch('app.ticket_cache.get_async_redis', return_value=redis):
+        assert await get_cached_ticket("ticket-1") == (None, None)
+        await cache_ticket("ticket-1", b"body", None)
+    redis.register_script.assert_not_called()
+
+
+def test_etag_depends_on_the_body():
+    assert etag(b"a") == etag(b"a") != etag(b"b")
+    assert etag(b"a").startswith('"') and etag(b"a").endswith('"')
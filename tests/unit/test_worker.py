@@ -0,0 +1,143 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.config import Config
+from app.models import TicketStatus
+from app.worker import TicketWorker
+
+
+class FakeRedis:
+    def __init__(self, ticket_ids):
+        self.items = [ticket_id.encode() for ticket_id in ticket_ids]
+        self.failed = []
+        self.attempts = {}
+
+    async def lpop(self, key, count):
+        popped, self.items = self.items[:count], self.items[count:]
+        return popped or None
+
+    async def blpop(self, keys, timeout):
+        await asyncio.sleep(0.01)
+        return None
+
+    async def rpush(self, key, value):
+        if key == Config.TICKET_QUEUE_KEY:
+            self.items.append(value.encode())
+        else:
+            self.failed.append(value)
+
+    async def hincrby(self, key, field, amount):
+        self.attempts[field] = self.attempts.get(field, 0) + amount
+        return self.attempts[field]
+
+    async def hdel(self, key, field):
+        self.attempts.pop(field, None)
+
+
+@pytest.mark.asyncio
+async def test_worker_processes_tickets_concurrently_up_to_the_limit():
+    in_flight = 0
+    max_in_flight = 0
+    processed = []
+
+    async def fake_process_ticket(ticket_id, enqueued_at=None):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        processed.append(ticket_id)
+
+    worker = TicketWorker(FakeRedis([str(i) for i in range(10)]), concurrency=4, batch_size=3, poll_timeout=0)
+    with patch('app.worker.process_ticket', fake_process_ticket):
+        run = asyncio.ensure_future(worker.run())
+        while len(processed) < 10:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await run
+    assert sorted(processed, key=int) == [str(i) for i in range(10)]
+    assert max_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_worker_finishes_in_flight_tickets_on_shutdown():
+    processed = []
+    started = asyncio.Event()
+
+    async def fake_process_ticket(ticket_id, enqueued_at=None):
+        started.set()
+        await asyncio.sleep(0.05)
+        processed.append(ticket_id)
+
+    redis = FakeRedis(["a", "b"])
+    worker = TicketWorker(redis, concurrency=2, batch_size=2, poll_timeout=0)
+    with patch('app.worker.process_ticket', fake_process_ticket):
+        run = asyncio.ensure_future(worker.run())
+        await started.wait()
+        worker.stop()
+        await run
+    assert sorted(processed) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_failed_tickets_then_puts_them_back_to_submitted():
+    attempts = []
+
+    async def failing_process_ticket(ticket_id, enqueued_at=None):
+        attempts.append(ticket_id)
+        raise ValueError("Invalid JSON format received")
+
+    redis = FakeRedis(["a"])
+    worker = TicketWorker(redis, concurrency=2, batch_size=2, poll_timeout=0, max_attempts=3)
+    with patch('app.worker.process_ticket', failing_process_ticket), \
+         patch('app.worker.AsyncSessionLocal', MagicMock()), \
+         patch('app.worker.update_ticket_status', new_callable=AsyncMock) as mock_update_status:
+        run = asyncio.ensure_future(worker.run())
+        while not redis.failed:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await run
+    assert attempts == ["a", "a", "a"]
+    assert redis.failed == ["a"]
+    assert redis.attempts == {}
+    assert mock_update_status.call_args.args[1:] == ("a", TicketStatus.submitted)
+
+
+@pytest.mark.asyncio
+async def test_worker_forgets_the_failed_attempts_of_a_ticket_that_succeeds():
+    attempts = []
+
+    async def flaky_process_ticket(ticket_id, enqueued_at=None):
+        attempts.append(ticket_id)
+        if len(attempts) == 1:
+            raise ValueError("Invalid JSON format received")
+
+    redis = FakeRedis(["a"])
+    worker = TicketWorker(redis, concurrency=2, batch_size=2, poll_timeout=0, max_attempts=3)
+    with patch('app.worker.process_ticket', flaky_process_ticket):
+        run = asyncio.ensure_future(worker.run())
+        while len(attempts) < 2:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await run
+    assert redis.failed == []
+    assert redis.attempts == {}
+
+
+@pytest.mark.asyncio
+async def test_worker_passes_enqueue_time_of_queue_entries():
+    calls = []
+
+    async def fake_process_ticket(ticket_id, enqueued_at=None):
+        calls.append((ticket_id, enqueued_at))
+
+    worker = TicketWorker(FakeRedis(["a|1700000000.5", "b"]), concurrency=2, batch_size=2, poll_timeout=0)
+    with patch('app.worker.process_ticket', fake_process_ticket):
+        run = asyncio.ensure_future(worker.run())
+        while len(calls) < 2:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await run
+    assert sorted(calls, key=lambda call: call[0]) == [("a", 1700000000.5), ("b", None)]